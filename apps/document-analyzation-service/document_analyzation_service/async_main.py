@@ -0,0 +1,199 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+
+"""This module contains an asyncio-based entry point for the document analyzation service. It consumes and publishes on a single asyncio RabbitMQ connection and extracts the document data with the asynchronous Azure client, so that one process can keep many extractions in flight."""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any
+
+from dotenv import load_dotenv
+
+from document_analyzation_service.image_processor import (
+    TransientProcessingError,
+    build_result_event,
+    extract_document_data_async,
+    process_image_async,
+)
+from document_analyzation_service.main import (
+    RABBITMQ_PASSWORD,
+    RABBITMQ_URI,
+    RABBITMQ_USER,
+    RECEIVE_QUEUE_NAME,
+    RETRY_TOPOLOGY,
+    SAVE_ANALYZATION_RESULT_PATTERN,
+    SEND_QUEUE_NAME,
+    build_error_event,
+    load_cached_event,
+    load_document,
+    parse_arguments,
+    parse_message,
+    prepare_document,
+    result_cache_key_for,
+    retry_message,
+    store_result,
+)
+from document_analyzation_service.document_classification.classification import (
+    shutdown_ocr_workers,
+    warmup_ocr_model,
+)
+from document_analyzation_service.message_broker import AsyncRabbitMQConsumer
+from document_analyzation_service.metrics import start_metrics_server
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+ASYNC_MAX_CONCURRENCY = int(os.getenv("ASYNC_MAX_CONCURRENCY", "100"))
+ASYNC_EXECUTOR_WORKERS = int(os.getenv("ASYNC_EXECUTOR_WORKERS", str(os.cpu_count() or 1)))
+
+
+class AsyncDocumentAnalyzationService:
+    """Process image messages concurrently on the event loop.
+
+    The Azure requests are awaited on the loop, bounded by a semaphore, while the CPU-bound
+    steps (JSON parsing, image decoding and re-encoding, doctr OCR) run in an executor.
+    """
+
+    def __init__(
+        self, consumer: AsyncRabbitMQConsumer, max_concurrency: int, executor: Executor
+    ) -> None:
+        """Initialize the service.
+
+        :param consumer: The consumer delivering the messages and publishing the results.
+        :param max_concurrency: Maximum number of messages processed at the same time.
+        :param executor: The executor running the CPU-bound processing steps.
+        """
+        self.consumer = consumer
+        self.executor = executor
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def on_image_received(self, properties: Any, body: bytes) -> None:
+        """Process a received image message and publish the result, see main.on_image_received.
+
+        Args:
+        ----------
+        properties : Any
+            The AMQP properties of the message.
+        body : bytes
+            The body of the message, JSON with UUID and image data or the raw image.
+        """
+        async with self._semaphore:
+            logger.info("Received message from queue '%s'.", RECEIVE_QUEUE_NAME)
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(self.executor, parse_message, properties, body)
+            image_uuid: Any = data.get("uuid")
+            document_type: Any = data.get("document_type")
+
+            try:
+                document = await loop.run_in_executor(self.executor, load_document, data)
+                cache_key = await loop.run_in_executor(
+                    self.executor, result_cache_key_for, data, document
+                )
+                # The result cache IO runs in a thread of its own, so that cache hits neither
+                # block the event loop nor queue behind the OCR in the executor
+                cached_event = await asyncio.to_thread(load_cached_event, cache_key, image_uuid)
+                if cached_event is not None:
+                    logger.info("Image with UUID: %s answered from the result cache.", image_uuid)
+                    self.send_event_to_queue(cached_event)
+                    return
+
+                data_url, document_type, scale_factor = await loop.run_in_executor(
+                    self.executor, prepare_document, data, document
+                )
+                if RETRY_TOPOLOGY is None:
+                    serializable_event = await process_image_async(
+                        data_url,
+                        image_uuid,
+                        SAVE_ANALYZATION_RESULT_PATTERN,
+                        document_type,
+                        scale_factor,
+                    )
+                else:
+                    serializable_event = build_result_event(
+                        await extract_document_data_async(data_url, document_type),
+                        image_uuid,
+                        SAVE_ANALYZATION_RESULT_PATTERN,
+                        document_type,
+                        scale_factor,
+                    )
+                logger.info("Image with UUID: %s processed successfully.", image_uuid)
+                await asyncio.to_thread(store_result, cache_key, serializable_event)
+
+                self.send_event_to_queue(serializable_event)
+            except TransientProcessingError as e:
+                logger.warning(f"Processing of image with UUID {image_uuid} failed: {e}")
+                error_event = retry_message(
+                    properties, body, e, image_uuid, document_type, self.consumer.publish
+                )
+                if error_event is not None:
+                    self.send_event_to_queue(error_event)
+            except Exception as e:
+                logger.error(f"Error processing message: {e}")
+                self.send_event_to_queue(build_error_event(e))
+
+    def send_event_to_queue(self, event: dict[str, Any]) -> None:
+        """Send the processed JSON event to the storage service queue.
+
+        Args:
+        ----------
+        event : dict[str, Any]
+            The event data to be sent to the queue.
+        """
+        self.consumer.publish(SEND_QUEUE_NAME, json.dumps(event))
+        logger.info(f"JSON event sent to queue '{SEND_QUEUE_NAME}'.")
+
+
+async def run_service() -> None:
+    """Consume image messages until SIGINT or SIGTERM is received."""
+    consumer = AsyncRabbitMQConsumer(
+        queue_name=RECEIVE_QUEUE_NAME,
+        uri=str(RABBITMQ_URI),
+        username=str(RABBITMQ_USER),
+        password=str(RABBITMQ_PASSWORD),
+        prefetch_count=ASYNC_MAX_CONCURRENCY,
+        declare_queues=(SEND_QUEUE_NAME,),
+        queue_arguments=(RETRY_TOPOLOGY.queue_arguments() if RETRY_TOPOLOGY else None),
+    )
+    executor = ThreadPoolExecutor(
+        max_workers=ASYNC_EXECUTOR_WORKERS, thread_name_prefix="das-executor"
+    )
+    service = AsyncDocumentAnalyzationService(consumer, ASYNC_MAX_CONCURRENCY, executor)
+
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(
+            signal_number, lambda: asyncio.ensure_future(consumer.stop(), loop=loop)
+        )
+
+    try:
+        logger.info(
+            f"Listening for messages on queue '{RECEIVE_QUEUE_NAME}' "
+            f"with up to {ASYNC_MAX_CONCURRENCY} concurrent messages..."
+        )
+        await consumer.run(service.on_image_received)
+    finally:
+        logger.info("Stopping Document Analyzation Service...")
+        executor.shutdown(wait=True)
+        shutdown_ocr_workers()
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Start the asyncio-based document analyzation service."""
+    arguments = parse_arguments(argv)
+    load_dotenv()
+    if arguments.warmup:
+        warmup_ocr_model()
+    start_metrics_server()
+    asyncio.run(run_service())
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
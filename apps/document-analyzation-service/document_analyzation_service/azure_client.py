@@ -0,0 +1,169 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+
+"""This module provides the Azure OpenAI clients shared by all threads of a process, so that the connections to the Azure API are kept alive between documents."""
+
+import asyncio
+import logging
+import os
+import threading
+from typing import NamedTuple
+
+import httpx
+from openai import AsyncAzureOpenAI, AzureOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+AZURE_MAX_CONNECTIONS = int(os.getenv("AZURE_MAX_CONNECTIONS", "20"))
+AZURE_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("AZURE_MAX_KEEPALIVE_CONNECTIONS", "10"))
+AZURE_KEEPALIVE_EXPIRY = float(os.getenv("AZURE_KEEPALIVE_EXPIRY", "30"))
+AZURE_CONNECT_TIMEOUT = float(os.getenv("AZURE_CONNECT_TIMEOUT", "10"))
+# The extraction of a large document can take a while, so the read timeout is generous
+AZURE_READ_TIMEOUT = float(os.getenv("AZURE_READ_TIMEOUT", "120"))
+AZURE_POOL_TIMEOUT = float(os.getenv("AZURE_POOL_TIMEOUT", "30"))
+
+
+class AzureCredentials(NamedTuple):
+    """The endpoint and credentials a client is created for."""
+
+    endpoint: str
+    api_key: str | None
+    api_version: str | None
+
+
+def current_credentials() -> AzureCredentials:
+    """Read the Azure credentials from the environment."""
+    return AzureCredentials(
+        str(os.getenv("AZURE_API_ENDPOINT")),
+        os.getenv("AZURE_API_KEY"),
+        os.getenv("API_VERSION"),
+    )
+
+
+def http_limits() -> httpx.Limits:
+    """Return the size of the connection pool of the clients."""
+    return httpx.Limits(
+        max_connections=AZURE_MAX_CONNECTIONS,
+        max_keepalive_connections=AZURE_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=AZURE_KEEPALIVE_EXPIRY,
+    )
+
+
+def http_timeout() -> httpx.Timeout:
+    """Return the timeouts of the requests to the Azure API."""
+    return httpx.Timeout(
+        connect=AZURE_CONNECT_TIMEOUT,
+        read=AZURE_READ_TIMEOUT,
+        write=AZURE_CONNECT_TIMEOUT,
+        pool=AZURE_POOL_TIMEOUT,
+    )
+
+
+class _SharedClient(NamedTuple):
+    """A client with the credentials and the owner it was created for."""
+
+    client: AzureOpenAI
+    credentials: AzureCredentials
+    pid: int
+
+
+class _SharedAsyncClient(NamedTuple):
+    """An asynchronous client with the credentials and the event loop it was created for."""
+
+    client: AsyncAzureOpenAI
+    credentials: AzureCredentials
+    loop: asyncio.AbstractEventLoop
+
+
+# The clients by endpoint, there is more than one if a pool of deployments is configured
+_clients: dict[str, _SharedClient] = {}
+_async_clients: dict[str, _SharedAsyncClient] = {}
+_client_lock = threading.Lock()
+
+
+def get_azure_client(credentials: AzureCredentials | None = None) -> AzureOpenAI:
+    """Return the client of the process for an endpoint, creating it on first use.
+
+    The client is thread-safe and shared by all threads. It is replaced when the credentials of
+    its endpoint change, and in forked processes, which must not reuse the connections of
+    their parent. A replaced client is not closed, as other threads may still be using it; its
+    connections are released when it is garbage collected.
+
+    Args:
+    ----------
+    credentials : AzureCredentials | None
+        The endpoint and credentials, those of the environment if None.
+
+    Returns:
+    -------
+    AzureOpenAI
+        The shared client.
+    """
+    credentials = credentials or current_credentials()
+    with _client_lock:
+        shared = _clients.get(credentials.endpoint)
+        if shared is None or shared.credentials != credentials or shared.pid != os.getpid():
+            if shared is not None and shared.pid == os.getpid():
+                logger.info("The Azure credentials changed, creating a new client.")
+            shared = _SharedClient(
+                AzureOpenAI(
+                    azure_endpoint=credentials.endpoint,
+                    api_key=credentials.api_key,
+                    api_version=credentials.api_version,
+                    timeout=http_timeout(),
+                    http_client=DefaultHttpxClient(limits=http_limits(), timeout=http_timeout()),
+                ),
+                credentials,
+                os.getpid(),
+            )
+            _clients[credentials.endpoint] = shared
+        return shared.client
+
+
+def get_async_azure_client(credentials: AzureCredentials | None = None) -> AsyncAzureOpenAI:
+    """Return the asynchronous client of the running event loop for an endpoint.
+
+    The client is created on first use. It is replaced when the credentials of its endpoint
+    change, or when it is used on another event loop, to which its connections cannot be moved.
+
+    Args:
+    ----------
+    credentials : AzureCredentials | None
+        The endpoint and credentials, those of the environment if None.
+
+    Returns:
+    -------
+    AsyncAzureOpenAI
+        The shared asynchronous client.
+    """
+    credentials = credentials or current_credentials()
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        shared = _async_clients.get(credentials.endpoint)
+        if shared is None or shared.credentials != credentials or shared.loop is not loop:
+            shared = _SharedAsyncClient(
+                AsyncAzureOpenAI(
+                    azure_endpoint=credentials.endpoint,
+                    api_key=credentials.api_key,
+                    api_version=credentials.api_version,
+                    timeout=http_timeout(),
+                    http_client=DefaultAsyncHttpxClient(
+                        limits=http_limits(), timeout=http_timeout()
+                    ),
+                ),
+                credentials,
+                loop,
+            )
+            _async_clients[credentials.endpoint] = shared
+        return shared.client
+
+
+def reset_azure_clients() -> None:
+    """Drop the shared clients, so that the next call creates new ones."""
+    with _client_lock:
+        _clients.clear()
+        _async_clients.clear()
@@ -0,0 +1,223 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+
+"""This module provides a circuit breaker, which stops calling a failing dependency for a while instead of letting every caller wait for its timeout."""
+
+import logging
+import os
+import threading
+import time
+from enum import Enum
+from typing import Awaitable, Callable, TypeVar
+
+from document_analyzation_service.metrics import labelled, metrics
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# The breaker is disabled unless the number of consecutive failures opening it is configured
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "0"))
+CIRCUIT_BREAKER_RECOVERY_SECONDS = float(os.getenv("CIRCUIT_BREAKER_RECOVERY_SECONDS", "30"))
+CIRCUIT_BREAKER_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_BREAKER_HALF_OPEN_PROBES", "1"))
+
+Result = TypeVar("Result")
+
+
+class CircuitState(Enum):
+    """The states of a circuit breaker, valued by their gauge value."""
+
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the dependency while the circuit is open."""
+
+    def __init__(self, name: str, retry_after: float) -> None:
+        """Initialize the error.
+
+        :param name: The name of the breaker.
+        :param retry_after: The seconds until the breaker lets probe calls through.
+        """
+        super().__init__(f"The circuit {name} is open, retry in {retry_after:.1f} seconds.")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Pass calls through while they succeed, and reject them for a while after repeated failures.
+
+    A closed circuit opens after failure_threshold consecutive failures. An open circuit rejects
+    all calls with a CircuitOpenError until recovery_seconds have passed, then it is half-open
+    and lets up to half_open_probes calls through at a time. It closes again once that many
+    probes succeeded, and opens again on the first failed probe.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        recovery_seconds: float,
+        half_open_probes: int = 1,
+        is_failure: Callable[[Exception], bool] = lambda exception: True,
+    ) -> None:
+        """Initialize a closed breaker.
+
+        :param name: The name of the breaker, used as label of its metrics.
+        :param failure_threshold: The consecutive failures opening the circuit, 0 disables the
+            breaker.
+        :param recovery_seconds: The seconds the circuit stays open before probing.
+        :param half_open_probes: The calls let through at a time and the successes needed to
+            close the half-open circuit.
+        :param is_failure: Whether an exception raised by a call indicates an outage. Other
+            exceptions count as success, as the dependency responded.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self.is_failure = is_failure
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+        metrics.set(labelled("circuit_breaker_state", breaker=name), CircuitState.CLOSED.value)
+
+    @property
+    def state(self) -> CircuitState:
+        """The current state, an open circuit becomes half-open once its recovery time passed."""
+        with self._lock:
+            self._refresh(time.monotonic())
+            return self._state
+
+    def before_call(self) -> None:
+        """Register a call, which has to be followed by record_success or record_failure.
+
+        Raises:
+        ------
+        CircuitOpenError
+            If the circuit is open or all probes of the half-open circuit are in flight.
+        """
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._refresh(now)
+            if self._state is CircuitState.CLOSED:
+                return
+            if (
+                self._state is CircuitState.HALF_OPEN
+                and self._probes_in_flight < self.half_open_probes
+            ):
+                self._probes_in_flight += 1
+                return
+            retry_after = max(0.0, self._opened_at + self.recovery_seconds - now)
+        metrics.increment(labelled("circuit_breaker_rejected_total", breaker=self.name))
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record_success(self) -> None:
+        """Register the success of a call, closing a half-open circuit after enough probes."""
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self._failures = 0
+            if self._state is CircuitState.HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self._transition(CircuitState.CLOSED)
+
+    def record_failure(self, exception: Exception) -> None:
+        """Register the failure of a call, opening the circuit if it indicates an outage."""
+        if self.failure_threshold <= 0:
+            return
+        if not self.is_failure(exception):
+            self.record_success()
+            return
+        with self._lock:
+            self._failures += 1
+            if self._state is CircuitState.HALF_OPEN or (
+                self._state is CircuitState.CLOSED and self._failures >= self.failure_threshold
+            ):
+                self._opened_at = time.monotonic()
+                self._transition(CircuitState.OPEN)
+
+    def record_cancellation(self) -> None:
+        """Register a call which was cancelled, which is neither a success nor a failure."""
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            if self._state is CircuitState.HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def call(self, function: Callable[[], Result]) -> Result:
+        """Call a function through the breaker.
+
+        Args:
+        ----------
+        function : Callable[[], Result]
+            The call of the dependency.
+
+        Returns:
+        -------
+        Result
+            The result of the function.
+
+        Raises:
+        ------
+        CircuitOpenError
+            If the circuit rejected the call, the function is not called then.
+        """
+        self.before_call()
+        try:
+            result = function()
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        except BaseException:
+            # E.g. a cancelled task, which must not keep its probe in flight
+            self.record_cancellation()
+            raise
+        self.record_success()
+        return result
+
+    async def call_async(self, function: Callable[[], Awaitable[Result]]) -> Result:
+        """Await a coroutine function through the breaker, see call."""
+        self.before_call()
+        try:
+            result = await function()
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        except BaseException:
+            # E.g. a cancelled task, which must not keep its probe in flight
+            self.record_cancellation()
+            raise
+        self.record_success()
+        return result
+
+    def _refresh(self, now: float) -> None:
+        """Let an open circuit become half-open once its recovery time passed."""
+        if self._state is CircuitState.OPEN and now - self._opened_at >= self.recovery_seconds:
+            self._transition(CircuitState.HALF_OPEN)
+
+    def _transition(self, state: CircuitState) -> None:
+        """Change the state and record the transition, the lock has to be held."""
+        logger.warning(
+            "Circuit %s changed from %s to %s.", self.name, self._state.name, state.name
+        )
+        self._state = state
+        self._failures = 0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        metrics.increment(
+            labelled(
+                "circuit_breaker_transitions_total", breaker=self.name, state=state.name.lower()
+            )
+        )
+        metrics.set(labelled("circuit_breaker_state", breaker=self.name), state.value)
@@ -11,6 +11,7 @@ import json
 import logging
 import os
 import uuid
+from mimetypes import guess_type
 
 import pika
 
@@ -59,6 +60,41 @@ def send_image_to_queue(image_path: str) -> None:
     connection.close()
 
 
+def send_binary_image_to_queue(image_path: str, document_type: str = "auto") -> None:
+    """Send an image to the RabbitMQ queue in the binary message format.
+
+    The raw image bytes are sent as body, the metadata as AMQP headers.
+
+    Args:
+        image_path (str): The file path of the image to be sent.
+        document_type (str): The document type of the image, "auto" to classify it.
+    """
+    image_uuid = str(uuid.uuid4())
+    content_type, _ = guess_type(image_path)
+
+    with open(image_path, "rb") as image_file:
+        image_data = image_file.read()
+
+    properties = pika.BasicProperties(
+        content_type=content_type or "application/octet-stream",
+        headers={"uuid": image_uuid, "document_type": document_type},
+    )
+
+    credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
+    parameters = pika.ConnectionParameters(RABBITMQ_URI, 5672, "/", credentials)
+    connection = pika.BlockingConnection(parameters)
+    channel = connection.channel()
+    channel.queue_declare(queue=QUEUE_NAME)
+    channel.basic_publish(
+        exchange="", routing_key=QUEUE_NAME, body=image_data, properties=properties
+    )
+
+    logging.info("Sent binary image to queue '%s'.", QUEUE_NAME)
+    logging.info("Image UUID: %s", image_uuid)
+
+    connection.close()
+
+
 if __name__ == "__main__":
     # Send example image
     send_image_to_queue(
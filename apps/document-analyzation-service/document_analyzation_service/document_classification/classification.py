@@ -6,49 +6,189 @@
 
 """This module uses the functions for classifying documents and consolidates their results."""
 
+import hashlib
 import logging
-from PIL import Image
-import base64
-from io import BytesIO
-from doctr.models import ocr_predictor
+import math
+import os
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, TypeVar
+
 import numpy as np
+from numpy.typing import NDArray
+from PIL import Image
 
+from document_analyzation_service.document_context import DocumentContext
+from document_analyzation_service.metrics import labelled, metrics
+from document_analyzation_service.single_flight import SingleFlight
+from document_analyzation_service.document_classification.fuzzy_scorer import FuzzyKeywordScorer
+from document_analyzation_service.document_classification.keyword_matcher import KeywordMatcher
+from document_analyzation_service.document_classification.layout_index import (
+    FINGERPRINT_SIZE,
+    LayoutIndex,
+    layout_fingerprint,
+)
+from document_analyzation_service.document_classification.ocr_batcher import OcrBatcher
+from document_analyzation_service.document_classification.ocr_process_pool import OcrProcessPool
 from document_analyzation_service.document_classification.document_class_identifier.document_type_identifier_list import (
     document_type_identifier_list,
 )
 
 logger = logging.getLogger(__name__)
 
-model = ocr_predictor(pretrained=True)
+StageResult = TypeVar("StageResult", bound=str | None)
+
+# Directory with pre-populated weights, so that no weights are downloaded at runtime
+OCR_MODEL_DIR = os.getenv("OCR_MODEL_DIR", "")
+OCR_DETECTION_WEIGHTS = "detection.pt"
+OCR_RECOGNITION_WEIGHTS = "recognition.pt"
+OCR_CHECKSUM_FILE = "checksums.sha256"
+# "torch" runs doctr in PyTorch, "onnx" runs the exported models of OnnxTR through onnxruntime
+OCR_BACKEND = os.getenv("OCR_BACKEND", "torch").lower()
+# Architectures of the OCR models, e.g. the faster db_mobilenet_v3_large and
+# crnn_mobilenet_v3_small, the defaults of the backend if empty
+OCR_DET_ARCH = os.getenv("OCR_DET_ARCH", "")
+OCR_RECO_ARCH = os.getenv("OCR_RECO_ARCH", "")
+# Whether the onnx backend runs the int8 quantized models
+OCR_ONNX_INT8 = os.getenv("OCR_ONNX_INT8", "false").lower() == "true"
+OCR_ONNX_DETECTION_MODEL = "detection.onnx"
+OCR_ONNX_RECOGNITION_MODEL = "recognition.onnx"
+OCR_ONNX_DEFAULT_DET_ARCH = "fast_base"
+OCR_ONNX_DEFAULT_RECO_ARCH = "crnn_vgg16_bn"
+# Pages of concurrent classifications run through the model together, 1 disables the batching
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "1"))
+OCR_BATCH_WAIT_MS = float(os.getenv("OCR_BATCH_WAIT_MS", "20"))
+# Worker processes running the OCR outside of the consumer process, 0 runs it in-process
+OCR_PROCESS_WORKERS = int(os.getenv("OCR_PROCESS_WORKERS", "0"))
+# Threads torch may use in each OCR worker process, 0 keeps the default of torch
+OCR_TORCH_THREADS = int(os.getenv("OCR_TORCH_THREADS", "1"))
+# "exact" matches the identifiers as substrings, "fuzzy" tolerates OCR errors by n-gram matching
+CLASSIFICATION_SCORING = os.getenv("CLASSIFICATION_SCORING", "exact").lower()
+FUZZY_NGRAM_SIZE = int(os.getenv("FUZZY_NGRAM_SIZE", "3"))
+FUZZY_MATCH_THRESHOLD = float(os.getenv("FUZZY_MATCH_THRESHOLD", "0.8"))
+# Index of sample layouts, built with layout_index.py, which classifies known templates without OCR
+LAYOUT_INDEX_PATH = os.getenv("LAYOUT_INDEX_PATH", "")
+LAYOUT_MATCH_MAX_DISTANCE = float(os.getenv("LAYOUT_MATCH_MAX_DISTANCE", "0.1"))
+# The staged classification first reads the header band of the page at a reduced resolution
+# and only runs the OCR on the full page if the header does not decide the document type
+STAGED_CLASSIFICATION = os.getenv("STAGED_CLASSIFICATION", "false").lower() == "true"
+HEADER_BAND_FRACTION = float(os.getenv("HEADER_BAND_FRACTION", "0.25"))
+HEADER_BAND_MAX_SIDE = int(os.getenv("HEADER_BAND_MAX_SIDE", "1024"))
+# Share by which the best score has to exceed the second best one to stop after a stage
+CLASSIFICATION_MIN_MARGIN = float(os.getenv("CLASSIFICATION_MIN_MARGIN", "0.5"))
 
+_ocr_model: Any = None
+_ocr_model_lock = threading.Lock()
+_layout_index: LayoutIndex | None = None
+_layout_index_loaded = False
+_layout_index_lock = threading.Lock()
 
-def calculate_doc_type_score(ocr_text: str, doc_type_identifier: list[str]) -> float:
-    """Calculate the similarity score for a document type."""
+_classification_flights: SingleFlight[str] = SingleFlight("classification")
+_ocr_batcher = OcrBatcher(lambda: get_ocr_model(), OCR_BATCH_SIZE, OCR_BATCH_WAIT_MS / 1000)
+# All identifiers compiled once, so that the OCR text is scanned once for all document types
+_identifier_matcher = KeywordMatcher(
+    identifier
+    for doc_type_identifier in document_type_identifier_list
+    for identifier in [
+        doc_type_identifier.main_identifier,
+        *doc_type_identifier.characteristic_identifier,
+    ]
+)
+_fuzzy_scorer = FuzzyKeywordScorer(
+    document_type_identifier_list, FUZZY_NGRAM_SIZE, FUZZY_MATCH_THRESHOLD
+)
+
+
+def calculate_doc_type_score(found_identifiers: set[str], doc_type_identifier: list[str]) -> float:
+    """Calculate the similarity score for a document type from the lowercase identifiers found in the OCR text."""
     similarity_score = 0
 
     for identifier in doc_type_identifier:
-        if identifier.lower() in ocr_text.lower():
+        if identifier.lower() in found_identifiers:
             similarity_score = similarity_score + 1
 
     return similarity_score / len(doc_type_identifier) if len(doc_type_identifier) > 0 else 0
 
 
-def calculate_best_doc_type_fit(doctr_ocr_text: str) -> str:
-    """Return the document type with the best similarity score. This function calculates the two key figures document_identifier_score and document_main_identifier_score. The document_identifier_score is the set of typical identifiers of a document type that occur in the OCR text. This value is multiplied by the key figure document_main_identifier_score, which is a value of 1 or 0.1, depending on whether a predefined main_identifier was found in the OCR text. The main_identifier is the name of the document type that is explicitly specified on the document."""
-    most_suitable_doc_type = ""
-    most_suitable_doc_type_score: float = 0
+def calculate_doc_type_scores(doctr_ocr_text: str) -> dict[str, float]:
+    """Return the similarity score of every document type. This function calculates the two key figures document_identifier_score and document_main_identifier_score. The document_identifier_score is the set of typical identifiers of a document type that occur in the OCR text. This value is multiplied by the key figure document_main_identifier_score, which is a value of 1 or 0.1, depending on whether a predefined main_identifier was found in the OCR text. The main_identifier is the name of the document type that is explicitly specified on the document. With CLASSIFICATION_SCORING set to "fuzzy", identifiers also match with OCR errors, see FuzzyKeywordScorer."""
+    if CLASSIFICATION_SCORING == "fuzzy":
+        return _fuzzy_scorer.score(doctr_ocr_text)
+    return _exact_doc_type_scores(_identifier_matcher.find(doctr_ocr_text))
+
 
+def _exact_doc_type_scores(found_identifiers: set[str]) -> dict[str, float]:
+    """Return the similarity score of every document type from the lowercase identifiers found in the OCR text."""
+    scores = {}
     for doc_type_identifier in document_type_identifier_list:
         document_identifier_score: float = calculate_doc_type_score(
-            doctr_ocr_text, doc_type_identifier.characteristic_identifier
+            found_identifiers, doc_type_identifier.characteristic_identifier
         )
         document_main_identifier_score = (
-            1 if doc_type_identifier.main_identifier.lower() in doctr_ocr_text.lower() else 0.1
+            1 if doc_type_identifier.main_identifier.lower() in found_identifiers else 0.1
+        )
+        scores[doc_type_identifier.name] = (
+            document_identifier_score * document_main_identifier_score
         )
-        score = document_identifier_score * document_main_identifier_score
+    return scores
+
+
+def match_doc_types(doctr_ocr_text: str) -> tuple[set[str], dict[str, float]]:
+    """Return the document types whose main identifier occurs in the OCR text and the scores of all document types, matching the identifiers once."""
+    if CLASSIFICATION_SCORING == "fuzzy":
+        matches = _fuzzy_scorer.identifier_matches(doctr_ocr_text)
+        return _fuzzy_scorer.found_main_identifiers(matches), _fuzzy_scorer.score_matches(matches)
+    found_identifiers = _identifier_matcher.find(doctr_ocr_text)
+    main_identifier_types = {
+        doc_type_identifier.name
+        for doc_type_identifier in document_type_identifier_list
+        if doc_type_identifier.main_identifier.lower() in found_identifiers
+    }
+    return main_identifier_types, _exact_doc_type_scores(found_identifiers)
+
+
+def confident_doc_type(doctr_ocr_text: str) -> str | None:
+    """Return the document type of a partial OCR text, if the text decides it.
+
+    The text decides the type if the main identifier of the best scoring type occurs in it and
+    the second best score stays below the best one by CLASSIFICATION_MIN_MARGIN. A text with
+    a single main identifier but no characteristic identifiers, e.g. the title of the document
+    only, decides the type if just one type has that main identifier.
+
+    Args:
+    ----------
+    doctr_ocr_text : str
+        The text found in a part of the document.
+
+    Returns:
+    -------
+    str | None
+        The document type, None if the text is ambiguous.
+    """
+    main_identifier_types, scores = match_doc_types(doctr_ocr_text)
+    if not main_identifier_types:
+        return None
+    ranking = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    best_doc_type, best_score = ranking[0]
+    second_score = ranking[1][1] if len(ranking) > 1 else 0
+    if best_score == 0:
+        return main_identifier_types.pop() if len(main_identifier_types) == 1 else None
+    if best_doc_type in main_identifier_types and second_score <= best_score * (
+        1 - CLASSIFICATION_MIN_MARGIN
+    ):
+        return best_doc_type
+    return None
 
+
+def calculate_best_doc_type_fit(doctr_ocr_text: str) -> str:
+    """Return the document type with the best similarity score, see calculate_doc_type_scores."""
+    most_suitable_doc_type = ""
+    most_suitable_doc_type_score: float = 0
+
+    for doc_type, score in calculate_doc_type_scores(doctr_ocr_text).items():
         if most_suitable_doc_type_score < score:
-            most_suitable_doc_type = doc_type_identifier.name
+            most_suitable_doc_type = doc_type
             most_suitable_doc_type_score = score
 
     logger.debug(
@@ -58,16 +198,318 @@ def calculate_best_doc_type_fit(doctr_ocr_text: str) -> str:
     return most_suitable_doc_type
 
 
-def create_doctr_ocr(base64_image_string: str) -> str:
-    """Return the text found in the image provided."""
-    image_data = base64.b64decode(base64_image_string)
-    converted_image = Image.open(BytesIO(image_data)).convert("RGB")
-    numpy_image = np.array(converted_image)
-    ocr_text: str = model([numpy_image]).render()
-    return ocr_text
+def _file_sha256(path: str) -> str:
+    """Return the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def verify_model_checksums(model_dir: str, file_names: list[str]) -> None:
+    """Verify the weight files in a model directory against its checksum file.
+
+    The checksum file lists one "<sha256>  <file name>" line per file, as written by sha256sum.
+
+    Args:
+    ----------
+    model_dir : str
+        The directory containing the weights and the checksum file.
+    file_names : list[str]
+        The weight files which have to be listed and match.
+
+    Raises:
+    ------
+    RuntimeError
+        If the checksum file or a weight file is missing, or a checksum does not match.
+    """
+    checksum_path = os.path.join(model_dir, OCR_CHECKSUM_FILE)
+    if not os.path.isfile(checksum_path):
+        raise RuntimeError(f"The checksum file {checksum_path} is missing.")
+    expected = {}
+    with open(checksum_path, encoding="utf-8") as checksum_file:
+        for line in checksum_file:
+            if line.strip():
+                checksum, file_name = line.split(maxsplit=1)
+                expected[file_name.strip().lstrip("*")] = checksum.lower()
+
+    for file_name in file_names:
+        path = os.path.join(model_dir, file_name)
+        if file_name not in expected:
+            raise RuntimeError(f"No checksum of {file_name} is listed in {checksum_path}.")
+        if not os.path.isfile(path):
+            raise RuntimeError(f"The weight file {path} is missing.")
+        if _file_sha256(path) != expected[file_name]:
+            raise RuntimeError(f"The checksum of {path} does not match {checksum_path}.")
+
+
+def load_ocr_model(
+    model_dir: str = OCR_MODEL_DIR,
+    backend: str = OCR_BACKEND,
+    det_arch: str = OCR_DET_ARCH,
+    reco_arch: str = OCR_RECO_ARCH,
+) -> Any:
+    """Build the OCR predictor.
+
+    Args:
+    ----------
+    model_dir : str
+        The directory with the verified detection and recognition weights. If it is empty,
+        the pretrained weights are downloaded into the cache of the backend.
+    backend : str
+        "torch" runs doctr, "onnx" runs the exported models of OnnxTR through onnxruntime.
+    det_arch : str
+        The detection architecture, e.g. "db_mobilenet_v3_large", the default one if empty.
+    reco_arch : str
+        The recognition architecture, e.g. "crnn_mobilenet_v3_small", the default one if empty.
+
+    Returns:
+    -------
+    Any
+        The OCR predictor.
+
+    Raises:
+    ------
+    ValueError
+        If the backend is unknown.
+    """
+    if backend == "onnx":
+        return _load_onnx_ocr_model(model_dir, det_arch, reco_arch)
+    if backend != "torch":
+        raise ValueError(f"Unknown OCR backend {backend}, expected torch or onnx.")
+
+    # doctr pulls in torch, so it is only imported once the model is needed
+    from doctr.models import ocr_predictor
+
+    architectures = _architecture_arguments(det_arch, reco_arch)
+    if not model_dir:
+        return ocr_predictor(pretrained=True, **architectures)
+
+    verify_model_checksums(model_dir, [OCR_DETECTION_WEIGHTS, OCR_RECOGNITION_WEIGHTS])
+    predictor: Any = ocr_predictor(pretrained=False, pretrained_backbone=False, **architectures)
+    predictor.det_predictor.model.from_pretrained(os.path.join(model_dir, OCR_DETECTION_WEIGHTS))
+    predictor.reco_predictor.model.from_pretrained(
+        os.path.join(model_dir, OCR_RECOGNITION_WEIGHTS)
+    )
+    logger.info("Loaded the OCR weights from %s.", model_dir)
+    return predictor
+
+
+def _architecture_arguments(det_arch: str, reco_arch: str) -> dict[str, Any]:
+    """Return the architecture arguments of ocr_predictor, leaving out the default ones."""
+    architectures: dict[str, Any] = {}
+    if det_arch:
+        architectures["det_arch"] = det_arch
+    if reco_arch:
+        architectures["reco_arch"] = reco_arch
+    return architectures
+
+
+def _load_onnx_ocr_model(model_dir: str, det_arch: str, reco_arch: str) -> Any:
+    """Build the OnnxTR predictor.
+
+    Downloaded models are the int8 quantized ones if OCR_ONNX_INT8 is set. The models of a local
+    model directory are used as they are, so quantized models have to be exported there.
+    """
+    try:
+        import onnxtr.models
+    except ImportError as e:
+        raise ImportError(
+            "The onnx OCR backend requires OnnxTR, install the service with the onnx extra."
+        ) from e
+
+    architectures = _architecture_arguments(det_arch, reco_arch)
+    if not model_dir:
+        return onnxtr.models.ocr_predictor(load_in_8_bit=OCR_ONNX_INT8, **architectures)
+
+    verify_model_checksums(model_dir, [OCR_ONNX_DETECTION_MODEL, OCR_ONNX_RECOGNITION_MODEL])
+    # The architecture functions of OnnxTR build the model from a local file
+    detection_model = getattr(onnxtr.models, det_arch or OCR_ONNX_DEFAULT_DET_ARCH)(
+        os.path.join(model_dir, OCR_ONNX_DETECTION_MODEL)
+    )
+    recognition_model = getattr(onnxtr.models, reco_arch or OCR_ONNX_DEFAULT_RECO_ARCH)(
+        os.path.join(model_dir, OCR_ONNX_RECOGNITION_MODEL)
+    )
+    logger.info("Loaded the ONNX OCR models from %s.", model_dir)
+    return onnxtr.models.ocr_predictor(det_arch=detection_model, reco_arch=recognition_model)
+
+
+def get_ocr_model() -> Any:
+    """Return the process-wide OCR predictor, loading it on first use."""
+    global _ocr_model
+    if _ocr_model is None:
+        with _ocr_model_lock:
+            if _ocr_model is None:
+                _ocr_model = load_ocr_model()
+    return _ocr_model
+
+
+# Created after get_ocr_model, which is passed by reference to the spawned workers
+_ocr_process_pool = OcrProcessPool(get_ocr_model, OCR_PROCESS_WORKERS, OCR_TORCH_THREADS)
+
+
+def warmup_ocr_model() -> None:
+    """Load the OCR predictor and run one inference on a blank page.
+
+    The first inference allocates the buffers of torch, so it is run before the first message.
+    With OCR_PROCESS_WORKERS set, every worker process is started and warmed up instead.
+    """
+    if OCR_PROCESS_WORKERS > 0:
+        _ocr_process_pool.warmup()
+    else:
+        get_ocr_model()([np.full((256, 256, 3), 255, dtype=np.uint8)])
+    logger.info("Warmed up the OCR model.")
+
+
+def recognize_page(page: NDArray[np.uint8]) -> str:
+    """Return the text found on a page.
+
+    With OCR_PROCESS_WORKERS set, the OCR runs in a worker process. Otherwise, or if the
+    workers could not be started, it runs in the current process and, with OCR_BATCH_SIZE
+    above 1, is batched with concurrent calls.
+
+    Args:
+    ----------
+    page : NDArray[np.uint8]
+        The page as RGB array of shape (height, width, 3).
+
+    Returns:
+    -------
+    str
+        The rendered text of the page.
+    """
+    if OCR_PROCESS_WORKERS > 0 and not _ocr_process_pool.failed:
+        try:
+            return _ocr_process_pool.recognize(page)
+        except BrokenProcessPool:
+            if not _ocr_process_pool.failed:
+                raise
+            logger.warning("Running the OCR in the current process instead of the workers.")
+    return _ocr_batcher.recognize(page)
+
 
+def shutdown_ocr_workers() -> None:
+    """Stop the OCR worker processes of the current process, if they were started."""
+    _ocr_process_pool.shutdown()
 
-def get_document_class(base64_image_string: str) -> str:
-    """Return the document class that best fits an image."""
-    doctr_text = create_doctr_ocr(base64_image_string)
-    return calculate_best_doc_type_fit(doctr_text)
+
+def header_band(document: DocumentContext) -> NDArray[np.uint8]:
+    """Render the top HEADER_BAND_FRACTION of a page, with its long side at most HEADER_BAND_MAX_SIDE.
+
+    Args:
+    ----------
+    document : DocumentContext
+        The context of the image.
+
+    Returns:
+    -------
+    NDArray[np.uint8]
+        The header band as RGB array of shape (height, width, 3).
+    """
+    width, height = document.size
+    scale = min(1.0, HEADER_BAND_MAX_SIDE / max(width, height))
+    target_width = max(1, math.ceil(width * scale))
+    image = document.decode_reduced((target_width, max(1, math.ceil(height * scale))))
+    band = image.crop((0, 0, image.width, max(1, round(image.height * HEADER_BAND_FRACTION))))
+    if band.width > target_width:
+        band_height = max(1, round(band.height * target_width / band.width))
+        band = band.resize((target_width, band_height), Image.Resampling.LANCZOS)
+    return np.asarray(band.convert("RGB"))
+
+
+def create_doctr_ocr(document: DocumentContext) -> str:
+    """Return the text found in the image of the document, see recognize_page."""
+    return recognize_page(document.rgb_array)
+
+
+def get_layout_index() -> LayoutIndex | None:
+    """Return the process-wide layout index, loading it on first use.
+
+    Returns:
+    -------
+    LayoutIndex | None
+        The index, None if LAYOUT_INDEX_PATH is not configured or cannot be read.
+    """
+    global _layout_index, _layout_index_loaded
+    if not LAYOUT_INDEX_PATH:
+        return None
+    with _layout_index_lock:
+        if not _layout_index_loaded:
+            _layout_index_loaded = True
+            try:
+                _layout_index = LayoutIndex.load(LAYOUT_INDEX_PATH)
+                logger.info(
+                    "Loaded %d sample layouts from %s.", len(_layout_index), LAYOUT_INDEX_PATH
+                )
+            except (OSError, ValueError, KeyError) as e:
+                logger.error("Could not load the layout index %s: %s", LAYOUT_INDEX_PATH, e)
+        return _layout_index
+
+
+def classify_layout(document: DocumentContext) -> str | None:
+    """Return the document class of the nearest sample layout, if it is near enough.
+
+    Args:
+    ----------
+    document : DocumentContext
+        The context of the image.
+
+    Returns:
+    -------
+    str | None
+        The document class, None if there is no index or no sample within
+        LAYOUT_MATCH_MAX_DISTANCE.
+    """
+    layout_index = get_layout_index()
+    if layout_index is None:
+        return None
+    # The fingerprint is tiny, so JPEGs only need to be decoded at a fraction of their size
+    thumbnail_size = (FINGERPRINT_SIZE * 8, FINGERPRINT_SIZE * 8)
+    nearest = layout_index.nearest(layout_fingerprint(document.decode_reduced(thumbnail_size)))
+    if nearest is None or nearest[1] > LAYOUT_MATCH_MAX_DISTANCE:
+        metrics.increment("layout_index_misses_total")
+        return None
+    metrics.increment("layout_index_hits_total")
+    logger.info("Matched the layout of %s with a distance of %.3f.", nearest[0], nearest[1])
+    return nearest[0]
+
+
+def get_document_class(document: DocumentContext) -> str:
+    """Return the document class that best fits the image of a document.
+
+    Concurrent calls for the same image share a single OCR run.
+    """
+    return _classification_flights.do(document.content_hash, lambda: classify_document(document))
+
+
+def classify_document(document: DocumentContext) -> str:
+    """Return the class of a document, by its layout if it matches a known template and otherwise by the text found by the OCR."""
+    layout_class = classify_layout(document)
+    if layout_class is not None:
+        return layout_class
+    if STAGED_CLASSIFICATION:
+        header_class = _run_stage(
+            "header", lambda: confident_doc_type(recognize_page(header_band(document)))
+        )
+        if header_class is not None:
+            return header_class
+    return _run_stage("full", lambda: calculate_best_doc_type_fit(create_doctr_ocr(document)))
+
+
+def _run_stage(stage: str, classify: Callable[[], StageResult]) -> StageResult:
+    """Run a classification stage, counting its runs, decisions and duration."""
+    start = time.perf_counter()
+    doc_type = classify()
+    duration = time.perf_counter() - start
+    metrics.increment(labelled("classification_stage_runs_total", stage=stage))
+    metrics.increment(labelled("classification_stage_seconds_total", stage=stage), duration)
+    if doc_type:
+        metrics.increment(labelled("classification_stage_decisions_total", stage=stage))
+    logger.info(
+        "Classification stage %s took %.3f seconds and decided on %s.",
+        stage,
+        duration,
+        doc_type or "no document type",
+    )
+    return doc_type
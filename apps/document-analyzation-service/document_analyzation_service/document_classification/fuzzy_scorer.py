@@ -0,0 +1,186 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+
+"""This module scores the document types against an OCR text by the character n-grams of their identifiers, which tolerates the misread umlauts and split words of real scans."""
+
+import unicodedata
+
+import numpy as np
+from numpy.typing import NDArray
+
+from document_analyzation_service.document_classification.document_class_identifier.document_type_identifier_dto import (
+    DocumentTypeIdentifierDto,
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """Split a text into folded words for the fuzzy comparison.
+
+    Diacritics and the case are removed, e.g. "Empfänger" becomes "empfanger", and the words
+    are separated by everything but letters and digits.
+
+    Args:
+    ----------
+    text : str
+        The text to split.
+
+    Returns:
+    -------
+    list[str]
+        The folded words in the order of the text.
+    """
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(
+        char if char.isalnum() else " " for char in decomposed if not unicodedata.combining(char)
+    ).split()
+
+
+def normalize_text(text: str) -> str:
+    """Fold a text into a single word, so that "Absen der:" becomes "absender", see tokenize."""
+    return "".join(tokenize(text))
+
+
+def character_ngrams(text: str, n: int) -> set[str]:
+    """Return the character n-grams of a normalized text, the text itself if it is shorter."""
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i : i + n] for i in range(len(text) - n + 1)}
+
+
+class FuzzyKeywordScorer:
+    """Score all document types against a text with matrix products.
+
+    Every identifier is represented by the set of its character n-grams. The text is compared
+    word by word, and by windows of adjacent words to tolerate words split by the OCR. A window
+    of several words is only compared to the identifiers it exceeds by less than n characters,
+    so that the end of one word and the start of the next cannot form an identifier. An
+    identifier matches if the share of its n-grams found in a single word or window reaches the
+    threshold, identifiers not longer than n therefore match exactly. It contributes that share
+    to the score of its document type. The scores follow calculate_best_doc_type_fit: the mean
+    of the characteristic identifiers, reduced to a tenth without the main identifier.
+    """
+
+    def __init__(
+        self,
+        document_type_identifiers: list[DocumentTypeIdentifierDto],
+        n: int = 3,
+        threshold: float = 0.8,
+        window_words: int = 3,
+    ) -> None:
+        """Precompute the n-gram vectors of the identifiers.
+
+        :param document_type_identifiers: The document types with their identifiers.
+        :param n: The length of the character n-grams.
+        :param threshold: The share of n-grams of an identifier needed for a match.
+        :param window_words: The most adjacent words joined to match a split identifier.
+        """
+        self.n = n
+        self.threshold = threshold
+        self.window_words = window_words
+        self.document_types = [identifier.name for identifier in document_type_identifiers]
+
+        identifiers: list[str] = []
+        identifier_index: dict[str, int] = {}
+
+        def index_of(identifier: str) -> int:
+            normalized = normalize_text(identifier)
+            if normalized not in identifier_index:
+                identifier_index[normalized] = len(identifiers)
+                identifiers.append(normalized)
+            return identifier_index[normalized]
+
+        main_indices = [index_of(dto.main_identifier) for dto in document_type_identifiers]
+        characteristic_indices = [
+            [index_of(identifier) for identifier in dto.characteristic_identifier]
+            for dto in document_type_identifiers
+        ]
+
+        identifier_ngrams = [character_ngrams(identifier, n) for identifier in identifiers]
+        self._vocabulary = {
+            ngram: index for index, ngram in enumerate(sorted(set().union(*identifier_ngrams)))
+        }
+        # Row i holds the n-grams of identifier i, weighted so that the product with the
+        # n-grams of a text is the share of the identifier's n-grams found in it
+        self._identifier_matrix = np.zeros((len(identifiers), len(self._vocabulary)), np.float32)
+        for row, ngrams in enumerate(identifier_ngrams):
+            for ngram in ngrams:
+                self._identifier_matrix[row, self._vocabulary[ngram]] = 1 / len(ngrams)
+
+        # Row t averages the characteristic identifiers of document type t, repeated
+        # identifiers count repeatedly as in calculate_doc_type_score
+        self._type_matrix = np.zeros((len(self.document_types), len(identifiers)), np.float32)
+        for row, indices in enumerate(characteristic_indices):
+            for index in indices:
+                self._type_matrix[row, index] += 1 / len(indices)
+        self._main_indices = np.array(main_indices, dtype=np.intp)
+        # The longest window of several words each identifier is compared to
+        self._window_lengths = np.array(
+            [len(identifier) + n - 1 for identifier in identifiers], dtype=np.intp
+        )
+
+    def identifier_matches(self, text: str) -> NDArray[np.float32]:
+        """Return the largest share of n-grams of every identifier found in a word or window of the text, 0 below the threshold."""
+        words = tokenize(text)
+        longest_window = int(self._window_lengths.max(initial=0))
+        window_indices: list[list[int]] = []
+        window_lengths: list[int] = []
+        for start in range(len(words)):
+            window = ""
+            for end in range(start, min(len(words), start + self.window_words)):
+                window += words[end]
+                if end > start and len(window) > longest_window:
+                    break
+                indices = [
+                    self._vocabulary[ngram]
+                    for ngram in character_ngrams(window, self.n)
+                    if ngram in self._vocabulary
+                ]
+                if indices:
+                    window_indices.append(indices)
+                    # Single words are compared to all identifiers
+                    window_lengths.append(0 if end == start else len(window))
+        if not window_indices:
+            return np.zeros(len(self._identifier_matrix), np.float32)
+
+        window_matrix = np.zeros((len(window_indices), len(self._vocabulary)), np.float32)
+        for row, indices in enumerate(window_indices):
+            window_matrix[row, indices] = 1
+        coverage = window_matrix @ self._identifier_matrix.T
+        comparable = np.array(window_lengths)[:, np.newaxis] <= self._window_lengths
+        coverage = np.where(comparable, coverage, 0).max(axis=0)
+        # Tolerate the rounding of the float32 weights for complete matches
+        coverage = np.minimum(coverage + 1e-6, 1)
+        matches: NDArray[np.float32] = np.where(coverage >= self.threshold, coverage, 0)
+        return matches
+
+    def found_main_identifiers(self, matches: NDArray[np.float32]) -> set[str]:
+        """Return the document types whose main identifier is among the identifier_matches."""
+        found = matches[self._main_indices] > 0
+        return {document_type for document_type, main in zip(self.document_types, found) if main}
+
+    def score(self, text: str) -> dict[str, float]:
+        """Return the confidence of every document type for the text.
+
+        Args:
+        ----------
+        text : str
+            The OCR text of the document.
+
+        Returns:
+        -------
+        dict[str, float]
+            The score of every document type, between 0 and 1.
+        """
+        return self.score_matches(self.identifier_matches(text))
+
+    def score_matches(self, matches: NDArray[np.float32]) -> dict[str, float]:
+        """Return the score of every document type for the identifier_matches of a text."""
+        main_factor = np.where(matches[self._main_indices] > 0, 1, 0.1)
+        scores = (self._type_matrix @ matches) * main_factor
+        return {
+            document_type: float(score)
+            for document_type, score in zip(self.document_types, scores)
+        }
@@ -0,0 +1,81 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+
+"""This module finds all keywords of the document types in an OCR text with a single scan, using a regular expression compiled from a trie of the keywords."""
+
+import re
+from typing import Iterable
+
+# Marks the end of a keyword in the trie
+_END = ""
+
+_TrieNode = dict[str, "_TrieNode"]
+
+
+def _trie_pattern(node: _TrieNode) -> str:
+    """Build the pattern of a trie node, preferring the longest keyword at each position."""
+    ends_here = _END in node
+    branches = [
+        re.escape(char) + _trie_pattern(child)
+        for char, child in sorted(node.items())
+        if char != _END
+    ]
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if ends_here:
+        # Greedy, so the longer keyword is tried first and the shorter one is the fallback
+        pattern = "(?:" + pattern + ")?" if len(branches) == 1 else pattern + "?"
+    return pattern
+
+
+class KeywordMatcher:
+    """Find which of a fixed set of keywords occur in a text, ignoring the case.
+
+    The keywords are compiled into one regular expression, which reports the longest keyword
+    starting at every position of the text. Keywords contained in a found keyword are found as
+    well, so the result equals a separate substring test per keyword.
+    """
+
+    def __init__(self, keywords: Iterable[str]) -> None:
+        """Compile the keywords.
+
+        :param keywords: The keywords to search for, in any case.
+        """
+        self.keywords = frozenset(keyword.lower() for keyword in keywords)
+        trie: _TrieNode = {}
+        for keyword in self.keywords:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[_END] = {}
+        pattern = _trie_pattern(trie)
+        self._pattern = re.compile(f"(?=({pattern}))") if pattern else None
+        # The keywords contained in each keyword, including itself
+        self._contained = {
+            keyword: frozenset(other for other in self.keywords if other in keyword)
+            for keyword in self.keywords
+        }
+
+    def find(self, text: str) -> set[str]:
+        """Return the keywords occurring in a text.
+
+        Args:
+        ----------
+        text : str
+            The text to search, in any case.
+
+        Returns:
+        -------
+        set[str]
+            The lowercase keywords found in the text.
+        """
+        found: set[str] = {keyword for keyword in self.keywords if not keyword}
+        if self._pattern is None:
+            return found
+        for longest in {match.group(1) for match in self._pattern.finditer(text.lower())}:
+            found |= self._contained[longest]
+        return found
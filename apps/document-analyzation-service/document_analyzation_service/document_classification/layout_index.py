@@ -0,0 +1,163 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+
+"""This module classifies documents by the layout of their page, comparing a binarized thumbnail with those of labeled sample documents, so that recurring form templates are recognized without OCR."""
+
+import argparse
+import logging
+import os
+
+import numpy as np
+from numpy.typing import NDArray
+from PIL import Image, ImageOps
+
+from document_analyzation_service.document_classification.document_class_identifier.document_type_identifier_list import (
+    document_type_identifier_list,
+)
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_SIZE = 32
+SAMPLE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".tif", ".tiff", ".bmp")
+
+# Number of set bits of every byte, to count the differing bits of packed fingerprints
+_BIT_COUNTS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+def layout_fingerprint(image: Image.Image, size: int = FINGERPRINT_SIZE) -> NDArray[np.uint8]:
+    """Compute the layout fingerprint of a page.
+
+    The page is reduced to a size x size thumbnail of its ink density, which is binarized at
+    its mean, so that the fingerprint captures the lines and text blocks of the form.
+
+    Args:
+    ----------
+    image : Image.Image
+        The page, at any resolution.
+    size : int
+        The side length of the thumbnail.
+
+    Returns:
+    -------
+    NDArray[np.uint8]
+        The size * size bits of the binarized thumbnail, packed into bytes.
+    """
+    thumbnail = ImageOps.autocontrast(image.convert("L")).resize(
+        (size, size), Image.Resampling.BOX
+    )
+    pixels = np.asarray(thumbnail, dtype=np.float32)
+    return np.packbits(pixels < pixels.mean())
+
+
+class LayoutIndex:
+    """The fingerprints of labeled sample pages, searched by their Hamming distance."""
+
+    def __init__(self, fingerprints: NDArray[np.uint8], labels: list[str]) -> None:
+        """Initialize the index.
+
+        :param fingerprints: The packed fingerprints, one row per sample.
+        :param labels: The document type of every sample.
+        """
+        if len(fingerprints) != len(labels):
+            raise ValueError(f"Got {len(fingerprints)} fingerprints but {len(labels)} labels.")
+        self.fingerprints = fingerprints
+        self.labels = labels
+
+    def __len__(self) -> int:
+        """Return the number of samples."""
+        return len(self.labels)
+
+    def nearest(self, fingerprint: NDArray[np.uint8]) -> tuple[str, float] | None:
+        """Find the sample with the most similar layout.
+
+        Args:
+        ----------
+        fingerprint : NDArray[np.uint8]
+            The packed fingerprint of the page, see layout_fingerprint.
+
+        Returns:
+        -------
+        tuple[str, float] | None
+            The document type of the nearest sample and the share of differing bits, None if
+            the index is empty.
+        """
+        if not self.labels:
+            return None
+        distances = _BIT_COUNTS[np.bitwise_xor(self.fingerprints, fingerprint)].sum(axis=1)
+        best = int(distances.argmin())
+        return self.labels[best], float(distances[best]) / (self.fingerprints.shape[1] * 8)
+
+    @classmethod
+    def build(
+        cls, samples_dir: str, known_labels: list[str] | None = None, size: int = FINGERPRINT_SIZE
+    ) -> "LayoutIndex":
+        """Build an index from a folder of labeled sample pages.
+
+        Every subfolder is named after a document type and holds the sample images of it.
+
+        Args:
+        ----------
+        samples_dir : str
+            The folder containing one subfolder per document type.
+        known_labels : list[str] | None
+            The valid document types, any subfolder name is accepted if None.
+        size : int
+            The side length of the fingerprint thumbnails.
+
+        Returns:
+        -------
+        LayoutIndex
+            The index of all samples.
+
+        Raises:
+        ------
+        ValueError
+            If a subfolder is not named after a known document type.
+        """
+        fingerprints = []
+        labels = []
+        for label in sorted(os.listdir(samples_dir)):
+            label_dir = os.path.join(samples_dir, label)
+            if label.startswith(".") or not os.path.isdir(label_dir):
+                continue
+            if known_labels is not None and label not in known_labels:
+                raise ValueError(f"Unknown document type {label}, expected one of {known_labels}.")
+            for file_name in sorted(os.listdir(label_dir)):
+                if not file_name.lower().endswith(SAMPLE_EXTENSIONS):
+                    continue
+                with Image.open(os.path.join(label_dir, file_name)) as image:
+                    fingerprints.append(layout_fingerprint(image, size))
+                labels.append(label)
+        logger.info("Indexed the layouts of %d sample documents.", len(labels))
+        packed = np.array(fingerprints, dtype=np.uint8).reshape(len(labels), size * size // 8)
+        return cls(packed, labels)
+
+    def save(self, path: str) -> None:
+        """Write the index to a NumPy archive at exactly the path given, whatever its suffix."""
+        # np.savez appends ".npz" to file names without it, np.load does not
+        with open(path, "wb") as file:
+            np.savez(file, fingerprints=self.fingerprints, labels=np.array(self.labels))
+
+    @classmethod
+    def load(cls, path: str) -> "LayoutIndex":
+        """Read an index written by save."""
+        with np.load(path) as archive:
+            return cls(archive["fingerprints"], [str(label) for label in archive["labels"]])
+
+
+def main() -> None:
+    """Build a layout index from a folder of labeled samples."""
+    parser = argparse.ArgumentParser(description="Build the layout index of sample documents")
+    parser.add_argument("samples_dir", help="folder with one subfolder per document type")
+    parser.add_argument("index_path", help="the .npz file the index is written to")
+    arguments = parser.parse_args()
+    known_labels = [identifier.name for identifier in document_type_identifier_list]
+    LayoutIndex.build(arguments.samples_dir, known_labels).save(arguments.index_path)
+
+
+if __name__ == "__main__":
+    main()
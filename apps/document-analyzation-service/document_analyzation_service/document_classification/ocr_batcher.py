@@ -0,0 +1,129 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+
+"""This module collects the pages of concurrently classified documents into batches, so that the doctr model processes them in a single call instead of one call per page."""
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable
+
+import numpy as np
+from numpy.typing import NDArray
+
+from document_analyzation_service.metrics import metrics
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+_PendingPage = tuple[NDArray[np.uint8], "Future[str]"]
+
+
+class OcrBatcher:
+    """Run the OCR of pages submitted by several threads in micro-batches.
+
+    A background thread waits for the first page, then collects further pages until the batch
+    is full or the maximum wait has passed, and runs the model once for the whole batch. Every
+    forked process starts its own background thread on first use.
+    """
+
+    def __init__(
+        self,
+        model_getter: Callable[[], Any],
+        max_batch_size: int,
+        max_wait_seconds: float,
+    ) -> None:
+        """Initialize the batcher.
+
+        :param model_getter: Returns the doctr OCR predictor.
+        :param max_batch_size: Maximum number of pages per model call, 1 disables the batching.
+        :param max_wait_seconds: Time to wait for further pages after the first one of a batch.
+        """
+        self.model_getter = model_getter
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self._queue: queue.Queue[_PendingPage] = queue.Queue()
+        self._worker: threading.Thread | None = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+
+    def recognize(self, page: NDArray[np.uint8]) -> str:
+        """Return the text found on a page.
+
+        Args:
+        ----------
+        page : NDArray[np.uint8]
+            The page as RGB array of shape (height, width, 3).
+
+        Returns:
+        -------
+        str
+            The rendered text of the page.
+        """
+        if self.max_batch_size <= 1:
+            text: str = self.model_getter()([page]).render()
+            return text
+
+        future: Future[str] = Future()
+        self._ensure_worker()
+        self._queue.put((page, future))
+        return future.result()
+
+    def _ensure_worker(self) -> None:
+        """Start the background thread of the current process, if it is not running yet."""
+        with self._lock:
+            if self._worker is None or self._pid != os.getpid():
+                # Pages queued before a fork are not processed by the child
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._worker = threading.Thread(
+                    target=self._run, name="das-ocr-batcher", daemon=True
+                )
+                self._worker.start()
+
+    def _run(self) -> None:
+        """Collect and process batches until the process exits."""
+        while True:
+            self.process_batch(self._collect_batch())
+
+    def _collect_batch(self) -> list[_PendingPage]:
+        """Wait for the first page, then for further pages until the batch is complete."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def process_batch(self, batch: list[_PendingPage]) -> None:
+        """Run the model on a batch of pages and hand the texts to the waiting callers.
+
+        Args:
+        ----------
+        batch : list[_PendingPage]
+            The pages with the futures their texts are set on. If the model fails, the
+            exception is set on every future.
+        """
+        metrics.increment("ocr_batches_total")
+        metrics.increment("ocr_batch_pages_total", len(batch))
+        logger.debug("Running the OCR on a batch of %d pages.", len(batch))
+        try:
+            result = self.model_getter()([page for page, _ in batch])
+            texts = [result_page.render() for result_page in result.pages]
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), text in zip(batch, texts):
+            future.set_result(text)
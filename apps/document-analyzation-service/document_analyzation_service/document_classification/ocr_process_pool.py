@@ -0,0 +1,163 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+
+"""This module runs the OCR in a pool of dedicated processes, so that the inference neither holds the GIL of the consumer nor blocks the I/O loop of pika. The pages are handed over through shared memory instead of being pickled."""
+
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable
+
+import numpy as np
+from numpy.typing import NDArray
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# The model of the worker process, loaded by its initializer
+_worker_model: Any = None
+
+
+def _initialize_worker(model_getter: Callable[[], Any], torch_threads: int) -> None:
+    """Limit the threads of torch and load the model once per worker process."""
+    global _worker_model
+    if torch_threads > 0:
+        try:
+            import torch
+
+            torch.set_num_threads(torch_threads)
+        except ImportError:
+            # The onnx backend runs without torch
+            pass
+    _worker_model = model_getter()
+    logger.info("OCR worker %d is ready.", os.getpid())
+
+
+def _recognize_shared_page(name: str, shape: tuple[int, ...], dtype: str) -> str:
+    """Run the OCR on a page in shared memory, in the worker process."""
+    shared_memory = SharedMemory(name=name)
+    try:
+        page: NDArray[Any] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shared_memory.buf)
+        text: str = _worker_model([page]).render()
+        # The view must be released before the shared memory can be closed
+        del page
+        return text
+    finally:
+        shared_memory.close()
+
+
+class OcrProcessPool:
+    """Run the OCR of pages in a pool of spawned worker processes.
+
+    The pool is started on first use, in every process using it. A pool whose worker crashed is
+    replaced on the next call. A pool which broke before any of its workers recognized a page,
+    e.g. because the model could not be loaded, is not replaced but marked as failed.
+    """
+
+    def __init__(
+        self, model_getter: Callable[[], Any], workers: int, torch_threads: int = 1
+    ) -> None:
+        """Initialize the pool without starting it.
+
+        :param model_getter: Returns the OCR predictor, called once in every worker. It has to
+            be a module-level function, so that it can be passed to the spawned workers.
+        :param workers: The number of worker processes.
+        :param torch_threads: The number of threads each worker lets torch use, 0 keeps the
+            default of torch.
+        """
+        self.model_getter = model_getter
+        self.workers = workers
+        self.torch_threads = torch_threads
+        self.failed = False
+        self._executor: ProcessPoolExecutor | None = None
+        self._pid: int | None = None
+        self._recognized = False
+        self._lock = threading.Lock()
+
+    def recognize(self, page: NDArray[np.uint8]) -> str:
+        """Return the text found on a page.
+
+        Args:
+        ----------
+        page : NDArray[np.uint8]
+            The page as RGB array of shape (height, width, 3).
+
+        Returns:
+        -------
+        str
+            The rendered text of the page.
+
+        Raises:
+        ------
+        BrokenProcessPool
+            If a worker died, failed is set as well if the workers could not be started.
+        """
+        executor = self._get_executor()
+        shared_memory = SharedMemory(create=True, size=max(1, page.nbytes))
+        try:
+            shared_page: NDArray[np.uint8] = np.ndarray(
+                page.shape, dtype=page.dtype, buffer=shared_memory.buf
+            )
+            shared_page[...] = page
+            del shared_page
+            future = executor.submit(
+                _recognize_shared_page, shared_memory.name, page.shape, page.dtype.str
+            )
+            text: str = future.result()
+        except BrokenProcessPool:
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+                    self.failed = not self._recognized
+            if self.failed:
+                logger.error("The OCR workers could not be started.")
+            else:
+                logger.error("An OCR worker died, the pool is restarted on the next call.")
+            raise
+        finally:
+            shared_memory.close()
+            shared_memory.unlink()
+        self._recognized = True
+        return text
+
+    def warmup(self) -> None:
+        """Start all workers and run one inference on a blank page in each of them."""
+        blank_page = np.full((256, 256, 3), 255, dtype=np.uint8)
+        threads = [
+            threading.Thread(target=self.recognize, args=(blank_page,))
+            for _ in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def shutdown(self) -> None:
+        """Stop the workers of the current process."""
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown()
+            self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Return the pool of the current process, starting it if necessary."""
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                logger.info("Starting %d OCR worker processes.", self.workers)
+                # Spawned, as forking a process with running threads and torch is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_initialize_worker,
+                    initargs=(self.model_getter, self.torch_threads),
+                )
+                self._pid = os.getpid()
+                self._recognized = False
+            return self._executor
@@ -0,0 +1,81 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+
+"""This module holds the representations of the image of a single message, so that the classification and the extraction share one decoded image instead of decoding the bytes again each."""
+
+import hashlib
+import io
+from functools import cached_property
+
+import numpy as np
+from numpy.typing import NDArray
+from PIL import Image
+
+from document_analyzation_service.utils import sniff_image_mime_type
+
+
+class DocumentContext:
+    """The image of a message, with every representation computed lazily and only once.
+
+    A context belongs to a single message and is not shared between threads.
+    """
+
+    def __init__(self, image_data: bytes) -> None:
+        """Initialize the context.
+
+        :param image_data: The raw bytes of the image, as received or fetched.
+        """
+        self.image_data = image_data
+
+    @cached_property
+    def content_hash(self) -> str:
+        """The SHA-256 hex digest of the raw image bytes."""
+        return hashlib.sha256(self.image_data).hexdigest()
+
+    @cached_property
+    def image(self) -> Image.Image:
+        """The decoded image, keeping the format of the raw bytes."""
+        image = Image.open(io.BytesIO(self.image_data))
+        image.load()
+        return image
+
+    @cached_property
+    def size(self) -> tuple[int, int]:
+        """The width and height of the image, read from its header if it is not decoded yet."""
+        if "image" in self.__dict__:
+            return self.image.size
+        with Image.open(io.BytesIO(self.image_data)) as image:
+            return image.size
+
+    def decode_reduced(self, size: tuple[int, int]) -> Image.Image:
+        """Decode the image at a reduced size, which is at least the requested size.
+
+        JPEGs are decoded at a fraction of their resolution by PIL's draft mode. All other
+        formats gain nothing from a reduced decoding, so they are decoded once at their full
+        size through the cached image, which is shared with the other representations.
+
+        Args:
+        ----------
+        size : tuple[int, int]
+            The minimum width and height needed.
+
+        Returns:
+        -------
+        Image.Image
+            The decoded image, to be resized to the exact size by the caller.
+        """
+        if "image" in self.__dict__ or sniff_image_mime_type(self.image_data) != "image/jpeg":
+            return self.image
+        image = Image.open(io.BytesIO(self.image_data))
+        image.draft(image.mode, size)
+        image.load()
+        return image
+
+    @cached_property
+    def rgb_array(self) -> NDArray[np.uint8]:
+        """The image as RGB array of shape (height, width, 3), as expected by the OCR."""
+        image = self.image if self.image.mode == "RGB" else self.image.convert("RGB")
+        return np.asarray(image)
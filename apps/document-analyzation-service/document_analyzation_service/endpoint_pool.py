@@ -0,0 +1,290 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+
+"""This module balances the extraction requests over several Azure deployments of the same model, tracking the health of every deployment and failing over to the others."""
+
+import json
+import logging
+import os
+import threading
+from typing import Awaitable, Callable, NamedTuple, TypeVar
+from urllib.parse import urlparse
+
+from document_analyzation_service.azure_client import AzureCredentials
+from document_analyzation_service.circuit_breaker import CircuitBreaker, CircuitOpenError
+from document_analyzation_service.metrics import labelled, metrics
+from document_analyzation_service.rate_limiter import (
+    AZURE_RPM_LIMIT,
+    AZURE_TPM_LIMIT,
+    RateLimitQuota,
+)
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+AZURE_ENDPOINT_FAILURE_THRESHOLD = int(os.getenv("AZURE_ENDPOINT_FAILURE_THRESHOLD", "3"))
+AZURE_ENDPOINT_RECOVERY_SECONDS = float(os.getenv("AZURE_ENDPOINT_RECOVERY_SECONDS", "30"))
+
+Result = TypeVar("Result")
+
+
+class AzureEndpoint(NamedTuple):
+    """A deployment of the model requests can be sent to."""
+
+    name: str
+    credentials: AzureCredentials
+    model: str
+    weight: float
+    """The share of the requests relative to the other deployments, e.g. by their quota."""
+    quota: RateLimitQuota = RateLimitQuota(AZURE_RPM_LIMIT, AZURE_TPM_LIMIT)
+    """The requests and tokens per minute of the deployment, enforced by the rate limiter."""
+
+
+def parse_azure_endpoints(value: str) -> list[AzureEndpoint]:
+    """Parse the deployments, given as JSON list of objects.
+
+    Every object has an "endpoint" and optionally a "name", "api_key" or the "api_key_env"
+    variable holding it, an "api_version", a "model", a "weight" and the quotas "rpm_limit"
+    and "tpm_limit" of the deployment. Missing values fall back to AZURE_API_KEY, API_VERSION,
+    GPT_MODEL, a weight of 1, AZURE_RPM_LIMIT and AZURE_TPM_LIMIT.
+
+    Args:
+    ----------
+    value : str
+        JSON like [{"endpoint": "https://west.openai.azure.com", "weight": 2}], empty for none.
+
+    Returns:
+    -------
+    list[AzureEndpoint]
+        The deployments, an empty list if none are configured.
+
+    Raises:
+    ------
+    ValueError
+        If a deployment has no positive weight or two deployments have the same name.
+    """
+    if not value:
+        return []
+    endpoints = []
+    for entry in json.loads(value):
+        api_key = entry.get("api_key") or os.getenv(entry.get("api_key_env", "AZURE_API_KEY"))
+        model = str(entry.get("model") or os.getenv("GPT_MODEL"))
+        endpoint = AzureEndpoint(
+            str(entry.get("name") or f"{urlparse(entry['endpoint']).hostname}/{model}"),
+            AzureCredentials(
+                entry["endpoint"], api_key, entry.get("api_version") or os.getenv("API_VERSION")
+            ),
+            model,
+            float(entry.get("weight", 1)),
+            RateLimitQuota(
+                int(entry.get("rpm_limit", AZURE_RPM_LIMIT)),
+                int(entry.get("tpm_limit", AZURE_TPM_LIMIT)),
+            ),
+        )
+        if endpoint.weight <= 0:
+            raise ValueError(f"The weight of the deployment {endpoint.name} must be positive.")
+        endpoints.append(endpoint)
+    names = [endpoint.name for endpoint in endpoints]
+    if len(set(names)) != len(names):
+        raise ValueError(f"The deployment names {names} are not unique.")
+    return endpoints
+
+
+AZURE_ENDPOINTS = parse_azure_endpoints(os.getenv("AZURE_ENDPOINTS", ""))
+
+
+class EndpointPool:
+    """Send every request to the deployment with the fewest outstanding requests per weight.
+
+    Every deployment has a circuit breaker, so that an unhealthy deployment receives no
+    requests until its probes succeed again. A request failing with an error which another
+    deployment may not have, e.g. an outage or an exhausted quota, is retried on the next
+    deployment.
+    """
+
+    def __init__(
+        self,
+        endpoints: list[AzureEndpoint],
+        failure_threshold: int,
+        recovery_seconds: float,
+        is_failure: Callable[[Exception], bool] = lambda exception: True,
+        should_fail_over: Callable[[Exception], bool] = lambda exception: True,
+    ) -> None:
+        """Initialize the pool.
+
+        :param endpoints: The deployments, at least one.
+        :param failure_threshold: The consecutive failures after which a deployment is
+            considered unhealthy, 0 disables the health tracking.
+        :param recovery_seconds: The seconds an unhealthy deployment receives no requests.
+        :param is_failure: Whether an error indicates that a deployment is unhealthy.
+        :param should_fail_over: Whether a request failing with an error is sent to another
+            deployment.
+        """
+        if not endpoints:
+            raise ValueError("The endpoint pool needs at least one deployment.")
+        self.endpoints = endpoints
+        self.should_fail_over = should_fail_over
+        self._breakers = {
+            endpoint.name: CircuitBreaker(
+                f"endpoint:{endpoint.name}",
+                failure_threshold,
+                recovery_seconds,
+                is_failure=is_failure,
+            )
+            for endpoint in endpoints
+        }
+        self._outstanding = {endpoint.name: 0 for endpoint in endpoints}
+        self._served = {endpoint.name: 0 for endpoint in endpoints}
+        self._lock = threading.Lock()
+
+    def outstanding(self, name: str) -> int:
+        """Return the number of requests in flight to a deployment."""
+        with self._lock:
+            return self._outstanding[name]
+
+    def acquire(self, excluded: set[str] | None = None) -> AzureEndpoint:
+        """Select the deployment for a request, which has to be followed by release.
+
+        Among the healthy deployments, the one with the fewest outstanding requests per weight
+        is selected, ties are broken by the requests it served per weight, so that sequential
+        requests are distributed by the weights as well.
+
+        Args:
+        ----------
+        excluded : set[str] | None
+            The names of the deployments which must not be selected.
+
+        Returns:
+        -------
+        AzureEndpoint
+            The selected deployment.
+
+        Raises:
+        ------
+        CircuitOpenError
+            If no deployment is available.
+        """
+        excluded = excluded or set()
+        retry_after = float("inf")
+        with self._lock:
+            candidates = sorted(
+                (endpoint for endpoint in self.endpoints if endpoint.name not in excluded),
+                key=lambda endpoint: (
+                    self._outstanding[endpoint.name] / endpoint.weight,
+                    self._served[endpoint.name] / endpoint.weight,
+                ),
+            )
+            for endpoint in candidates:
+                try:
+                    self._breakers[endpoint.name].before_call()
+                except CircuitOpenError as e:
+                    retry_after = min(retry_after, e.retry_after)
+                    continue
+                self._outstanding[endpoint.name] += 1
+                self._record_outstanding(endpoint)
+                return endpoint
+        raise CircuitOpenError("endpoints", 0.0 if retry_after == float("inf") else retry_after)
+
+    def release(self, endpoint: AzureEndpoint, exception: BaseException | None = None) -> None:
+        """Complete a request to a deployment and update its health.
+
+        Args:
+        ----------
+        endpoint : AzureEndpoint
+            The deployment returned by acquire.
+        exception : BaseException | None
+            The error of the request, None if it succeeded. A cancellation, i.e. no Exception,
+            is neither a success nor a failure of the deployment.
+        """
+        with self._lock:
+            self._outstanding[endpoint.name] -= 1
+            self._served[endpoint.name] += 1
+            self._record_outstanding(endpoint)
+        metrics.increment(labelled("endpoint_requests_total", endpoint=endpoint.name))
+        if exception is None:
+            self._breakers[endpoint.name].record_success()
+        elif isinstance(exception, Exception):
+            self._breakers[endpoint.name].record_failure(exception)
+        else:
+            self._breakers[endpoint.name].record_cancellation()
+
+    def call(self, function: Callable[[AzureEndpoint], Result]) -> Result:
+        """Send a request to the selected deployment, failing over to the others.
+
+        Args:
+        ----------
+        function : Callable[[AzureEndpoint], Result]
+            Sends the request to the given deployment.
+
+        Returns:
+        -------
+        Result
+            The result of the first successful request.
+
+        Raises:
+        ------
+        CircuitOpenError
+            If no deployment is available.
+        """
+        tried: set[str] = set()
+        while True:
+            endpoint = self._acquire_next(tried)
+            try:
+                result = function(endpoint)
+            except Exception as e:
+                self.release(endpoint, e)
+                tried.add(endpoint.name)
+                if not self._fail_over(endpoint, e, tried):
+                    raise
+                continue
+            except BaseException as e:
+                self.release(endpoint, e)
+                raise
+            self.release(endpoint)
+            return result
+
+    async def call_async(self, function: Callable[[AzureEndpoint], Awaitable[Result]]) -> Result:
+        """Send a request with a coroutine function, see call."""
+        tried: set[str] = set()
+        while True:
+            endpoint = self._acquire_next(tried)
+            try:
+                result = await function(endpoint)
+            except Exception as e:
+                self.release(endpoint, e)
+                tried.add(endpoint.name)
+                if not self._fail_over(endpoint, e, tried):
+                    raise
+                continue
+            except BaseException as e:
+                self.release(endpoint, e)
+                raise
+            self.release(endpoint)
+            return result
+
+    def _acquire_next(self, tried: set[str]) -> AzureEndpoint:
+        """Select a deployment not tried yet, see acquire."""
+        try:
+            return self.acquire(tried)
+        except CircuitOpenError:
+            if tried:
+                logger.warning("No other deployment is available for the failover.")
+            raise
+
+    def _fail_over(self, endpoint: AzureEndpoint, exception: Exception, tried: set[str]) -> bool:
+        """Return whether a failed request is sent to another deployment."""
+        if not self.should_fail_over(exception) or len(tried) >= len(self.endpoints):
+            return False
+        logger.warning("Deployment %s failed, failing over: %s", endpoint.name, exception)
+        metrics.increment(labelled("endpoint_failovers_total", endpoint=endpoint.name))
+        return True
+
+    def _record_outstanding(self, endpoint: AzureEndpoint) -> None:
+        """Update the gauge of the outstanding requests, the lock has to be held."""
+        metrics.set(
+            labelled("endpoint_outstanding_requests", endpoint=endpoint.name),
+            self._outstanding[endpoint.name],
+        )
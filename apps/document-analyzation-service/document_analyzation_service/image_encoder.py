@@ -0,0 +1,284 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+
+"""This module encodes the images sent to the Azure API. Besides keeping the original format, it can re-encode them as grayscale, JPEG or WebP, or search for the smallest encoding which stays legible according to its structural similarity to the original."""
+
+import io
+import logging
+import os
+from typing import Any, NamedTuple
+
+import numpy as np
+from numpy.typing import NDArray
+from PIL import Image
+
+from document_analyzation_service.metrics import labelled, metrics
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# "original" keeps the format of the upload, "jpeg" and "webp" re-encode with the configured
+# quality, "adaptive" searches the smallest encoding above the SSIM threshold
+IMAGE_ENCODING = os.getenv("IMAGE_ENCODING", "original").lower()
+IMAGE_ENCODING_QUALITY = int(os.getenv("IMAGE_ENCODING_QUALITY", "90"))
+# Drops the color with every encoding, "original" then re-encodes the upload in its own format
+IMAGE_ENCODING_GRAYSCALE = os.getenv("IMAGE_ENCODING_GRAYSCALE", "false").lower() == "true"
+ADAPTIVE_SSIM_THRESHOLD = float(os.getenv("ADAPTIVE_SSIM_THRESHOLD", "0.95"))
+ADAPTIVE_MIN_QUALITY = int(os.getenv("ADAPTIVE_MIN_QUALITY", "30"))
+ADAPTIVE_MAX_QUALITY = int(os.getenv("ADAPTIVE_MAX_QUALITY", "95"))
+ADAPTIVE_FORMATS = tuple(
+    image_format.strip().upper()
+    for image_format in os.getenv("ADAPTIVE_FORMATS", "WEBP,JPEG").split(",")
+    if image_format.strip()
+)
+SSIM_WINDOW_SIZE = 7
+
+# Constants of the SSIM for 8 bit images
+_SSIM_C1 = (0.01 * 255) ** 2
+_SSIM_C2 = (0.03 * 255) ** 2
+
+
+class EncodedImage(NamedTuple):
+    """An encoded image with its MIME type."""
+
+    data: bytes
+    mime_type: str
+
+
+def encoding_settings() -> dict[str, Any]:
+    """Return the configured encoding, as part of the fingerprint of cached results."""
+    return {
+        "encoding": IMAGE_ENCODING,
+        "quality": IMAGE_ENCODING_QUALITY,
+        "grayscale": IMAGE_ENCODING_GRAYSCALE,
+        "ssim_threshold": ADAPTIVE_SSIM_THRESHOLD,
+        "quality_range": [ADAPTIVE_MIN_QUALITY, ADAPTIVE_MAX_QUALITY],
+        "formats": list(ADAPTIVE_FORMATS),
+    }
+
+
+def _window_mean(values: NDArray[np.float64], window_size: int) -> NDArray[np.float64]:
+    """Return the mean of every complete square window of the array, using summed areas."""
+    summed = np.zeros((values.shape[0] + 1, values.shape[1] + 1))
+    summed[1:, 1:] = values.cumsum(axis=0).cumsum(axis=1)
+    window_sums = (
+        summed[window_size:, window_size:]
+        - summed[:-window_size, window_size:]
+        - summed[window_size:, :-window_size]
+        + summed[:-window_size, :-window_size]
+    )
+    result: NDArray[np.float64] = window_sums / (window_size * window_size)
+    return result
+
+
+def structural_similarity(
+    reference: NDArray[Any], candidate: NDArray[Any], window_size: int = SSIM_WINDOW_SIZE
+) -> float:
+    """Compute the mean structural similarity (SSIM) of two grayscale images.
+
+    Args:
+    ----------
+    reference : NDArray[Any]
+        The original image as 2D array of 8 bit luminance values.
+    candidate : NDArray[Any]
+        The encoded image of the same shape.
+    window_size : int
+        The side length of the square windows the statistics are computed over.
+
+    Returns:
+    -------
+    float
+        The SSIM, 1.0 for identical images.
+
+    Raises:
+    ------
+    ValueError
+        If the images differ in shape.
+    """
+    if reference.shape != candidate.shape:
+        raise ValueError(
+            f"Cannot compare images of shapes {reference.shape} and {candidate.shape}."
+        )
+    window_size = max(1, min(window_size, *reference.shape))
+    x = reference.astype(np.float64)
+    y = candidate.astype(np.float64)
+
+    mean_x = _window_mean(x, window_size)
+    mean_y = _window_mean(y, window_size)
+    variance_x = _window_mean(x * x, window_size) - mean_x * mean_x
+    variance_y = _window_mean(y * y, window_size) - mean_y * mean_y
+    covariance = _window_mean(x * y, window_size) - mean_x * mean_y
+
+    ssim_map = ((2 * mean_x * mean_y + _SSIM_C1) * (2 * covariance + _SSIM_C2)) / (
+        (mean_x * mean_x + mean_y * mean_y + _SSIM_C1) * (variance_x + variance_y + _SSIM_C2)
+    )
+    return float(ssim_map.mean())
+
+
+def encode_image(
+    image: Image.Image, image_format: str, quality: int, grayscale: bool = False
+) -> EncodedImage:
+    """Encode an image in the given format.
+
+    Args:
+    ----------
+    image : Image.Image
+        The image to encode.
+    image_format : str
+        The PIL format, JPEG, WEBP or PNG.
+    quality : int
+        The quality of the lossy formats, between 1 and 100.
+    grayscale : bool
+        Whether the color information is dropped.
+
+    Returns:
+    -------
+    EncodedImage
+        The encoded image.
+    """
+    image_format = image_format.upper()
+    if grayscale:
+        image = image.convert("L")
+    elif image_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    elif image_format == "WEBP" and image.mode not in ("RGB", "RGBA", "L"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+    buffer = io.BytesIO()
+    if image_format == "PNG":
+        image.save(buffer, format="PNG", optimize=True)
+    else:
+        image.save(buffer, format=image_format, quality=quality)
+    return EncodedImage(buffer.getvalue(), f"image/{image_format.lower()}")
+
+
+def _luminance(image: Image.Image) -> NDArray[np.uint8]:
+    """Return the luminance of an image as 2D array."""
+    return np.asarray(image.convert("L"))
+
+
+def encode_adaptive(
+    image: Image.Image,
+    ssim_threshold: float = ADAPTIVE_SSIM_THRESHOLD,
+    image_formats: tuple[str, ...] = ADAPTIVE_FORMATS,
+    min_quality: int = ADAPTIVE_MIN_QUALITY,
+    max_quality: int = ADAPTIVE_MAX_QUALITY,
+    grayscale: bool = IMAGE_ENCODING_GRAYSCALE,
+) -> EncodedImage:
+    """Search the smallest encoding whose SSIM to the image stays above the threshold.
+
+    The lowest sufficient quality is found by a binary search per format, as the SSIM grows
+    with the quality. The smallest of the encodings found is returned.
+
+    Args:
+    ----------
+    image : Image.Image
+        The image to encode, already downscaled.
+    ssim_threshold : float
+        The minimum SSIM of the luminance of the encoding, keeping the text legible.
+    image_formats : tuple[str, ...]
+        The formats to try.
+    min_quality : int
+        The lowest quality to try.
+    max_quality : int
+        The highest quality to try, used if no lower one reaches the threshold.
+    grayscale : bool
+        Whether the color information is dropped.
+
+    Returns:
+    -------
+    EncodedImage
+        The smallest encoding reaching the threshold.
+    """
+    reference = _luminance(image)
+    candidates = []
+    for image_format in image_formats:
+        best = None
+        low, high = min_quality, max_quality
+        while low <= high:
+            quality = (low + high) // 2
+            encoded = encode_image(image, image_format, quality, grayscale)
+            with Image.open(io.BytesIO(encoded.data)) as decoded:
+                similarity = structural_similarity(reference, _luminance(decoded))
+            if similarity >= ssim_threshold:
+                best = encoded
+                high = quality - 1
+            else:
+                low = quality + 1
+        candidates.append(best or encode_image(image, image_format, max_quality, grayscale))
+    return min(candidates, key=lambda candidate: len(candidate.data))
+
+
+def encode_for_extraction(
+    image: Image.Image,
+    original: EncodedImage | None = None,
+    encoding: str = IMAGE_ENCODING,
+    grayscale: bool = IMAGE_ENCODING_GRAYSCALE,
+) -> EncodedImage:
+    """Encode an image with the configured encoding.
+
+    Args:
+    ----------
+    image : Image.Image
+        The decoded, possibly downscaled image.
+    original : EncodedImage | None
+        The uploaded bytes, if they can be sent as they are. Re-encodings are only used if
+        they are smaller.
+    encoding : str
+        The encoding, "original", "jpeg", "webp" or "adaptive".
+    grayscale : bool
+        Whether the color information is dropped. The original bytes are never used then, so
+        that the image is re-encoded in its own format with the "original" encoding.
+
+    Returns:
+    -------
+    EncodedImage
+        The image to send to the Azure API.
+    """
+    if grayscale:
+        original = None
+    if encoding == "adaptive":
+        encoded = encode_adaptive(image, grayscale=grayscale)
+    elif encoding in ("jpeg", "webp"):
+        encoded = encode_image(image, encoding.upper(), IMAGE_ENCODING_QUALITY, grayscale)
+    elif original is not None:
+        return original
+    elif image.format in ("PNG", "WEBP"):
+        encoded = encode_image(image, image.format, IMAGE_ENCODING_QUALITY, grayscale)
+    else:
+        encoded = encode_image(image, "JPEG", IMAGE_ENCODING_QUALITY, grayscale)
+
+    if original is not None and len(original.data) <= len(encoded.data):
+        return original
+    return encoded
+
+
+def record_encoding(document_type: str, bytes_before: int, bytes_after: int) -> None:
+    """Count the bytes of a document before and after its encoding.
+
+    Args:
+    ----------
+    document_type : str
+        The type of the document.
+    bytes_before : int
+        The size of the uploaded image.
+    bytes_after : int
+        The size of the image sent to the Azure API.
+    """
+    metrics.increment(
+        labelled("image_bytes_before_total", document_type=document_type), bytes_before
+    )
+    metrics.increment(
+        labelled("image_bytes_after_total", document_type=document_type), bytes_after
+    )
+    metrics.increment(labelled("images_encoded_total", document_type=document_type))
+    logger.info(
+        "Encoded %s image from %d to %d bytes (%.0f%%).",
+        document_type,
+        bytes_before,
+        bytes_after,
+        100 * bytes_after / bytes_before if bytes_before else 100,
+    )
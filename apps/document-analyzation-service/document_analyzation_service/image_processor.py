@@ -6,30 +6,277 @@
 
 """This module provides functions to process images and interact with the Azure API to extract document data."""
 
+import asyncio
+import base64
+import hashlib
 import io
+import json
 import logging
+import math
 import os
 import time
-from typing import Any
+from functools import lru_cache
+from typing import Any, NamedTuple, Type, Union
 
-from openai import AzureOpenAI
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    AsyncAzureOpenAI,
+    AzureOpenAI,
+    RateLimitError,
+)
+from openai.types.chat import ChatCompletionMessageParam
 from openai.types.chat.parsed_chat_completion import ParsedChatCompletion
 from PIL import Image
 
+from document_analyzation_service.azure_client import get_async_azure_client, get_azure_client
+from document_analyzation_service.circuit_breaker import (
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    CIRCUIT_BREAKER_HALF_OPEN_PROBES,
+    CIRCUIT_BREAKER_RECOVERY_SECONDS,
+    CircuitBreaker,
+    CircuitOpenError,
+)
 from document_analyzation_service.delivery_note import DeliveryNoteDocument
+from document_analyzation_service.document_context import DocumentContext
+from document_analyzation_service.endpoint_pool import (
+    AZURE_ENDPOINT_FAILURE_THRESHOLD,
+    AZURE_ENDPOINT_RECOVERY_SECONDS,
+    AZURE_ENDPOINTS,
+    AzureEndpoint,
+    EndpointPool,
+)
+from document_analyzation_service.image_encoder import (
+    IMAGE_ENCODING,
+    IMAGE_ENCODING_GRAYSCALE,
+    EncodedImage,
+    encode_for_extraction,
+    encoding_settings,
+    record_encoding,
+)
 from document_analyzation_service.ecmr_schema import ECMRDocument
+from document_analyzation_service.metrics import metrics
 from document_analyzation_service.pallet_note_schema import PalletNoteDocument
-from document_analyzation_service.utils import DocumentType, image_to_data_url, make_serializable
+from document_analyzation_service.rate_limiter import (
+    RateLimitQuota,
+    RateLimitTimeout,
+    get_rate_limiter,
+)
+from document_analyzation_service.single_flight import AsyncSingleFlight, SingleFlight, content_key
+from document_analyzation_service.utils import (
+    LLM_IMAGE_MIME_TYPES,
+    DocumentType,
+    bytes_to_data_url,
+    make_serializable,
+    sniff_image_mime_type,
+)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
 # mypy: disable-error-code=return-value
 
+DocumentSchema = Type[Union[PalletNoteDocument, DeliveryNoteDocument, ECMRDocument]]
+
+MAX_AZURE_ATTEMPTS = 2
+
+_extraction_flights: SingleFlight[object] = SingleFlight("extraction")
+_async_extraction_flights: AsyncSingleFlight[object] = AsyncSingleFlight("extraction")
+
+
+class ImageSizeLimit(NamedTuple):
+    """The size images of a document type are downscaled to before the extraction."""
+
+    max_long_side: int
+    """Maximum length of the longer side in pixels, 0 disables the limit."""
+    max_pixels: int
+    """Maximum number of pixels, 0 disables the limit."""
+
+
+def parse_image_size_limits(value: str) -> dict[str, ImageSizeLimit]:
+    """Parse the per document type size limits, given as JSON object by document type.
+
+    Args:
+    ----------
+    value : str
+        JSON like {"CMR": {"max_long_side": 2560, "max_pixels": 0}}, empty for no limits.
+
+    Returns:
+    -------
+    dict[str, ImageSizeLimit]
+        The size limit by document type, falling back to the default limits for missing keys.
+    """
+    if not value:
+        return {}
+    return {
+        document_type: ImageSizeLimit(
+            int(limit.get("max_long_side", IMAGE_MAX_LONG_SIDE)),
+            int(limit.get("max_pixels", IMAGE_MAX_PIXELS)),
+        )
+        for document_type, limit in json.loads(value).items()
+    }
+
+
+# The Azure API scales images into 2048 x 2048 anyway, larger images only cost upload and time
+IMAGE_MAX_LONG_SIDE = int(os.getenv("IMAGE_MAX_LONG_SIDE", "2048"))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "0"))
+IMAGE_SIZE_LIMITS = parse_image_size_limits(os.getenv("IMAGE_SIZE_LIMITS", ""))
+# The completion tokens reserved for a response in the rate limit, before its usage is known
+EXPECTED_COMPLETION_TOKENS = int(os.getenv("EXPECTED_COMPLETION_TOKENS", "1000"))
+
+
+class TransientProcessingError(Exception):
+    """Raised when the document data could not be extracted, but a later attempt may succeed."""
+
+
+class ExtractionUnavailableError(TransientProcessingError):
+    """Raised when the extraction was not attempted, because the circuit breaker is open."""
+
+    def __init__(self, message: str, retry_after: float = 0.0) -> None:
+        """Initialize the error.
+
+        :param message: The description of the error.
+        :param retry_after: The seconds until the circuit breaker lets requests through again.
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_outage(exception: Exception) -> bool:
+    """Return whether an error of the Azure API indicates that it is unavailable.
+
+    Connection errors, timeouts, server errors and the unavailability of all deployments do,
+    whereas client errors like an invalid request or an exhausted quota mean that the API
+    responded.
+    """
+    if isinstance(exception, APIStatusError):
+        return exception.status_code >= 500
+    return isinstance(exception, (APIConnectionError, CircuitOpenError))
+
+
+def should_fail_over(exception: Exception) -> bool:
+    """Return whether a request failing with the error may succeed on another deployment."""
+    return is_outage(exception) or isinstance(exception, (RateLimitError, RateLimitTimeout))
+
+
+_extraction_breaker = CircuitBreaker(
+    "extraction",
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    CIRCUIT_BREAKER_RECOVERY_SECONDS,
+    CIRCUIT_BREAKER_HALF_OPEN_PROBES,
+    is_failure=is_outage,
+)
+
+# The requests are balanced over the deployments in AZURE_ENDPOINTS, if any are configured
+_endpoint_pool = (
+    EndpointPool(
+        AZURE_ENDPOINTS,
+        AZURE_ENDPOINT_FAILURE_THRESHOLD,
+        AZURE_ENDPOINT_RECOVERY_SECONDS,
+        is_failure=is_outage,
+        should_fail_over=should_fail_over,
+    )
+    if AZURE_ENDPOINTS
+    else None
+)
+
+
+def image_size_limit(document_type: str) -> ImageSizeLimit:
+    """Return the size images of the given document type are downscaled to."""
+    return IMAGE_SIZE_LIMITS.get(
+        document_type, ImageSizeLimit(IMAGE_MAX_LONG_SIDE, IMAGE_MAX_PIXELS)
+    )
+
+
+def compute_scale_factor(size: tuple[int, int], limit: ImageSizeLimit) -> float:
+    """Compute the factor an image has to be scaled by to fit into the size limit.
+
+    Args:
+    ----------
+    size : tuple[int, int]
+        The width and height of the image.
+    limit : ImageSizeLimit
+        The size limit of the document type.
+
+    Returns:
+    -------
+    float
+        The scale factor, 1.0 if the image already fits, images are never upscaled.
+    """
+    width, height = size
+    scale_factor = 1.0
+    if limit.max_long_side > 0 and max(width, height) > limit.max_long_side:
+        scale_factor = limit.max_long_side / max(width, height)
+    if limit.max_pixels > 0 and width * height * scale_factor**2 > limit.max_pixels:
+        scale_factor = (limit.max_pixels / (width * height)) ** 0.5
+    return scale_factor
+
+
+def prepare_image_for_extraction(
+    document: DocumentContext, document_type: str
+) -> tuple[str, float]:
+    """Downscale and encode the image of a document and build its Data URL.
+
+    Images which fit into the size limit of their type are passed on unchanged, as long as
+    their format is accepted and neither another encoding nor grayscale is configured. Larger
+    JPEGs are decoded at a reduced size instead of decoding them at full resolution first.
+
+    Args:
+    ----------
+    document : DocumentContext
+        The context of the image.
+    document_type : str
+        The type of the document, selecting the size limit.
+
+    Returns:
+    -------
+    tuple[str, float]
+        The Data URL of the image sent to the Azure API and the factor it was scaled by.
+    """
+    mime_type = sniff_image_mime_type(document.image_data)
+    original = (
+        EncodedImage(document.image_data, str(mime_type))
+        if mime_type in LLM_IMAGE_MIME_TYPES
+        else None
+    )
+    scale_factor = min(1.0, compute_scale_factor(document.size, image_size_limit(document_type)))
+
+    if scale_factor == 1.0:
+        if original is not None and IMAGE_ENCODING == "original" and not IMAGE_ENCODING_GRAYSCALE:
+            encoded = original
+        else:
+            encoded = encode_for_extraction(
+                document.image, original, IMAGE_ENCODING, IMAGE_ENCODING_GRAYSCALE
+            )
+    else:
+        width, height = document.size
+        target_size = (max(1, round(width * scale_factor)), max(1, round(height * scale_factor)))
+        image = document.decode_reduced(target_size)
+        if image.size != target_size:
+            image_format = image.format
+            image = image.resize(target_size, Image.Resampling.LANCZOS)
+            image.format = image_format
+        encoded = encode_for_extraction(
+            image, encoding=IMAGE_ENCODING, grayscale=IMAGE_ENCODING_GRAYSCALE
+        )
+        metrics.increment("images_downscaled_total")
+        logger.info(
+            "Downscaled image from %dx%d to %dx%d for document type %s.",
+            width,
+            height,
+            *target_size,
+            document_type,
+        )
+
+    record_encoding(document_type, len(document.image_data), len(encoded.data))
+    return bytes_to_data_url(encoded.data, encoded.mime_type), scale_factor
+
 
 def convert_image_to_data_url(image_data: bytes) -> str:
     """Convert binary image data to a Data URL.
 
+    Formats the LLM accepts are encoded as they are, any other image is converted first.
+
     Args:
     ----------
     image_data : bytes
@@ -40,13 +287,20 @@ def convert_image_to_data_url(image_data: bytes) -> str:
     str
         The Data URL representation of the image.
     """
-    image = Image.open(io.BytesIO(image_data))
-    data_url = image_to_data_url(image)
-    return data_url
+    mime_type = sniff_image_mime_type(image_data)
+    if mime_type in LLM_IMAGE_MIME_TYPES:
+        return bytes_to_data_url(image_data, str(mime_type))
+    with Image.open(io.BytesIO(image_data)) as image:
+        encoded = encode_for_extraction(image, encoding="original")
+    return bytes_to_data_url(encoded.data, encoded.mime_type)
 
 
 def process_image(
-    data_url: str, image_uuid: str, message_pattern: str, document_type: str
+    data_url: str,
+    image_uuid: str,
+    message_pattern: str,
+    document_type: str,
+    scale_factor: float = 1.0,
 ) -> dict[str, Any]:
     """Process an image Data URL and extracting document data using Azure API.
 
@@ -60,13 +314,20 @@ def process_image(
         Topic name for sending the result.
     document_type : str
         The type of document to be processed.
+    scale_factor : float
+        The factor the image was downscaled by before the extraction.
 
     Returns:
     -------
     dict[str, Any]
         The resulting event of the image processing.
+
+    Raises:
+    ------
+    ExtractionUnavailableError
+        If the extraction was not attempted, because the circuit breaker is open.
     """
-    max_attempts = 2
+    max_attempts = MAX_AZURE_ATTEMPTS
     attempt = 0
     last_exception = None
 
@@ -77,41 +338,269 @@ def process_image(
 
         except Exception as e:
             last_exception = e
-            if "401" in str(last_exception):
-                logger.error("Unauthorized error (401). Azure Environment file not adjusted.")
-                event = {
-                    "status": "error",
-                    "message": "Azure Environment file not adjusted. Please check your .env file configuration for Azure credentials.",
-                    "error_details": str(e),
-                }
+            if _is_unauthorized(e):
+                event = _unauthorized_event(e)
                 # No need to retry on authentication error
                 break
+            if isinstance(e, CircuitOpenError):
+                # The extraction was not attempted, the message is requeued instead
+                raise ExtractionUnavailableError(str(e), e.retry_after) from e
+            if _is_permanent(e):
+                event = processing_failed_event(e)
+                break
 
             logger.warning(f"Attempt {attempt + 1} failed: {str(e)}")
             attempt += 1
             time.sleep(1)  # short delay before retrying
     else:
         # Only executed if the loop was not broken, meaning all attempts failed
-        logger.error(f"Error while processing the image: {str(last_exception)}")
-        event = {
-            "status": "error",
-            "message": "An error occurred while processing the image.",
-            "error_details": str(last_exception),
-        }
+        event = processing_failed_event(last_exception)
+
+    return build_result_event(event, image_uuid, message_pattern, document_type, scale_factor)
+
 
+async def process_image_async(
+    data_url: str,
+    image_uuid: str,
+    message_pattern: str,
+    document_type: str,
+    scale_factor: float = 1.0,
+) -> dict[str, Any]:
+    """Process an image Data URL with the asynchronous Azure client, see process_image.
+
+    Args:
+    ----------
+    data_url : str
+        The Data URL representation of the image.
+    image_uuid : str
+        The unique identifier for the image.
+    message_pattern : str
+        Topic name for sending the result.
+    document_type : str
+        The type of document to be processed.
+    scale_factor : float
+        The factor the image was downscaled by before the extraction.
+
+    Returns:
+    -------
+    dict[str, Any]
+        The resulting event of the image processing.
+    """
+    last_exception = None
+
+    for attempt in range(MAX_AZURE_ATTEMPTS):
+        try:
+            event = await process_image_with_azure_async(data_url, document_type=document_type)
+            break
+        except Exception as e:
+            last_exception = e
+            if _is_unauthorized(e):
+                event = _unauthorized_event(e)
+                break
+            if isinstance(e, CircuitOpenError):
+                raise ExtractionUnavailableError(str(e), e.retry_after) from e
+            if _is_permanent(e):
+                event = processing_failed_event(e)
+                break
+
+            logger.warning(f"Attempt {attempt + 1} failed: {str(e)}")
+            await asyncio.sleep(1)
+    else:
+        event = processing_failed_event(last_exception)
+
+    return build_result_event(event, image_uuid, message_pattern, document_type, scale_factor)
+
+
+def extract_document_data(data_url: str, document_type: str) -> object:
+    """Make a single attempt to extract the document data, leaving retries to the caller.
+
+    Args:
+    ----------
+    data_url : str
+        The Data URL representation of the image.
+    document_type : str
+        The type of document to be processed.
+
+    Returns:
+    -------
+    object
+        The serialized result, or an error event if the Azure credentials are invalid or the
+        API rejected the request.
+
+    Raises:
+    ------
+    ExtractionUnavailableError
+        If the extraction was not attempted, because the circuit breaker is open.
+    TransientProcessingError
+        If the extraction failed for any other reason.
+    """
+    try:
+        return process_image_with_azure(data_url, document_type=document_type)
+    except CircuitOpenError as e:
+        raise ExtractionUnavailableError(str(e), e.retry_after) from e
+    except Exception as e:
+        if _is_unauthorized(e):
+            return _unauthorized_event(e)
+        if _is_permanent(e):
+            return processing_failed_event(e)
+        raise TransientProcessingError(str(e)) from e
+
+
+async def extract_document_data_async(data_url: str, document_type: str) -> object:
+    """Make a single attempt to extract the document data, see extract_document_data.
+
+    Args:
+    ----------
+    data_url : str
+        The Data URL representation of the image.
+    document_type : str
+        The type of document to be processed.
+
+    Returns:
+    -------
+    object
+        The serialized result, or an error event if the Azure credentials are invalid or the
+        API rejected the request.
+
+    Raises:
+    ------
+    ExtractionUnavailableError
+        If the extraction was not attempted, because the circuit breaker is open.
+    TransientProcessingError
+        If the extraction failed for any other reason.
+    """
+    try:
+        return await process_image_with_azure_async(data_url, document_type=document_type)
+    except CircuitOpenError as e:
+        raise ExtractionUnavailableError(str(e), e.retry_after) from e
+    except Exception as e:
+        if _is_unauthorized(e):
+            return _unauthorized_event(e)
+        if _is_permanent(e):
+            return processing_failed_event(e)
+        raise TransientProcessingError(str(e)) from e
+
+
+def build_result_event(
+    event: object,
+    image_uuid: str,
+    message_pattern: str,
+    document_type: str,
+    scale_factor: float = 1.0,
+) -> dict[str, Any]:
+    """Wrap an analysis result into the event sent to the storage service.
+
+    Args:
+    ----------
+    event : object
+        The serialized analysis result or error event.
+    image_uuid : str
+        The unique identifier for the image.
+    message_pattern : str
+        Topic name for sending the result.
+    document_type : str
+        The type of the processed document.
+    scale_factor : float
+        The factor the image was downscaled by before the extraction.
+
+    Returns:
+    -------
+    dict[str, Any]
+        The event for the storage service.
+    """
     return {
         "pattern": message_pattern,
         "data": {
             "uuid": image_uuid,
             "image_analysis_result": event,
             "document_type": document_type,
+            "scale_factor": scale_factor,
         },
     }
 
 
+def _is_unauthorized(exception: Exception) -> bool:
+    """Return whether the exception was caused by invalid Azure credentials."""
+    return "401" in str(exception)
+
+
+def _is_permanent(exception: Exception) -> bool:
+    """Return whether the Azure API rejected the request itself, so that a retry fails as well.
+
+    Invalid requests, unknown deployments and rejected content, e.g. by the content filter, are
+    permanent, whereas connection errors, timeouts, exhausted quotas and server errors are not.
+    """
+    return isinstance(exception, APIStatusError) and exception.status_code in (400, 404, 422)
+
+
+def _unauthorized_event(exception: Exception) -> dict[str, Any]:
+    """Create the error event for invalid Azure credentials."""
+    logger.error("Unauthorized error (401). Azure Environment file not adjusted.")
+    return {
+        "status": "error",
+        "message": "Azure Environment file not adjusted. Please check your .env file configuration for Azure credentials.",
+        "error_details": str(exception),
+    }
+
+
+def processing_failed_event(exception: Exception | None) -> dict[str, Any]:
+    """Create the error event after all attempts to process an image failed.
+
+    Args:
+    ----------
+    exception : Exception | None
+        The error of the last attempt.
+
+    Returns:
+    -------
+    dict[str, Any]
+        The error event used as analysis result.
+    """
+    logger.error(f"Error while processing the image: {str(exception)}")
+    return {
+        "status": "error",
+        "message": "An error occurred while processing the image.",
+        "error_details": str(exception),
+    }
+
+
 def process_image_with_azure(data_url: str, document_type: str) -> object:
     """Communicate with the Azure API to process the image Data URL and return the serialized result.
 
+    Concurrent calls for the same image and document type share a single request, the result
+    is then wrapped into an event for the uuid of every message by the callers. The request is
+    sent through the circuit breaker of the extraction, which rejects it while the API is
+    considered unavailable.
+
+    Args:
+    ----------
+    data_url : str
+        The Data URL representation of the image.
+    document_type : str
+        The type of document to be processed.
+
+    Returns:
+    -------
+    object
+        The serialized result from the Azure API.
+
+    Raises:
+    ------
+    CircuitOpenError
+        If the circuit breaker rejected the request.
+    """
+    return _extraction_flights.do(
+        extraction_key(data_url, document_type),
+        lambda: _extraction_breaker.call(lambda: request_document_data(data_url, document_type)),
+    )
+
+
+def request_document_data(data_url: str, document_type: str) -> object:
+    """Send a single extraction request for the image Data URL to the Azure API.
+
+    The request is sent to the deployment of the environment, or balanced over the pool of
+    deployments in AZURE_ENDPOINTS.
+
     Args:
     ----------
     data_url : str
@@ -124,39 +613,216 @@ def process_image_with_azure(data_url: str, document_type: str) -> object:
     object
         The serialized result from the Azure API.
     """
-    client = AzureOpenAI(
-        azure_endpoint=str(os.getenv("AZURE_API_ENDPOINT")),
-        api_key=os.getenv("AZURE_API_KEY"),
-        api_version=os.getenv("API_VERSION"),
+    if _endpoint_pool is None:
+        completion = retrieve_document_data(data_url, get_azure_client(), document_type)
+    else:
+
+        def request(endpoint: AzureEndpoint) -> ParsedChatCompletion[Any]:
+            return retrieve_document_data(
+                data_url,
+                get_azure_client(endpoint.credentials),
+                document_type,
+                endpoint.model,
+                endpoint.quota,
+            )
+
+        completion = _endpoint_pool.call(request)
+    event = completion.choices[0].message.parsed
+    return make_serializable(event)
+
+
+async def process_image_with_azure_async(data_url: str, document_type: str) -> object:
+    """Communicate with the asynchronous Azure API client, see process_image_with_azure.
+
+    Args:
+    ----------
+    data_url : str
+        The Data URL representation of the image.
+    document_type : str
+        The type of document to be processed.
+
+    Returns:
+    -------
+    object
+        The serialized result from the Azure API.
+    """
+    # Hashing the image of several MB would block the event loop
+    key = await asyncio.to_thread(extraction_key, data_url, document_type)
+    return await _async_extraction_flights.do(
+        key,
+        lambda: _extraction_breaker.call_async(
+            lambda: request_document_data_async(data_url, document_type)
+        ),
     )
 
-    completion = retrieve_document_data(data_url, client, document_type)
+
+async def request_document_data_async(data_url: str, document_type: str) -> object:
+    """Send a single extraction request with the asynchronous Azure API client.
+
+    Args:
+    ----------
+    data_url : str
+        The Data URL representation of the image.
+    document_type : str
+        The type of document to be processed.
+
+    Returns:
+    -------
+    object
+        The serialized result from the Azure API.
+    """
+    if _endpoint_pool is None:
+        completion = await retrieve_document_data_async(
+            data_url, get_async_azure_client(), document_type
+        )
+    else:
+
+        async def request(endpoint: AzureEndpoint) -> ParsedChatCompletion[Any]:
+            return await retrieve_document_data_async(
+                data_url,
+                get_async_azure_client(endpoint.credentials),
+                document_type,
+                endpoint.model,
+                endpoint.quota,
+            )
+
+        completion = await _endpoint_pool.call_async(request)
     event = completion.choices[0].message.parsed
     return make_serializable(event)
 
 
-def retrieve_document_data(
-    data_url: str, client: AzureOpenAI, document_type: str
-) -> ParsedChatCompletion[ECMRDocument | DeliveryNoteDocument | PalletNoteDocument]:
-    """Retrieve the document data from the Azure API, by assembling an Open AI message.
+def extraction_key(data_url: str, document_type: str) -> str:
+    """Return the key identifying identical extractions in flight.
 
     Args:
     ----------
     data_url : str
         The Data URL representation of the image.
-    client : AzureOpenAI
-        The Azure OpenAI client instance.
     document_type : str
         The type of document to be processed.
 
     Returns:
     -------
-    ParsedChatCompletion[ECMRDocument | DeliveryNoteDocument | PalletNoteDocument]
-        The document data retrieved from the Azure API.
+    str
+        The hex digest of the image, the document type and the model.
+    """
+    return content_key(data_url, document_type, str(os.getenv("GPT_MODEL")))
+
+
+def is_error_event(event: object) -> bool:
+    """Return whether an analysis result is one of the error events instead of document data."""
+    return isinstance(event, dict) and event.get("status") == "error"
+
+
+@lru_cache(maxsize=1)
+def extraction_version() -> str:
+    """Return a fingerprint of the prompt, the schemas and the image preprocessing.
+
+    Cached results of earlier versions are not reused once the prompt, a schema, the size the
+    images are downscaled to or their encoding changes.
+
+    Returns:
+    -------
+    str
+        The hex digest of the prompt, the JSON schemas, the size limits and the encoding.
     """
-    from typing import Type, Union
+    fingerprint = {
+        "messages": build_extraction_messages(""),
+        "schemas": [
+            select_response_format(document_type.value).model_json_schema()
+            for document_type in DocumentType
+        ],
+        "image_size_limits": [
+            image_size_limit(document_type.value) for document_type in DocumentType
+        ],
+        "encoding": encoding_settings(),
+    }
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def rate_limit_scope(client: AzureOpenAI | AsyncAzureOpenAI, model: str) -> str:
+    """Return the scope the rate limits of a deployment are shared in, its endpoint and model."""
+    return f"{client.base_url}|{model}"
+
 
-    response_format: Type[Union[PalletNoteDocument, DeliveryNoteDocument, ECMRDocument]]
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Estimate the prompt tokens of an image in high detail.
+
+    The API fits the image into 2048 x 2048, scales its shorter side down to 768 and charges
+    170 tokens per tile of 512 x 512 plus a base of 85 tokens.
+
+    Args:
+    ----------
+    width : int
+        The width of the image in pixels.
+    height : int
+        The height of the image in pixels.
+
+    Returns:
+    -------
+    int
+        The estimated number of tokens.
+    """
+    scale = min(1.0, 2048 / max(width, height), 768 / max(1, min(width, height)))
+    tiles = math.ceil(width * scale / 512) * math.ceil(height * scale / 512)
+    return 85 + 170 * tiles
+
+
+@lru_cache(maxsize=None)
+def estimate_text_tokens(document_type: str) -> int:
+    """Estimate the prompt tokens of the messages and the schema of a document type."""
+    text = json.dumps(build_extraction_messages("")) + json.dumps(
+        select_response_format(document_type).model_json_schema()
+    )
+    # Roughly four characters per token
+    return len(text) // 4
+
+
+def estimate_request_tokens(data_url: str, document_type: str) -> int:
+    """Estimate the tokens an extraction request is charged in the rate limit.
+
+    Args:
+    ----------
+    data_url : str
+        The Data URL representation of the image.
+    document_type : str
+        The type of document to be processed.
+
+    Returns:
+    -------
+    int
+        The estimated prompt tokens of the image, the messages and the schema, plus the
+        expected completion tokens.
+    """
+    try:
+        image_data = base64.b64decode(data_url.partition(",")[2])
+        with Image.open(io.BytesIO(image_data)) as image:
+            image_tokens = estimate_image_tokens(*image.size)
+    except Exception:
+        # Charge the largest image the API accepts
+        image_tokens = estimate_image_tokens(768, 2048)
+    return image_tokens + estimate_text_tokens(document_type) + EXPECTED_COMPLETION_TOKENS
+
+
+def used_tokens(completion: ParsedChatCompletion[Any]) -> int | None:
+    """Return the total tokens a completion was charged, None if the usage is missing."""
+    return completion.usage.total_tokens if completion.usage is not None else None
+
+
+def select_response_format(document_type: str) -> DocumentSchema:
+    """Return the schema the Azure API has to fill in for the given document type.
+
+    Args:
+    ----------
+    document_type : str
+        The type of document to be processed.
+
+    Returns:
+    -------
+    DocumentSchema
+        The pydantic model describing the expected document data.
+    """
+    response_format: DocumentSchema
 
     if document_type == DocumentType.PALLET_NOTE.value:
         response_format = PalletNoteDocument
@@ -168,31 +834,158 @@ def retrieve_document_data(
     logger.info(
         "Using response_format=%s for document_type=%s", response_format.__name__, document_type
     )
+    return response_format
 
-    completion = client.beta.chat.completions.parse(
-        model=str(os.getenv("GPT_MODEL")),
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a specialist in document digitalization. You know exactly how to extract all relevant information from documents. Information can be machine-written, hand-written or be part of a stamp. You do not conclude information or include it from the context if it is missing.",
-            },
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": 'A CMR consists of several fields, give me the information that is written on the document for all of these fields. In other words: Extract all relevant information. If you cannot find a value for a field, fill in this value with an empty string ("").',
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": data_url,
-                        },
+
+def build_extraction_messages(data_url: str) -> list[ChatCompletionMessageParam]:
+    """Assemble the Open AI messages asking for the document data of an image.
+
+    Args:
+    ----------
+    data_url : str
+        The Data URL representation of the image.
+
+    Returns:
+    -------
+    list[ChatCompletionMessageParam]
+        The system and user messages of the request.
+    """
+    return [
+        {
+            "role": "system",
+            "content": "You are a specialist in document digitalization. You know exactly how to extract all relevant information from documents. Information can be machine-written, hand-written or be part of a stamp. You do not conclude information or include it from the context if it is missing.",
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": 'A CMR consists of several fields, give me the information that is written on the document for all of these fields. In other words: Extract all relevant information. If you cannot find a value for a field, fill in this value with an empty string ("").',
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": data_url,
                     },
-                ],
-            },
-        ],
-        response_format=response_format,
-    )
+                },
+            ],
+        },
+    ]
+
+
+def retrieve_document_data(
+    data_url: str,
+    client: AzureOpenAI,
+    document_type: str,
+    model: str | None = None,
+    quota: RateLimitQuota | None = None,
+) -> ParsedChatCompletion[ECMRDocument | DeliveryNoteDocument | PalletNoteDocument]:
+    """Retrieve the document data from the Azure API, by assembling an Open AI message.
+
+    Args:
+    ----------
+    data_url : str
+        The Data URL representation of the image.
+    client : AzureOpenAI
+        The Azure OpenAI client instance.
+    document_type : str
+        The type of document to be processed.
+    model : str | None
+        The deployment of the model, GPT_MODEL if None.
+    quota : RateLimitQuota | None
+        The rate limits of the deployment, AZURE_RPM_LIMIT and AZURE_TPM_LIMIT if None.
+
+    Returns:
+    -------
+    ParsedChatCompletion[ECMRDocument | DeliveryNoteDocument | PalletNoteDocument]
+        The document data retrieved from the Azure API.
+    """
+    model = model or str(os.getenv("GPT_MODEL"))
+    rate_limiter = get_rate_limiter(quota)
+    if rate_limiter is None:
+        completion = client.beta.chat.completions.parse(
+            model=model,
+            messages=build_extraction_messages(data_url),
+            response_format=select_response_format(document_type),
+        )
+    else:
+        scope = rate_limit_scope(client, model)
+        tokens = estimate_request_tokens(data_url, document_type)
+        rate_limiter.acquire(scope, tokens, quota)
+        try:
+            response = client.beta.chat.completions.with_raw_response.parse(
+                model=model,
+                messages=build_extraction_messages(data_url),
+                response_format=select_response_format(document_type),
+            )
+        except APIStatusError as e:
+            rate_limiter.observe(scope, e.response.headers, quota=quota)
+            raise
+        except APIConnectionError:
+            # Connection errors and timeouts are not charged for the tokens of the request
+            rate_limiter.release(scope, tokens, quota)
+            raise
+        completion = response.parse()
+        rate_limiter.observe(scope, response.headers, tokens, used_tokens(completion), quota)
+    logger.debug("Completion received: %s", completion)
+    return completion
+
+
+async def retrieve_document_data_async(
+    data_url: str,
+    client: AsyncAzureOpenAI,
+    document_type: str,
+    model: str | None = None,
+    quota: RateLimitQuota | None = None,
+) -> ParsedChatCompletion[ECMRDocument | DeliveryNoteDocument | PalletNoteDocument]:
+    """Retrieve the document data with the asynchronous Azure API client.
+
+    Args:
+    ----------
+    data_url : str
+        The Data URL representation of the image.
+    client : AsyncAzureOpenAI
+        The asynchronous Azure OpenAI client instance.
+    document_type : str
+        The type of document to be processed.
+    model : str | None
+        The deployment of the model, GPT_MODEL if None.
+    quota : RateLimitQuota | None
+        The rate limits of the deployment, AZURE_RPM_LIMIT and AZURE_TPM_LIMIT if None.
+
+    Returns:
+    -------
+    ParsedChatCompletion[ECMRDocument | DeliveryNoteDocument | PalletNoteDocument]
+        The document data retrieved from the Azure API.
+    """
+    model = model or str(os.getenv("GPT_MODEL"))
+    rate_limiter = get_rate_limiter(quota)
+    if rate_limiter is None:
+        completion = await client.beta.chat.completions.parse(
+            model=model,
+            messages=build_extraction_messages(data_url),
+            response_format=select_response_format(document_type),
+        )
+    else:
+        scope = rate_limit_scope(client, model)
+        # Decoding the image of several MB would block the event loop
+        tokens = await asyncio.to_thread(estimate_request_tokens, data_url, document_type)
+        await rate_limiter.acquire_async(scope, tokens, quota)
+        try:
+            response = await client.beta.chat.completions.with_raw_response.parse(
+                model=model,
+                messages=build_extraction_messages(data_url),
+                response_format=select_response_format(document_type),
+            )
+        except APIStatusError as e:
+            await rate_limiter.observe_async(scope, e.response.headers, quota=quota)
+            raise
+        except APIConnectionError:
+            await rate_limiter.release_async(scope, tokens, quota)
+            raise
+        completion = response.parse()
+        await rate_limiter.observe_async(
+            scope, response.headers, tokens, used_tokens(completion), quota
+        )
     logger.debug("Completion received: %s", completion)
     return completion
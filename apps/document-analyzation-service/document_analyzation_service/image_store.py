@@ -0,0 +1,197 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+
+"""This module provides access to images which are referenced by a message instead of being embedded in it (claim-check messages)."""
+
+import io
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+IMAGE_STORE = os.getenv("IMAGE_STORE", "s3")
+IMAGE_STORE_ROOT = os.getenv("IMAGE_STORE_ROOT", "/data/images")
+S3_POOL_SIZE = int(os.getenv("S3_POOL_SIZE", "10"))
+S3_CHUNK_SIZE = 1024 * 1024
+
+_image_store: "ImageStore | None" = None
+_image_store_lock = threading.Lock()
+
+
+class ImageStore(ABC):
+    """Base class of the stores images can be fetched from by their key."""
+
+    @abstractmethod
+    def fetch(self, key: str, bucket: str | None = None) -> bytes:
+        """Return the bytes of the image stored under the given key.
+
+        Args:
+        ----------
+        key : str
+            The key of the image.
+        bucket : str | None
+            The bucket containing the image, the default bucket of the store if None.
+
+        Returns:
+        -------
+        bytes
+            The raw image data.
+        """
+
+
+class LocalImageStore(ImageStore):
+    """Read images from a directory of the local filesystem, e.g. a mounted volume."""
+
+    def __init__(self, root: str) -> None:
+        """Initialize the store.
+
+        :param root: The directory containing the images, buckets are subdirectories of it.
+        """
+        self.root = Path(root).resolve()
+
+    def fetch(self, key: str, bucket: str | None = None) -> bytes:
+        """Return the bytes of the file stored under the key, relative to the root directory.
+
+        Raises:
+        ------
+        ValueError
+            If the key points outside of the root directory.
+        FileNotFoundError
+            If there is no image with the given key.
+        """
+        directory = self.root / bucket if bucket else self.root
+        path = (directory / key).resolve()
+        if not path.is_relative_to(self.root):
+            raise ValueError(f"Image key '{key}' points outside of the image store.")
+        return path.read_bytes()
+
+
+class S3ImageStore(ImageStore):
+    """Stream images from an S3 compatible object store, e.g. the MinIO of the storage service.
+
+    A single client with a sized connection pool is shared by all threads of the process.
+    """
+
+    def __init__(
+        self,
+        endpoint_url: str,
+        access_key: str | None,
+        secret_key: str | None,
+        default_bucket: str | None,
+        pool_size: int = S3_POOL_SIZE,
+    ) -> None:
+        """Initialize the store.
+
+        :param endpoint_url: The URL of the object store.
+        :param access_key: The access key for the object store.
+        :param secret_key: The secret key for the object store.
+        :param default_bucket: The bucket used for messages which do not specify one.
+        :param pool_size: Maximum number of pooled HTTP connections to the object store.
+        """
+        self.default_bucket = default_bucket
+        self.client = _create_s3_client(endpoint_url, access_key, secret_key, pool_size)
+
+    def fetch(self, key: str, bucket: str | None = None) -> bytes:
+        """Stream the object with the given key into memory.
+
+        Raises:
+        ------
+        ValueError
+            If neither the message nor the store specify a bucket.
+        """
+        bucket_name = bucket or self.default_bucket
+        if not bucket_name:
+            raise ValueError(f"No bucket specified for image key '{key}'.")
+        response = self.client.get_object(Bucket=bucket_name, Key=key)
+        buffer = io.BytesIO()
+        for chunk in response["Body"].iter_chunks(chunk_size=S3_CHUNK_SIZE):
+            buffer.write(chunk)
+        return buffer.getvalue()
+
+
+def _create_s3_client(
+    endpoint_url: str, access_key: str | None, secret_key: str | None, pool_size: int
+) -> Any:
+    """Create a boto3 S3 client, boto3 being an optional dependency of the service."""
+    try:
+        import boto3
+        from botocore.config import Config
+    except ImportError as e:
+        raise ImportError(
+            "The S3 image store requires boto3, install the service with the 's3' extra."
+        ) from e
+    return boto3.client(
+        "s3",
+        endpoint_url=endpoint_url,
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        config=Config(max_pool_connections=pool_size, retries={"mode": "standard"}),
+    )
+
+
+def create_image_store() -> ImageStore:
+    """Create the image store configured by the environment.
+
+    Returns:
+    -------
+    ImageStore
+        A LocalImageStore if IMAGE_STORE is "local", an S3ImageStore otherwise.
+    """
+    if IMAGE_STORE == "local":
+        logger.info("Fetching referenced images from directory %s", IMAGE_STORE_ROOT)
+        return LocalImageStore(IMAGE_STORE_ROOT)
+
+    endpoint_url = (
+        os.getenv("S3_ENDPOINT_URL")
+        or f"http://{os.getenv('S3_HOST', 'localhost')}:{os.getenv('S3_PORT', '9000')}"
+    )
+    logger.info("Fetching referenced images from object store %s", endpoint_url)
+    return S3ImageStore(
+        endpoint_url=endpoint_url,
+        access_key=os.getenv("S3_ACCESS_KEY"),
+        secret_key=os.getenv("S3_SECRET_KEY"),
+        default_bucket=os.getenv("S3_BUCKET"),
+    )
+
+
+def get_image_store() -> ImageStore:
+    """Return the process-wide image store, creating it on first use.
+
+    Returns:
+    -------
+    ImageStore
+        The shared image store.
+    """
+    global _image_store
+    with _image_store_lock:
+        if _image_store is None:
+            _image_store = create_image_store()
+        return _image_store
+
+
+def fetch_image(key: str, bucket: str | None = None) -> bytes:
+    """Fetch a referenced image from the process-wide image store.
+
+    Args:
+    ----------
+    key : str
+        The key of the image.
+    bucket : str | None
+        The bucket containing the image, the default bucket of the store if None.
+
+    Returns:
+    -------
+    bytes
+        The raw image data.
+    """
+    image_data = get_image_store().fetch(key, bucket)
+    logger.info("Fetched image '%s' (%d bytes) from the image store.", key, len(image_data))
+    return image_data
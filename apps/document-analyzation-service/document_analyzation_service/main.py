@@ -6,18 +6,46 @@
 
 """This module contains the main entry point for the document analyzation service. It sets up the RabbitMQ receiver to listen for image messages, processes the images, and sends the results to a specified queue."""
 
+import argparse
 import json
 import logging
 import os
-from typing import Any
+import sys
+import threading
+from typing import Any, Callable
 
 import pika
 from dotenv import load_dotenv
 
-from document_analyzation_service.image_processor import convert_image_to_data_url, process_image
-from document_analyzation_service.message_broker import RabbitMQReceiver, decode_image_from_message
+from document_analyzation_service.image_processor import (
+    ExtractionUnavailableError,
+    TransientProcessingError,
+    build_result_event,
+    extract_document_data,
+    extraction_version,
+    is_error_event,
+    prepare_image_for_extraction,
+    process_image,
+    processing_failed_event,
+)
+from document_analyzation_service.document_context import DocumentContext
+from document_analyzation_service.image_store import fetch_image
+from document_analyzation_service.message_broker import (
+    DeferredMessageError,
+    RabbitMQPublisher,
+    RabbitMQReceiver,
+    decode_image_from_message,
+)
+from document_analyzation_service.metrics import metrics, start_metrics_server
+from document_analyzation_service.result_cache import get_result_cache, result_cache_key
+from document_analyzation_service.retry_topology import RetryTopology
 from document_analyzation_service.utils import DocumentType
-from document_analyzation_service.document_classification.classification import get_document_class
+from document_analyzation_service.document_classification.classification import (
+    OCR_PROCESS_WORKERS,
+    get_document_class,
+    shutdown_ocr_workers,
+    warmup_ocr_model,
+)
 from document_analyzation_service.document_classification.document_class_identifier.document_type_identifier_list import (
     document_type_identifier_list,
 )
@@ -33,6 +61,22 @@ SAVE_ANALYZATION_RESULT_PATTERN = "analysis/publish"
 RABBITMQ_URI = os.getenv("RABBITMQ_HOST")
 RABBITMQ_USER = os.getenv("RABBITMQ_USER")
 RABBITMQ_PASSWORD = os.getenv("RABBITMQ_PASSWORD")
+CONSUMER_WORKER_COUNT = int(os.getenv("CONSUMER_WORKER_COUNT", "0"))
+CONSUMER_PREFETCH_COUNT = int(os.getenv("CONSUMER_PREFETCH_COUNT", str(CONSUMER_WORKER_COUNT)))
+PUBLISHER_POOL_SIZE = int(os.getenv("PUBLISHER_POOL_SIZE", str(max(1, CONSUMER_WORKER_COUNT))))
+# Broker-side retries replace the in-process retries, if at least one retry level is configured
+BROKER_RETRY_LEVELS = int(os.getenv("BROKER_RETRY_LEVELS", "0"))
+BROKER_RETRY_BASE_DELAY_MS = int(os.getenv("BROKER_RETRY_BASE_DELAY_MS", "5000"))
+RETRY_TOPOLOGY = (
+    RetryTopology.exponential(RECEIVE_QUEUE_NAME, BROKER_RETRY_LEVELS, BROKER_RETRY_BASE_DELAY_MS)
+    if BROKER_RETRY_LEVELS > 0
+    else None
+)
+
+BINARY_MESSAGE_HEADERS = ("uuid", "document_type", "bundleId")
+
+_publisher: RabbitMQPublisher | None = None
+_publisher_lock = threading.Lock()
 
 
 def on_image_received(
@@ -47,66 +91,432 @@ def on_image_received(
         ch: The channel object.
         method: The method frame.
         properties: The properties.
-        body: The body of the message, which contains JSON with UUID and image data.
+        body: The body of the message, which contains JSON with UUID and image data, or the
+            raw image for binary messages.
     Processes the received image by decoding it, converting it to a data URL,
     and then processing it further. The result is then sent to a queue.
     """
     logger.info("Received message from queue '%s'.", RECEIVE_QUEUE_NAME)
-    message = json.loads(body)
-    data = message.get("data")
-    image_uuid = data.get("uuid")
-    base64_image = data.get("image_base64")
+    data = parse_message(properties, body)
+    image_uuid: Any = data.get("uuid")
+    document_type: Any = data.get("document_type")
 
     try:
-        image_data = decode_image_from_message(base64_image)
-        data_url = convert_image_to_data_url(image_data)
-
-        document_type = None
-        if "document_type" in data:
-            document_type = data["document_type"]
-
-            if document_type == "auto":
-                found_doc_type_identifier = get_document_class(base64_image)
-                if found_doc_type_identifier == document_type_identifier_list[0].name:
-                    document_type = DocumentType.PALLET_NOTE.value
-                elif found_doc_type_identifier == document_type_identifier_list[1].name:
-                    document_type = DocumentType.CMR.value
-                elif found_doc_type_identifier == document_type_identifier_list[2].name:
-                    document_type = DocumentType.CMR.value
-                elif found_doc_type_identifier == document_type_identifier_list[3].name:
-                    document_type = DocumentType.DELIVERY_NOTE.value
-                else:
-                    document_type = DocumentType.CMR.value
-
-            # Sanity check, whether document_type is valid
-            if document_type in (dt.value for dt in DocumentType):
-                logger.info("Selected, valid document type: %s", document_type)
-            else:
-                logger.warning(
-                    "Invalid document type specified: %s. Defaulting to CMR.", document_type
-                )
-                logger.warning("Valid document types are: %s", [dt.value for dt in DocumentType])
-                document_type = DocumentType.CMR.value
-        else:
-            logger.warning("No 'document_type' specified in the message. Defaulting to CMR.")
-            document_type = DocumentType.CMR.value
+        document = load_document(data)
+        cache_key = result_cache_key_for(data, document)
+        cached_event = load_cached_event(cache_key, image_uuid)
+        if cached_event is not None:
+            logger.info("Image with UUID: %s answered from the result cache.", image_uuid)
+            send_event_to_queue(cached_event)
+            return
 
-        serializable_event = process_image(
-            data_url, image_uuid, SAVE_ANALYZATION_RESULT_PATTERN, document_type
-        )
+        data_url, document_type, scale_factor = prepare_document(data, document)
+
+        if RETRY_TOPOLOGY is None:
+            serializable_event = process_image(
+                data_url, image_uuid, SAVE_ANALYZATION_RESULT_PATTERN, document_type, scale_factor
+            )
+        else:
+            serializable_event = build_result_event(
+                extract_document_data(data_url, document_type),
+                image_uuid,
+                SAVE_ANALYZATION_RESULT_PATTERN,
+                document_type,
+                scale_factor,
+            )
         logger.info("Image with UUID: %s processed successfully.", image_uuid)
+        store_result(cache_key, serializable_event)
 
         send_event_to_queue(serializable_event)
 
         logger.info(f"JSON event sent to queue '{SEND_QUEUE_NAME}'.")
+    except TransientProcessingError as e:
+        logger.warning(f"Processing of image with UUID {image_uuid} failed: {e}")
+        error_event = retry_message(
+            properties,
+            body,
+            e,
+            image_uuid,
+            document_type,
+            lambda routing_key, message, retry_properties: get_publisher().publish(
+                message, routing_key, retry_properties
+            ),
+        )
+        if error_event is not None:
+            send_event_to_queue(error_event)
     except Exception as e:
         logger.error(f"Error processing message: {e}")
-        event = {
-            "status": "error",
-            "message": "Invalid message format: Missing UUID or image data.",
-            "error_details": str(e),
-        }
-        send_event_to_queue(event)
+        send_event_to_queue(build_error_event(e))
+
+
+def parse_message(properties: Any, body: bytes) -> dict[str, Any]:
+    """Extract the data of a message in the JSON or the binary message format.
+
+    Binary messages, recognized by an image or octet-stream content type, carry the raw image
+    bytes as body and the uuid, document_type and bundleId as AMQP headers. All other messages
+    are JSON with the image data in the "data" object.
+
+    Args:
+    ----------
+    properties : Any
+        The AMQP properties of the message.
+    body : bytes
+        The body of the message.
+
+    Returns:
+    -------
+    dict[str, Any]
+        The data of the message, containing the raw image as "image_data" for binary messages.
+    """
+    if not is_binary_message(properties):
+        message = json.loads(body)
+        data: dict[str, Any] = message.get("data")
+        return data
+
+    headers = properties.headers or {}
+    data = {"image_data": body}
+    for field in BINARY_MESSAGE_HEADERS:
+        if field in headers:
+            value = headers[field]
+            data[field] = value.decode("utf-8") if isinstance(value, bytes) else value
+    return data
+
+
+def is_binary_message(properties: Any) -> bool:
+    """Return whether a message carries the raw image bytes as body, based on its content type.
+
+    Args:
+    ----------
+    properties : Any
+        The AMQP properties of the message.
+
+    Returns:
+    -------
+    bool
+        True for an image or octet-stream content type, False otherwise.
+    """
+    content_type = getattr(properties, "content_type", None)
+    return isinstance(content_type, str) and (
+        content_type.startswith("image/") or content_type == "application/octet-stream"
+    )
+
+
+def load_image_data(data: dict[str, Any]) -> bytes:
+    """Load the image of a message.
+
+    The image is either embedded base64-encoded as "image_base64", the raw "image_data" of a
+    binary message or, for claim-check messages, referenced by its "image_key" (and optionally
+    "bucket") in the image store.
+
+    Args:
+    ----------
+    data : dict[str, Any]
+        The data of the received message.
+
+    Returns:
+    -------
+    bytes
+        The decoded image.
+    """
+    if "image_data" in data:
+        image_data: bytes = data["image_data"]
+        return image_data
+    if data.get("image_key"):
+        return fetch_image(data["image_key"], data.get("bucket"))
+    base64_image: Any = data.get("image_base64")
+    return decode_image_from_message(base64_image)
+
+
+def load_document(data: dict[str, Any]) -> DocumentContext:
+    """Load the image of a message into the context shared by all processing steps.
+
+    Args:
+    ----------
+    data : dict[str, Any]
+        The data of the received message.
+
+    Returns:
+    -------
+    DocumentContext
+        The context of the loaded image.
+    """
+    return DocumentContext(load_image_data(data))
+
+
+def prepare_document(
+    data: dict[str, Any], document: DocumentContext | None = None
+) -> tuple[str, str, float]:
+    """Load the image of a message, determine the type of the document and downscale the image.
+
+    Args:
+    ----------
+    data : dict[str, Any]
+        The data of the received message.
+    document : DocumentContext | None
+        The context of the already loaded image, loaded with load_document if None.
+
+    Returns:
+    -------
+    tuple[str, str, float]
+        The Data URL of the possibly downscaled image, the valid document type to process it
+        with and the factor the image was scaled by.
+    """
+    if document is None:
+        document = load_document(data)
+    document_type = resolve_document_type(data, document)
+    data_url, scale_factor = prepare_image_for_extraction(document, document_type)
+    return data_url, document_type, scale_factor
+
+
+def resolve_document_type(data: dict[str, Any], document: DocumentContext) -> str:
+    """Determine the document type of a message, classifying the image if requested.
+
+    Args:
+    ----------
+    data : dict[str, Any]
+        The data of the received message.
+    document : DocumentContext
+        The context of the image, classified when the document type is "auto".
+
+    Returns:
+    -------
+    str
+        A valid document type, CMR if none or an invalid one was specified.
+    """
+    document_type = None
+    if "document_type" in data:
+        document_type = data["document_type"]
+
+        if document_type == "auto":
+            found_doc_type_identifier = get_document_class(document)
+            if found_doc_type_identifier == document_type_identifier_list[0].name:
+                document_type = DocumentType.PALLET_NOTE.value
+            elif found_doc_type_identifier == document_type_identifier_list[1].name:
+                document_type = DocumentType.CMR.value
+            elif found_doc_type_identifier == document_type_identifier_list[2].name:
+                document_type = DocumentType.CMR.value
+            elif found_doc_type_identifier == document_type_identifier_list[3].name:
+                document_type = DocumentType.DELIVERY_NOTE.value
+            else:
+                document_type = DocumentType.CMR.value
+
+        # Sanity check, whether document_type is valid
+        if document_type in (dt.value for dt in DocumentType):
+            logger.info("Selected, valid document type: %s", document_type)
+        else:
+            logger.warning(
+                "Invalid document type specified: %s. Defaulting to CMR.", document_type
+            )
+            logger.warning("Valid document types are: %s", [dt.value for dt in DocumentType])
+            document_type = DocumentType.CMR.value
+    else:
+        logger.warning("No 'document_type' specified in the message. Defaulting to CMR.")
+        document_type = DocumentType.CMR.value
+
+    return str(document_type)
+
+
+def result_cache_key_for(data: dict[str, Any], document: DocumentContext) -> str | None:
+    """Derive the result cache key of a message.
+
+    The key uses the requested instead of the resolved document type, so that cache hits for
+    "auto" messages skip the classification as well.
+
+    Args:
+    ----------
+    data : dict[str, Any]
+        The data of the received message.
+    document : DocumentContext
+        The context of the image of the message.
+
+    Returns:
+    -------
+    str | None
+        The cache key, None if the result cache is disabled.
+    """
+    if get_result_cache() is None:
+        return None
+    return result_cache_key(
+        document.content_hash,
+        str(data.get("document_type", "")),
+        str(os.getenv("GPT_MODEL")),
+        extraction_version(),
+    )
+
+
+def load_cached_event(cache_key: str | None, image_uuid: Any) -> dict[str, Any] | None:
+    """Build the result event of a message from the result cache.
+
+    Args:
+    ----------
+    cache_key : str | None
+        The result cache key of the message, None if the cache is disabled.
+    image_uuid : Any
+        The unique identifier for the image.
+
+    Returns:
+    -------
+    dict[str, Any] | None
+        The result event for the storage service, None if no result is cached.
+    """
+    cache = get_result_cache()
+    if cache is None or cache_key is None:
+        return None
+    try:
+        cached = cache.get(cache_key)
+    except Exception as e:
+        logger.warning(f"Reading the result cache failed: {e}")
+        cached = None
+    if cached is None:
+        metrics.increment("result_cache_misses_total")
+        return None
+    metrics.increment("result_cache_hits_total")
+    return build_result_event(
+        cached["image_analysis_result"],
+        image_uuid,
+        SAVE_ANALYZATION_RESULT_PATTERN,
+        cached["document_type"],
+        cached.get("scale_factor", 1.0),
+    )
+
+
+def store_result(cache_key: str | None, event: dict[str, Any]) -> None:
+    """Store the analysis result of a result event in the result cache, unless it is an error.
+
+    Args:
+    ----------
+    cache_key : str | None
+        The result cache key of the message, None if the cache is disabled.
+    event : dict[str, Any]
+        The result event sent to the storage service.
+    """
+    cache = get_result_cache()
+    data = event.get("data") or {}
+    if cache is None or cache_key is None or is_error_event(data.get("image_analysis_result")):
+        return
+    try:
+        cache.put(
+            cache_key,
+            {
+                "image_analysis_result": data.get("image_analysis_result"),
+                "document_type": data.get("document_type"),
+                "scale_factor": data.get("scale_factor", 1.0),
+            },
+        )
+    except Exception as e:
+        logger.warning(f"Writing the result cache failed: {e}")
+
+
+def retry_message(
+    properties: Any,
+    body: bytes,
+    exception: Exception,
+    image_uuid: Any,
+    document_type: str,
+    publish: Callable[[str, bytes, pika.BasicProperties], None],
+) -> dict[str, Any] | None:
+    """Publish a transiently failed message to its next delay queue or to the dead-letter queue.
+
+    Messages whose extraction was not attempted, because the circuit breaker is open, are
+    parked in the longest delay queue instead, without counting as a retry.
+
+    Args:
+    ----------
+    properties : Any
+        The AMQP properties of the failed message, carrying its attempt count.
+    body : bytes
+        The unchanged body of the failed message.
+    exception : Exception
+        The error of the failed attempt.
+    image_uuid : Any
+        The unique identifier for the image.
+    document_type : str
+        The type of the document.
+    publish : Callable[[str, bytes, pika.BasicProperties], None]
+        Publishes a body with properties to the queue given as first argument.
+
+    Returns:
+    -------
+    dict[str, Any] | None
+        The error event to send once the retries are exhausted, None if the message is retried.
+
+    Raises:
+    ------
+    DeferredMessageError
+        If no retry topology is configured and the extraction was not attempted, so that the
+        receiver requeues the message once the circuit breaker lets requests through again.
+    TransientProcessingError
+        If no retry topology is configured.
+    """
+    if RETRY_TOPOLOGY is None:
+        if isinstance(exception, ExtractionUnavailableError):
+            raise DeferredMessageError(str(exception), exception.retry_after) from exception
+        raise TransientProcessingError("No retry topology configured.") from exception
+    if isinstance(exception, ExtractionUnavailableError):
+        routing_key, retry_properties = RETRY_TOPOLOGY.park_destination(properties)
+        publish(routing_key, body, retry_properties)
+        return None
+    routing_key, retry_properties, exhausted = RETRY_TOPOLOGY.next_destination(properties)
+    publish(routing_key, body, retry_properties)
+    if not exhausted:
+        return None
+    return build_result_event(
+        processing_failed_event(exception),
+        image_uuid,
+        SAVE_ANALYZATION_RESULT_PATTERN,
+        document_type,
+    )
+
+
+def build_error_event(exception: Exception) -> dict[str, Any]:
+    """Create the event reporting a message which could not be processed.
+
+    Args:
+    ----------
+    exception : Exception
+        The error raised while processing the message.
+
+    Returns:
+    -------
+    dict[str, Any]
+        The error event for the storage service.
+    """
+    return {
+        "status": "error",
+        "message": "Invalid message format: Missing UUID or image data.",
+        "error_details": str(exception),
+    }
+
+
+def get_publisher() -> RabbitMQPublisher:
+    """Return the process-wide publisher for result events, creating it on first use.
+
+    Returns:
+    -------
+    RabbitMQPublisher
+        The shared publisher sending to the storage service queue.
+    """
+    global _publisher
+    with _publisher_lock:
+        if _publisher is None:
+            _publisher = RabbitMQPublisher(
+                queue_name=SEND_QUEUE_NAME,
+                uri=str(RABBITMQ_URI),
+                username=str(RABBITMQ_USER),
+                password=str(RABBITMQ_PASSWORD),
+                pool_size=PUBLISHER_POOL_SIZE,
+                queue_arguments=RETRY_TOPOLOGY.queue_arguments() if RETRY_TOPOLOGY else None,
+            )
+        return _publisher
+
+
+def close_publisher() -> None:
+    """Close the process-wide publisher, if it was created."""
+    global _publisher
+    with _publisher_lock:
+        if _publisher is not None:
+            _publisher.close()
+            _publisher = None
 
 
 def send_event_to_queue(event: dict[str, Any]) -> None:
@@ -120,40 +530,85 @@ def send_event_to_queue(event: dict[str, Any]) -> None:
     # Convert event to a JSON string
     event_json = json.dumps(event)
 
-    # Connect to RabbitMQ
-    credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
-    parameters = pika.ConnectionParameters(RABBITMQ_URI, 5672, "/", credentials)
-    connection = pika.BlockingConnection(parameters)
-
-    channel = connection.channel()
-
-    # Declare queue
-    channel.queue_declare(queue=SEND_QUEUE_NAME)
-
-    # Send JSON-Event to Queue
-    channel.basic_publish(exchange="", routing_key=SEND_QUEUE_NAME, body=event_json)
+    # Send JSON-Event to Queue using the long-lived publisher
+    get_publisher().publish(event_json)
     logger.info(f"JSON event sent to queue '{SEND_QUEUE_NAME}'.")
 
-    # Close connection
-    connection.close()
 
+def create_receiver(
+    worker_count: int = CONSUMER_WORKER_COUNT, prefetch_count: int = CONSUMER_PREFETCH_COUNT
+) -> RabbitMQReceiver:
+    """Create the receiver consuming the image messages of the service.
 
-def main() -> None:
-    """Start the RabbitMQ receiver and listen for messages."""
-    load_dotenv()
-    receiver = RabbitMQReceiver(
+    Args:
+    ----------
+    worker_count : int
+        The threads processing the messages, with 0 they are processed on the I/O thread of pika
+        and acknowledged on delivery.
+    prefetch_count : int
+        The most unacknowledged messages delivered to the receiver.
+
+    Returns:
+    -------
+    RabbitMQReceiver
+        The connected receiver.
+    """
+    if OCR_PROCESS_WORKERS > 0 and worker_count <= 0:
+        logger.warning(
+            "OCR_PROCESS_WORKERS is set without CONSUMER_WORKER_COUNT, so the messages are "
+            "still processed on the I/O thread of pika, which misses its heartbeats while "
+            "waiting for the OCR."
+        )
+    return RabbitMQReceiver(
         queue_name=RECEIVE_QUEUE_NAME,
         uri=str(RABBITMQ_URI),
         username=str(RABBITMQ_USER),
         password=str(RABBITMQ_PASSWORD),
+        worker_count=worker_count,
+        prefetch_count=prefetch_count,
+    )
+
+
+def parse_arguments(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parse the command line arguments of the service.
+
+    Args:
+    ----------
+    argv : list[str] | None
+        The arguments, none if None; the entry point passes those of the process.
+
+    Returns:
+    -------
+    argparse.Namespace
+        The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Document Analyzation Service")
+    parser.add_argument(
+        "--warmup",
+        action="store_true",
+        help="load the OCR model and run one inference before consuming messages",
     )
+    return parser.parse_args(argv if argv is not None else [])
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Start the RabbitMQ receiver and listen for messages."""
+    arguments = parse_arguments(argv)
+    load_dotenv()
+    if arguments.warmup:
+        warmup_ocr_model()
+    start_metrics_server()
+    receiver = create_receiver()
     try:
         logger.info(f"Listening for messages on queue '{RECEIVE_QUEUE_NAME}'...")
         receiver.start_listening(on_image_received)  # type: ignore[arg-type]
     except KeyboardInterrupt:
         logger.info("Stopping Document Analyzation Service...")
         receiver.stop()
+    finally:
+        close_publisher()
+        shutdown_ocr_workers()
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
@@ -6,34 +6,69 @@
 
 """This module provides functionality to receive and process messages from a RabbitMQ queue."""
 
+import asyncio
 import base64
+import functools
 import logging
+import queue
+import threading
 import time
-from typing import Any, Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable
 
 import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
 
+class DeferredMessageError(Exception):
+    """Raised by a message callback for a message to be requeued after a delay, e.g. while a dependency is unavailable."""
+
+    def __init__(self, message: str, retry_after: float) -> None:
+        """Initialize the error.
+
+        :param message: The description of the error.
+        :param retry_after: The seconds after which the message is requeued.
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
 class RabbitMQReceiver:
     """A class to receive messages from a RabbitMQ queue."""
 
-    def __init__(self, queue_name: str, uri: str, username: str, password: str) -> None:
+    def __init__(
+        self,
+        queue_name: str,
+        uri: str,
+        username: str,
+        password: str,
+        worker_count: int = 0,
+        prefetch_count: int | None = None,
+    ) -> None:
         """Initialize the RabbitMQReceiver with the given parameters.
 
         :param queue_name: The name of the RabbitMQ queue.
         :param uri: The URI of the RabbitMQ server.
         :param username: The username for RabbitMQ authentication.
         :param password: The password for RabbitMQ authentication.
+        :param worker_count: Number of worker threads processing messages concurrently. With 0
+            messages are processed inline on the connection thread and acknowledged on delivery.
+        :param prefetch_count: Maximum number of unacknowledged messages delivered to this
+            consumer, defaults to the number of workers.
         """
         self.queue_name = queue_name
         self.uri = uri
         self.username = username
         self.password = password
+        self.worker_count = max(0, worker_count)
+        self.prefetch_count = prefetch_count if prefetch_count else self.worker_count
         self.connection: pika.BlockingConnection | None = None
         self.channel: Any | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._stopping = False
         # Direkter Verbindungsaufbau im Konstruktor
         self.connect()
 
@@ -84,18 +119,577 @@ class RabbitMQReceiver:
 
         # Wenn die Verbindung da ist, Nachrichten konsumieren
         logger.info(f"Listening to queue: {self.queue_name}")
-        self.channel.basic_consume(
-            queue=self.queue_name, on_message_callback=callback, auto_ack=True
-        )
+        if self.worker_count > 0:
+            logger.info(
+                "Processing messages with %d workers and a prefetch count of %d.",
+                self.worker_count,
+                self.prefetch_count,
+            )
+            self.channel.basic_qos(prefetch_count=self.prefetch_count)
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.worker_count, thread_name_prefix="das-worker"
+            )
+            self.channel.basic_consume(
+                queue=self.queue_name,
+                on_message_callback=functools.partial(self._dispatch, callback),
+                auto_ack=False,
+            )
+        else:
+            self.channel.basic_consume(
+                queue=self.queue_name,
+                on_message_callback=functools.partial(self._process_inline, callback),
+                auto_ack=True,
+            )
         self.channel.start_consuming()
 
+    def _process_inline(
+        self,
+        callback: Callable[[object, object, object, object], None],
+        ch: Any,
+        method: Any,
+        properties: Any,
+        body: bytes,
+    ) -> None:
+        """Run the callback on the connection thread, the message was acknowledged on delivery.
+
+        A deferred message is published to the queue again after its delay, as it cannot be
+        requeued anymore.
+        """
+        try:
+            callback(ch, method, properties, body)
+        except DeferredMessageError as e:
+            logger.warning(
+                "Republishing message %s in %.1f seconds: %s.",
+                method.delivery_tag,
+                e.retry_after,
+                e,
+            )
+            if self.connection is not None:
+                self.connection.call_later(
+                    e.retry_after, functools.partial(self._republish, ch, properties, body)
+                )
+
+    def _republish(self, ch: Any, properties: Any, body: bytes) -> None:
+        """Publish a message to the queue of the receiver again, if its channel is still open."""
+        if ch.is_open:
+            ch.basic_publish(
+                exchange="", routing_key=self.queue_name, body=body, properties=properties
+            )
+
+    def _dispatch(
+        self,
+        callback: Callable[[object, object, object, object], None],
+        ch: Any,
+        method: Any,
+        properties: Any,
+        body: bytes,
+    ) -> None:
+        """Hand a delivered message over to the worker pool (runs on the connection thread)."""
+        if self._executor is None:
+            raise RuntimeError("ERROR: Worker pool of the RabbitMQ receiver is not running.")
+        if self._stopping:
+            # Delivered before the consumer was cancelled, another consumer processes it instead
+            logger.info("Requeueing message %s, the receiver is stopping.", method.delivery_tag)
+            self._nack(ch, method.delivery_tag, requeue=True)
+            return
+        self._executor.submit(self._process, callback, ch, method, properties, body)
+
+    def _process(
+        self,
+        callback: Callable[[object, object, object, object], None],
+        ch: Any,
+        method: Any,
+        properties: Any,
+        body: bytes,
+    ) -> None:
+        """Run the callback on a worker thread and acknowledge the message afterwards.
+
+        The callback publishes the result before it returns, therefore the message is only
+        acknowledged once its result is on the way. Failed messages are requeued once and
+        rejected when they fail again after redelivery. Deferred messages are requeued after
+        their delay, regardless of earlier deliveries.
+        """
+        delivery_tag = method.delivery_tag
+        try:
+            callback(ch, method, properties, body)
+        except DeferredMessageError as e:
+            logger.warning(
+                "Requeueing message %s in %.1f seconds: %s.", delivery_tag, e.retry_after, e
+            )
+            self._schedule_on_connection(
+                functools.partial(self._defer, ch, delivery_tag, e.retry_after)
+            )
+        except Exception as e:
+            requeue = not method.redelivered
+            logger.error(
+                "Error while processing message %s: %s. %s.",
+                delivery_tag,
+                e,
+                "Requeueing" if requeue else "Rejecting",
+            )
+            self._schedule_on_connection(functools.partial(self._nack, ch, delivery_tag, requeue))
+        else:
+            self._schedule_on_connection(functools.partial(self._ack, ch, delivery_tag))
+
+    def _schedule_on_connection(self, function: Callable[[], None]) -> None:
+        """Execute the given function on the connection thread, the only thread allowed to use it."""
+        if self.connection is None or not self.connection.is_open:
+            logger.warning("RabbitMQ connection closed, the message will be redelivered.")
+            return
+        self.connection.add_callback_threadsafe(function)
+
+    def _defer(self, ch: Any, delivery_tag: int, delay: float) -> None:
+        """Requeue a message after a delay, runs on the connection thread."""
+        if self.connection is not None:
+            self.connection.call_later(
+                delay, functools.partial(self._nack, ch, delivery_tag, requeue=True)
+            )
+
+    @staticmethod
+    def _ack(ch: Any, delivery_tag: int) -> None:
+        """Acknowledge a message if its channel is still open."""
+        if ch.is_open:
+            ch.basic_ack(delivery_tag=delivery_tag)
+
+    @staticmethod
+    def _nack(ch: Any, delivery_tag: int, requeue: bool) -> None:
+        """Negatively acknowledge a message if its channel is still open."""
+        if ch.is_open:
+            ch.basic_nack(delivery_tag=delivery_tag, requeue=requeue)
+
+    def request_stop(self) -> None:
+        """Stop consuming after the current messages; safe to call from any thread.
+
+        start_listening() returns once the consumer was cancelled, afterwards stop() has to be
+        called to finish the in-flight messages and close the connection. Messages delivered
+        in the meantime are requeued.
+        """
+        self._stopping = True
+        if self.channel is not None:
+            self._schedule_on_connection(self.channel.stop_consuming)
+
     def stop(self) -> None:
-        """Stop the RabbitMQ connection."""
+        """Stop the RabbitMQ connection, waiting for the workers to finish their messages."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            if self.connection and self.connection.is_open:
+                # Deliver the (n)acks which the workers scheduled on the connection thread
+                self.connection.process_data_events(time_limit=0)
         if self.connection:
             self.connection.close()
             logger.info("RabbitMQ connection closed.")
 
 
+class _PooledChannel:
+    """A single publishing slot of the pool, owning its own connection and channel.
+
+    pika's BlockingConnection is not thread-safe, therefore every slot keeps a dedicated
+    connection which is only ever used by the thread that currently holds the slot.
+    """
+
+    def __init__(self, parameters_factory: Callable[[], pika.ConnectionParameters]) -> None:
+        """Initialize an unconnected slot.
+
+        :param parameters_factory: Callable creating the connection parameters for the slot.
+        """
+        self._parameters_factory = parameters_factory
+        self.connection: pika.BlockingConnection | None = None
+        self.channel: Any | None = None
+        self.declared_queues: set[str] = set()
+
+    def ensure_open(self) -> Any:
+        """Return an open channel, (re)connecting if necessary."""
+        if self.connection is not None and self.connection.is_open and self.channel is not None:
+            # Service heartbeats and detect a connection closed by the broker while idle
+            self.connection.process_data_events(time_limit=0)
+            if self.channel.is_open:
+                return self.channel
+        self.reset()
+        self.connection = pika.BlockingConnection(self._parameters_factory())
+        self.channel = self.connection.channel()
+        return self.channel
+
+    def declare_queue(self, queue_name: str, arguments: dict[str, Any] | None = None) -> None:
+        """Declare the given queue once per connection."""
+        if queue_name not in self.declared_queues and self.channel is not None:
+            if arguments:
+                self.channel.queue_declare(queue=queue_name, arguments=arguments)
+            else:
+                self.channel.queue_declare(queue=queue_name)
+            self.declared_queues.add(queue_name)
+
+    def reset(self) -> None:
+        """Close the connection of the slot, ignoring errors of an already broken connection."""
+        connection = self.connection
+        self.connection = None
+        self.channel = None
+        self.declared_queues = set()
+        if connection is not None and connection.is_open:
+            try:
+                connection.close()
+            except pika.exceptions.AMQPError as e:
+                logger.debug("Ignoring error while closing publisher connection: %s", e)
+
+
+class RabbitMQPublisher:
+    """A long-lived, thread-safe publisher backed by a pool of RabbitMQ channels.
+
+    Connections are opened lazily, re-established automatically after failures and the target
+    queue is declared only once per connection. Several worker threads can publish concurrently,
+    each one borrowing a slot of the pool for the duration of a single publish.
+    """
+
+    def __init__(
+        self,
+        queue_name: str,
+        uri: str,
+        username: str,
+        password: str,
+        pool_size: int = 1,
+        publish_attempts: int = 3,
+        acquire_timeout: float | None = 30.0,
+        queue_arguments: dict[str, dict[str, Any]] | None = None,
+    ) -> None:
+        """Initialize the RabbitMQPublisher with the given parameters.
+
+        :param queue_name: The name of the default RabbitMQ queue to publish to.
+        :param uri: The URI of the RabbitMQ server.
+        :param username: The username for RabbitMQ authentication.
+        :param password: The password for RabbitMQ authentication.
+        :param pool_size: The number of channels which may be used concurrently.
+        :param publish_attempts: How often a publish is attempted, reconnecting in between.
+        :param acquire_timeout: Seconds to wait for a free channel, None waits forever.
+        :param queue_arguments: Further queues which are declared, with the given arguments,
+            before the first publish to them, e.g. the queues of a retry topology.
+        """
+        if pool_size < 1:
+            raise ValueError("The pool size of the publisher must be at least 1.")
+        self.queue_name = queue_name
+        self.uri = uri
+        self.username = username
+        self.password = password
+        self.publish_attempts = max(1, publish_attempts)
+        self.acquire_timeout = acquire_timeout
+        self.queue_arguments = {queue_name: {}, **(queue_arguments or {})}
+        self._closed = False
+        self._lock = threading.Lock()
+        self._slots = [_PooledChannel(self._create_parameters) for _ in range(pool_size)]
+        self._pool: queue.LifoQueue[_PooledChannel] = queue.LifoQueue()
+        for slot in self._slots:
+            self._pool.put(slot)
+
+    def _create_parameters(self) -> pika.ConnectionParameters:
+        """Create the connection parameters for a new publisher connection."""
+        credentials = pika.PlainCredentials(self.username, self.password)
+        return pika.ConnectionParameters(self.uri, 5672, "/", credentials)
+
+    def publish(
+        self,
+        body: str | bytes,
+        routing_key: str | None = None,
+        properties: pika.BasicProperties | None = None,
+    ) -> None:
+        """Publish a message, reconnecting and retrying on connection failures.
+
+        Args:
+        ----------
+        body : str | bytes
+            The message body.
+        routing_key : str | None
+            The queue to publish to, defaults to the queue of the publisher. The queue of the
+            publisher and those with queue arguments are declared before the first publish on
+            every connection.
+        properties : pika.BasicProperties | None
+            Optional AMQP properties of the message.
+
+        Raises:
+        ------
+        RuntimeError
+            If the publisher was already closed or no channel became available in time.
+        pika.exceptions.AMQPError
+            If the message could not be published after all attempts.
+        """
+        if self._closed:
+            raise RuntimeError("ERROR: RabbitMQ publisher is already closed.")
+        try:
+            slot = self._pool.get(timeout=self.acquire_timeout)
+        except queue.Empty as e:
+            raise RuntimeError("ERROR: No RabbitMQ publisher channel available.") from e
+
+        try:
+            self._publish_with_slot(slot, body, routing_key or self.queue_name, properties)
+        finally:
+            if self._closed:
+                slot.reset()
+            self._pool.put(slot)
+
+    def _publish_with_slot(
+        self,
+        slot: _PooledChannel,
+        body: str | bytes,
+        routing_key: str,
+        properties: pika.BasicProperties | None,
+    ) -> None:
+        """Publish the message with the given slot, reconnecting it on failures."""
+        for attempt in range(1, self.publish_attempts + 1):
+            try:
+                channel = slot.ensure_open()
+                if routing_key in self.queue_arguments:
+                    slot.declare_queue(routing_key, self.queue_arguments[routing_key])
+                channel.basic_publish(
+                    exchange="", routing_key=routing_key, body=body, properties=properties
+                )
+                return
+            except pika.exceptions.AMQPError as e:
+                slot.reset()
+                if attempt >= self.publish_attempts:
+                    raise
+                logger.warning(
+                    "Publishing to '%s' failed: %s. Reconnecting... %d attempts left.",
+                    routing_key,
+                    e,
+                    self.publish_attempts - attempt,
+                )
+
+    def close(self) -> None:
+        """Close all connections of the pool. Publishing afterwards raises an error."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        # Slots which are currently in use are reset by their thread when they are returned
+        while True:
+            try:
+                slot = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            slot.reset()
+        logger.info("RabbitMQ publisher closed.")
+
+
+class AsyncRabbitMQConsumer:
+    """An asyncio-native consumer and publisher sharing a single RabbitMQ connection.
+
+    Every delivered message is handled by its own task on the event loop and acknowledged once
+    the handler returned, i.e. after the handler published its result. The connection is
+    re-established automatically until stop() is called.
+    """
+
+    def __init__(
+        self,
+        queue_name: str,
+        uri: str,
+        username: str,
+        password: str,
+        prefetch_count: int,
+        declare_queues: tuple[str, ...] = (),
+        reconnect_delay: float = 5.0,
+        queue_arguments: dict[str, dict[str, Any]] | None = None,
+    ) -> None:
+        """Initialize the AsyncRabbitMQConsumer with the given parameters.
+
+        :param queue_name: The name of the RabbitMQ queue to consume from.
+        :param uri: The URI of the RabbitMQ server.
+        :param username: The username for RabbitMQ authentication.
+        :param password: The password for RabbitMQ authentication.
+        :param prefetch_count: Maximum number of unacknowledged messages delivered at once.
+        :param declare_queues: Further queues to declare, e.g. the queues published to.
+        :param reconnect_delay: Seconds to wait before reconnecting after a connection loss.
+        :param queue_arguments: Further queues to declare with the given arguments.
+        """
+        self.queue_name = queue_name
+        self.uri = uri
+        self.username = username
+        self.password = password
+        self.prefetch_count = prefetch_count
+        self.declare_queues = declare_queues
+        self.reconnect_delay = reconnect_delay
+        self.queue_arguments = queue_arguments or {}
+        self.connection: AsyncioConnection | None = None
+        self.channel: Any = None
+        self._handler: Callable[[Any, bytes], Awaitable[None]] | None = None
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._closed: asyncio.Future[None] | None = None
+        self._consumer_tag: str | None = None
+        self._stopping = False
+
+    async def run(self, handler: Callable[[Any, bytes], Awaitable[None]]) -> None:
+        """Consume messages with the given handler until stop() is called.
+
+        Args:
+        ----------
+        handler : Callable[[Any, bytes], Awaitable[None]]
+            Coroutine function processing the properties and body of a message.
+        """
+        self._handler = handler
+        while not self._stopping:
+            try:
+                closed = await self._connect()
+                self._consumer_tag = self.channel.basic_consume(
+                    queue=self.queue_name, on_message_callback=self._on_message, auto_ack=False
+                )
+                logger.info(f"Listening to queue: {self.queue_name}")
+                await closed
+            except pika.exceptions.AMQPError as e:
+                logger.error("Error connecting to RabbitMQ: %s.", e)
+            if not self._stopping:
+                logger.info("Reconnecting to RabbitMQ in %.1f seconds...", self.reconnect_delay)
+                await asyncio.sleep(self.reconnect_delay)
+
+    async def _connect(self) -> asyncio.Future[None]:
+        """Open the connection and channel and declare the queues.
+
+        Returns:
+        -------
+        asyncio.Future[None]
+            A future which is resolved once the connection is closed.
+        """
+        loop = asyncio.get_running_loop()
+        opened: asyncio.Future[AsyncioConnection] = loop.create_future()
+        closed: asyncio.Future[None] = loop.create_future()
+        self._closed = closed
+
+        def on_open_error(connection: AsyncioConnection, error: BaseException) -> None:
+            if not opened.done():
+                opened.set_exception(
+                    error
+                    if isinstance(error, pika.exceptions.AMQPError)
+                    else pika.exceptions.AMQPConnectionError(str(error))
+                )
+
+        logger.info("Connecting to RabbitMQ at %s", self.uri)
+        credentials = pika.PlainCredentials(self.username, self.password)
+        parameters = pika.ConnectionParameters(self.uri, 5672, "/", credentials)
+        connection = AsyncioConnection(
+            parameters,
+            on_open_callback=functools.partial(_resolve, opened),
+            on_open_error_callback=on_open_error,
+            on_close_callback=self._on_connection_closed,
+            custom_ioloop=loop,
+        )
+        self.connection = connection
+        await opened
+
+        channel_opened: asyncio.Future[Any] = loop.create_future()
+        connection.channel(on_open_callback=functools.partial(_resolve, channel_opened))
+        self.channel = await channel_opened
+        self.channel.add_on_close_callback(self._on_channel_closed)
+
+        for queue_name in (self.queue_name, *self.declare_queues):
+            await self._call(self.channel.queue_declare, queue=queue_name)
+        for queue_name, arguments in self.queue_arguments.items():
+            await self._call(self.channel.queue_declare, queue=queue_name, arguments=arguments)
+        await self._call(self.channel.basic_qos, prefetch_count=self.prefetch_count)
+        logger.info("RabbitMQ connection established to %s", self.uri)
+        return closed
+
+    @staticmethod
+    async def _call(method: Callable[..., Any], **kwargs: Any) -> Any:
+        """Invoke a callback-style channel method and wait for its confirmation frame."""
+        done: asyncio.Future[Any] = asyncio.get_running_loop().create_future()
+        method(callback=functools.partial(_resolve, done), **kwargs)
+        return await done
+
+    def _on_connection_closed(self, connection: AsyncioConnection, reason: Exception) -> None:
+        """Resolve the closed future, which lets run() reconnect or return."""
+        logger.warning("RabbitMQ connection closed: %s", reason)
+        self.channel = None
+        if self._closed is not None and not self._closed.done():
+            self._closed.set_result(None)
+
+    def _on_channel_closed(self, channel: Any, reason: Exception) -> None:
+        """Close the connection as well, so that both are re-established together."""
+        logger.warning("RabbitMQ channel closed: %s", reason)
+        if self.connection is not None and not (
+            self.connection.is_closing or self.connection.is_closed
+        ):
+            self.connection.close()
+
+    def _on_message(self, ch: Any, method: Any, properties: Any, body: bytes) -> None:
+        """Schedule the handling of a delivered message as a task."""
+        task = asyncio.get_running_loop().create_task(self._handle(ch, method, properties, body))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, ch: Any, method: Any, properties: Any, body: bytes) -> None:
+        """Run the handler and (n)acknowledge the message on the channel it was received on."""
+        if self._handler is None:
+            raise RuntimeError("ERROR: No handler registered for the RabbitMQ consumer.")
+        try:
+            await self._handler(properties, body)
+        except asyncio.CancelledError:
+            logger.warning(
+                "Requeueing message %s, its handling was cancelled.", method.delivery_tag
+            )
+            if ch.is_open:
+                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            raise
+        except DeferredMessageError as e:
+            logger.warning(
+                "Requeueing message %s in %.1f seconds: %s.", method.delivery_tag, e.retry_after, e
+            )
+            asyncio.get_running_loop().call_later(
+                e.retry_after, self._requeue, ch, method.delivery_tag
+            )
+        except Exception as e:
+            requeue = not method.redelivered
+            logger.error(
+                "Error while processing message %s: %s. %s.",
+                method.delivery_tag,
+                e,
+                "Requeueing" if requeue else "Rejecting",
+            )
+            if ch.is_open:
+                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=requeue)
+        else:
+            if ch.is_open:
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    @staticmethod
+    def _requeue(ch: Any, delivery_tag: int) -> None:
+        """Requeue a deferred message if its channel is still open."""
+        if ch.is_open:
+            ch.basic_nack(delivery_tag=delivery_tag, requeue=True)
+
+    def publish(
+        self, routing_key: str, body: str | bytes, properties: pika.BasicProperties | None = None
+    ) -> None:
+        """Publish a message on the shared channel.
+
+        Raises:
+        ------
+        pika.exceptions.AMQPConnectionError
+            If the channel is currently not open.
+        """
+        if self.channel is None or not self.channel.is_open:
+            raise pika.exceptions.AMQPConnectionError("ERROR: RabbitMQ channel not open.")
+        self.channel.basic_publish(
+            exchange="", routing_key=routing_key, body=body, properties=properties
+        )
+
+    async def stop(self) -> None:
+        """Wait for the in-flight messages and close the connection."""
+        self._stopping = True
+        if self.channel is not None and self.channel.is_open and self._consumer_tag:
+            self.channel.basic_cancel(self._consumer_tag)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.connection is not None and not (
+            self.connection.is_closing or self.connection.is_closed
+        ):
+            self.connection.close()
+        if self._closed is not None and not self._closed.done():
+            await self._closed
+        logger.info("RabbitMQ connection closed.")
+
+
+def _resolve(future: "asyncio.Future[Any]", result: Any) -> None:
+    """Resolve a future from a pika callback, unless it was already resolved."""
+    if not future.done():
+        future.set_result(result)
+
+
 def decode_image_from_message(body: bytes) -> bytes:
     """Decode base64 image data from message body.
 
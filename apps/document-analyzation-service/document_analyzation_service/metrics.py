@@ -0,0 +1,133 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+
+"""This module collects process-wide counters of the service and optionally exposes them in the Prometheus text format over HTTP."""
+
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRIC_PREFIX = "document_analyzation_service_"
+
+
+def labelled(name: str, **labels: str) -> str:
+    """Attach labels to a counter name in the Prometheus text format.
+
+    Args:
+    ----------
+    name : str
+        The name of the counter.
+    **labels : str
+        The labels of the counter.
+
+    Returns:
+    -------
+    str
+        The counter name with the labels in the Prometheus text format.
+    """
+    if not labels:
+        return name
+    rendered = ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    return f"{name}{{{rendered}}}"
+
+
+class Metrics:
+    """Thread-safe counters identified by their name."""
+
+    def __init__(self) -> None:
+        """Initialize the metrics without any counters."""
+        self._counters: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, amount: float = 1) -> None:
+        """Increase a counter, creating it on first use.
+
+        Args:
+        ----------
+        name : str
+            The name of the counter.
+        amount : float
+            The value added to the counter.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def set(self, name: str, value: float) -> None:
+        """Set a gauge, i.e. a counter which may also decrease, to a value."""
+        with self._lock:
+            self._counters[name] = value
+
+    def value(self, name: str) -> float:
+        """Return the current value of a counter, 0 if it was never increased."""
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> dict[str, float]:
+        """Return a copy of all counters."""
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self) -> None:
+        """Remove all counters."""
+        with self._lock:
+            self._counters.clear()
+
+    def render(self) -> str:
+        """Render all counters in the Prometheus text exposition format.
+
+        Returns:
+        -------
+        str
+            One line per counter, sorted by name.
+        """
+        return "".join(
+            f"{METRIC_PREFIX}{name} {value:g}\n" for name, value in sorted(self.snapshot().items())
+        )
+
+
+metrics = Metrics()
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Answer every GET request with the rendered counters."""
+
+    def do_GET(self) -> None:
+        """Send the counters of the process-wide metrics."""
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        """Keep the scrapes out of the service log."""
+
+
+def start_metrics_server(port: int = METRICS_PORT) -> ThreadingHTTPServer | None:
+    """Serve the metrics on the given port in a daemon thread.
+
+    Args:
+    ----------
+    port : int
+        The port to listen on, 0 disables the endpoint.
+
+    Returns:
+    -------
+    ThreadingHTTPServer | None
+        The running server, None if the endpoint is disabled.
+    """
+    if port <= 0:
+        return None
+    server = ThreadingHTTPServer(("", port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name="das-metrics", daemon=True).start()
+    logger.info("Serving metrics on port %d.", port)
+    return server
@@ -0,0 +1,606 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+
+"""This module schedules the requests to the Azure API with token buckets for its requests and tokens per minute, shared by all processes and replicas through a pluggable backend."""
+
+import asyncio
+import email.utils
+import importlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Mapping, NamedTuple
+
+from document_analyzation_service.metrics import labelled, metrics
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# The limiter is disabled unless at least one of the quotas of the deployment is configured
+AZURE_RPM_LIMIT = int(os.getenv("AZURE_RPM_LIMIT", "0"))
+AZURE_TPM_LIMIT = int(os.getenv("AZURE_TPM_LIMIT", "0"))
+# "local", "sqlite" or the "module:Class" of a custom backend, e.g. one backed by Redis
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "sqlite")
+RATE_LIMIT_SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", "/tmp/das-rate-limits.sqlite")
+# Requests which would have to wait longer are failed instead, leaving the delay to the retries
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "60"))
+
+_rate_limiter: "RateLimiter | None" = None
+_rate_limiter_lock = threading.Lock()
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a request would have to wait longer than allowed for its budget."""
+
+
+class RateLimitQuota(NamedTuple):
+    """The quotas of a scope, e.g. of a deployment, 0 disables the bucket of a quota."""
+
+    requests_per_minute: int
+    tokens_per_minute: int
+
+
+class BucketCost(NamedTuple):
+    """The share of a token bucket a request takes."""
+
+    name: str
+    capacity: float
+    """The budget per minute, which is also the largest burst."""
+    cost: float
+
+
+class BucketState(NamedTuple):
+    """The stored state of a token bucket."""
+
+    level: float
+    """The budget left when the state was updated, negative while requests are queued."""
+    updated: float
+    blocked_until: float
+    """Until when the API asked not to send any requests, e.g. by a Retry-After header."""
+
+
+def refill(state: BucketState | None, capacity: float, now: float) -> BucketState:
+    """Return the state of a bucket at the given time, refilled at its capacity per minute.
+
+    Args:
+    ----------
+    state : BucketState | None
+        The stored state, None for a new bucket, which starts full.
+    capacity : float
+        The budget per minute.
+    now : float
+        The current time as UNIX timestamp.
+
+    Returns:
+    -------
+    BucketState
+        The refilled state, updated at the given time.
+    """
+    if state is None:
+        return BucketState(capacity, now, 0.0)
+    elapsed = max(0.0, now - state.updated)
+    return BucketState(
+        min(capacity, state.level + elapsed * capacity / 60), now, state.blocked_until
+    )
+
+
+def plan_reservation(
+    states: Mapping[str, BucketState | None],
+    costs: list[BucketCost],
+    now: float,
+    max_wait: float,
+) -> tuple[float, dict[str, BucketState]] | None:
+    """Take the costs of a request from their buckets.
+
+    The levels may drop below zero, so that later requests queue up behind the ones which
+    already reserved their budget instead of all of them retrying at once.
+
+    Args:
+    ----------
+    states : Mapping[str, BucketState | None]
+        The stored state of every bucket of the costs.
+    costs : list[BucketCost]
+        The costs of the request.
+    now : float
+        The current time as UNIX timestamp.
+    max_wait : float
+        The longest acceptable wait in seconds.
+
+    Returns:
+    -------
+    tuple[float, dict[str, BucketState]] | None
+        The seconds to wait before sending the request and the new states of the buckets,
+        None if the wait would exceed max_wait, in which case nothing may be reserved.
+    """
+    wait = 0.0
+    new_states = {}
+    for bucket in costs:
+        state = refill(states.get(bucket.name), bucket.capacity, now)
+        level = state.level - bucket.cost
+        if level < 0:
+            wait = max(wait, -level * 60 / bucket.capacity)
+        wait = max(wait, state.blocked_until - now)
+        new_states[bucket.name] = BucketState(level, now, state.blocked_until)
+    if wait > max_wait:
+        return None
+    return wait, new_states
+
+
+def update_state(
+    state: BucketState | None,
+    capacity: float,
+    now: float,
+    delta: float = 0.0,
+    remaining: float | None = None,
+    blocked_until: float | None = None,
+) -> BucketState:
+    """Correct the state of a bucket with what the API reported.
+
+    Args:
+    ----------
+    state : BucketState | None
+        The stored state, None for a new bucket.
+    capacity : float
+        The budget per minute.
+    now : float
+        The current time as UNIX timestamp.
+    delta : float
+        Budget given back, e.g. when a request cost less than estimated, negative to take more.
+    remaining : float | None
+        The budget the API reported as remaining, the level is lowered to it.
+    blocked_until : float | None
+        Until when the API asked not to send requests.
+
+    Returns:
+    -------
+    BucketState
+        The corrected state.
+    """
+    state = refill(state, capacity, now)
+    level = min(capacity, state.level + delta)
+    if remaining is not None:
+        level = min(level, remaining)
+    return BucketState(level, now, max(state.blocked_until, blocked_until or 0.0))
+
+
+class RateLimitBackend(ABC):
+    """Base class of the stores the token buckets are shared through.
+
+    Both operations have to be atomic across all processes using the same store.
+    """
+
+    @abstractmethod
+    def reserve(self, costs: list[BucketCost], now: float, max_wait: float) -> float | None:
+        """Reserve the costs of a request, see plan_reservation.
+
+        Returns:
+        -------
+        float | None
+            The seconds to wait before sending the request, None if nothing was reserved
+            because the wait would exceed max_wait.
+        """
+
+    @abstractmethod
+    def update(
+        self,
+        name: str,
+        capacity: float,
+        now: float,
+        delta: float = 0.0,
+        remaining: float | None = None,
+        blocked_until: float | None = None,
+    ) -> None:
+        """Correct the state of a bucket, see update_state."""
+
+
+class LocalRateLimitBackend(RateLimitBackend):
+    """Keep the buckets in memory, shared by the threads of a single process."""
+
+    def __init__(self) -> None:
+        """Initialize the backend with no buckets."""
+        self._states: dict[str, BucketState] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, costs: list[BucketCost], now: float, max_wait: float) -> float | None:
+        """Reserve the costs of a request, see plan_reservation."""
+        with self._lock:
+            plan = plan_reservation(self._states, costs, now, max_wait)
+            if plan is None:
+                return None
+            wait, new_states = plan
+            self._states.update(new_states)
+            return wait
+
+    def update(
+        self,
+        name: str,
+        capacity: float,
+        now: float,
+        delta: float = 0.0,
+        remaining: float | None = None,
+        blocked_until: float | None = None,
+    ) -> None:
+        """Correct the state of a bucket, see update_state."""
+        with self._lock:
+            self._states[name] = update_state(
+                self._states.get(name), capacity, now, delta, remaining, blocked_until
+            )
+
+
+class SqliteRateLimitBackend(RateLimitBackend):
+    """Keep the buckets in a SQLite database, shared by all processes of a host or volume.
+
+    A stand-in for a networked store in development and single host deployments. Every process,
+    including forked workers, opens its own connection on first use.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Initialize the backend.
+
+        :param path: The file of the SQLite database, created if it does not exist.
+        """
+        self.path = path
+        self._connection: sqlite3.Connection | None = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+
+    def reserve(self, costs: list[BucketCost], now: float, max_wait: float) -> float | None:
+        """Reserve the costs of a request, see plan_reservation."""
+        with self._lock:
+            connection = self._connect()
+            # Take the write lock up front, so that no other process reads the same levels
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                states = {bucket.name: self._load(connection, bucket.name) for bucket in costs}
+                plan = plan_reservation(states, costs, now, max_wait)
+                if plan is not None:
+                    for name, state in plan[1].items():
+                        self._store(connection, name, state)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return None if plan is None else plan[0]
+
+    def update(
+        self,
+        name: str,
+        capacity: float,
+        now: float,
+        delta: float = 0.0,
+        remaining: float | None = None,
+        blocked_until: float | None = None,
+    ) -> None:
+        """Correct the state of a bucket, see update_state."""
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                state = update_state(
+                    self._load(connection, name), capacity, now, delta, remaining, blocked_until
+                )
+                self._store(connection, name, state)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def close(self) -> None:
+        """Close the connection of the current process."""
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+
+    @staticmethod
+    def _load(connection: sqlite3.Connection, name: str) -> BucketState | None:
+        """Read the state of a bucket, None if it does not exist yet."""
+        row = connection.execute(
+            "SELECT level, updated, blocked_until FROM buckets WHERE name = ?", (name,)
+        ).fetchone()
+        return None if row is None else BucketState(*row)
+
+    @staticmethod
+    def _store(connection: sqlite3.Connection, name: str, state: BucketState) -> None:
+        """Write the state of a bucket."""
+        connection.execute(
+            "INSERT OR REPLACE INTO buckets (name, level, updated, blocked_until) "
+            "VALUES (?, ?, ?, ?)",
+            (name, *state),
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return the connection of the current process, opening it if necessary."""
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets "
+                "(name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL, "
+                "blocked_until REAL NOT NULL)"
+            )
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+
+def parse_retry_after(headers: Mapping[str, str], now: float) -> float | None:
+    """Return until when the API asked not to send requests.
+
+    Args:
+    ----------
+    headers : Mapping[str, str]
+        The headers of the response, with case-insensitive keys.
+    now : float
+        The current time as UNIX timestamp.
+
+    Returns:
+    -------
+    float | None
+        The UNIX timestamp from the retry-after-ms or Retry-After header, None without them.
+    """
+    try:
+        if "retry-after-ms" in headers:
+            return now + float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            try:
+                return now + float(value)
+            except ValueError:
+                # Retry-After may also be an HTTP date
+                return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        logger.warning("Ignoring the invalid retry headers %s.", dict(headers))
+    return None
+
+
+def _header_float(headers: Mapping[str, str], name: str) -> float | None:
+    """Return the numeric value of a header, None if it is missing or invalid."""
+    try:
+        return float(headers[name]) if name in headers else None
+    except ValueError:
+        return None
+
+
+class RateLimiter:
+    """Delay the requests to a rate limited API until their budget is available.
+
+    Every scope, e.g. a deployment of a model, has one bucket for its requests and one for its
+    tokens per minute. The budgets are corrected with the x-ratelimit-remaining-* headers of
+    the API, and no requests are sent while a Retry-After of it is pending.
+    """
+
+    def __init__(
+        self,
+        backend: RateLimitBackend,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        max_wait_seconds: float,
+    ) -> None:
+        """Initialize the limiter.
+
+        :param backend: The store of the buckets.
+        :param requests_per_minute: The request quota of the scopes without their own quota, 0
+            disables their bucket.
+        :param tokens_per_minute: The token quota of the scopes without their own quota, 0
+            disables their bucket.
+        :param max_wait_seconds: The longest a request is delayed before failing instead.
+        """
+        self.backend = backend
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_wait_seconds = max_wait_seconds
+
+    def quota(self, quota: RateLimitQuota | None = None) -> RateLimitQuota:
+        """Return the given quota of a scope, the quota of the limiter if None."""
+        return quota or RateLimitQuota(self.requests_per_minute, self.tokens_per_minute)
+
+    def reserve(self, scope: str, tokens: int, quota: RateLimitQuota | None = None) -> float:
+        """Reserve the budget of a request.
+
+        Args:
+        ----------
+        scope : str
+            The scope the quotas apply to.
+        tokens : int
+            The estimated number of tokens of the request.
+        quota : RateLimitQuota | None
+            The quotas of the scope, those of the limiter if None.
+
+        Returns:
+        -------
+        float
+            The seconds to wait before sending the request.
+
+        Raises:
+        ------
+        RateLimitTimeout
+            If the request would have to wait longer than max_wait_seconds.
+        """
+        quota = self.quota(quota)
+        costs = [
+            BucketCost(f"{scope}|{kind}", capacity, cost)
+            for kind, capacity, cost in (
+                ("requests", quota.requests_per_minute, 1),
+                ("tokens", quota.tokens_per_minute, tokens),
+            )
+            if capacity > 0
+        ]
+        wait = self.backend.reserve(costs, time.time(), self.max_wait_seconds)
+        if wait is None:
+            metrics.increment(labelled("rate_limit_timeouts_total", scope=scope))
+            raise RateLimitTimeout(
+                f"The rate limit of {scope} does not allow a request within "
+                f"{self.max_wait_seconds} seconds."
+            )
+        if wait > 0:
+            metrics.increment(labelled("rate_limit_throttled_total", scope=scope))
+            metrics.increment(labelled("rate_limit_wait_seconds_total", scope=scope), wait)
+        return wait
+
+    def acquire(self, scope: str, tokens: int, quota: RateLimitQuota | None = None) -> None:
+        """Reserve the budget of a request and sleep until it may be sent, see reserve."""
+        wait = self.reserve(scope, tokens, quota)
+        if wait > 0:
+            logger.info(
+                "Delaying a request to %s by %.1f seconds for its rate limit.", scope, wait
+            )
+            time.sleep(wait)
+
+    async def acquire_async(
+        self, scope: str, tokens: int, quota: RateLimitQuota | None = None
+    ) -> None:
+        """Reserve the budget of a request without blocking the event loop, see reserve."""
+        wait = await asyncio.to_thread(self.reserve, scope, tokens, quota)
+        if wait > 0:
+            logger.info(
+                "Delaying a request to %s by %.1f seconds for its rate limit.", scope, wait
+            )
+            await asyncio.sleep(wait)
+
+    def observe(
+        self,
+        scope: str,
+        headers: Mapping[str, str],
+        estimated_tokens: int = 0,
+        used_tokens: int | None = None,
+        quota: RateLimitQuota | None = None,
+    ) -> None:
+        """Correct the budgets of a scope with a response of the API.
+
+        Args:
+        ----------
+        scope : str
+            The scope the request was sent to.
+        headers : Mapping[str, str]
+            The headers of the response, with case-insensitive keys.
+        estimated_tokens : int
+            The tokens reserved for the request.
+        used_tokens : int | None
+            The tokens the request actually used, None if unknown.
+        quota : RateLimitQuota | None
+            The quotas of the scope, those of the limiter if None.
+        """
+        quota = self.quota(quota)
+        now = time.time()
+        blocked_until = parse_retry_after(headers, now)
+        if blocked_until is not None:
+            metrics.increment(labelled("rate_limit_retry_after_total", scope=scope))
+            logger.warning(
+                "The API of %s asked to wait %.1f seconds.", scope, max(0, blocked_until - now)
+            )
+        for kind, capacity, delta in (
+            ("requests", quota.requests_per_minute, 0),
+            (
+                "tokens",
+                quota.tokens_per_minute,
+                0 if used_tokens is None else estimated_tokens - used_tokens,
+            ),
+        ):
+            remaining = _header_float(headers, f"x-ratelimit-remaining-{kind}")
+            if capacity > 0 and (delta or remaining is not None or blocked_until is not None):
+                self.backend.update(
+                    f"{scope}|{kind}", capacity, now, delta, remaining, blocked_until
+                )
+
+    async def observe_async(
+        self,
+        scope: str,
+        headers: Mapping[str, str],
+        estimated_tokens: int = 0,
+        used_tokens: int | None = None,
+        quota: RateLimitQuota | None = None,
+    ) -> None:
+        """Correct the budgets of a scope without blocking the event loop, see observe."""
+        await asyncio.to_thread(self.observe, scope, headers, estimated_tokens, used_tokens, quota)
+
+    def release(self, scope: str, tokens: int, quota: RateLimitQuota | None = None) -> None:
+        """Give back the tokens reserved for a request which never got a response.
+
+        Args:
+        ----------
+        scope : str
+            The scope the request was sent to.
+        tokens : int
+            The tokens reserved for the request.
+        quota : RateLimitQuota | None
+            The quotas of the scope, those of the limiter if None.
+        """
+        capacity = self.quota(quota).tokens_per_minute
+        if capacity > 0 and tokens > 0:
+            self.backend.update(f"{scope}|tokens", capacity, time.time(), tokens)
+
+    async def release_async(
+        self, scope: str, tokens: int, quota: RateLimitQuota | None = None
+    ) -> None:
+        """Give back reserved tokens without blocking the event loop, see release."""
+        await asyncio.to_thread(self.release, scope, tokens, quota)
+
+
+def create_rate_limit_backend(name: str) -> RateLimitBackend:
+    """Create the backend of the given name.
+
+    Args:
+    ----------
+    name : str
+        "local", "sqlite" or the "module:Class" of a RateLimitBackend constructed without
+        arguments.
+
+    Returns:
+    -------
+    RateLimitBackend
+        The new backend.
+    """
+    if name == "local":
+        return LocalRateLimitBackend()
+    if name == "sqlite":
+        return SqliteRateLimitBackend(RATE_LIMIT_SQLITE_PATH)
+    module_name, _, class_name = name.partition(":")
+    backend: RateLimitBackend = getattr(importlib.import_module(module_name), class_name)()
+    return backend
+
+
+def get_rate_limiter(quota: RateLimitQuota | None = None) -> RateLimiter | None:
+    """Return the process-wide rate limiter, creating it on first use.
+
+    Args:
+    ----------
+    quota : RateLimitQuota | None
+        The quotas of the scope the limiter is used for, AZURE_RPM_LIMIT and AZURE_TPM_LIMIT
+        if None.
+
+    Returns:
+    -------
+    RateLimiter | None
+        The shared limiter, None if the scope has neither a request nor a token quota.
+    """
+    global _rate_limiter
+    quota = quota or RateLimitQuota(AZURE_RPM_LIMIT, AZURE_TPM_LIMIT)
+    if quota.requests_per_minute <= 0 and quota.tokens_per_minute <= 0:
+        return None
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            logger.info(
+                "Limiting the Azure requests by default to %d requests and %d tokens per minute with the %s backend.",
+                AZURE_RPM_LIMIT,
+                AZURE_TPM_LIMIT,
+                RATE_LIMIT_BACKEND,
+            )
+            _rate_limiter = RateLimiter(
+                create_rate_limit_backend(RATE_LIMIT_BACKEND),
+                AZURE_RPM_LIMIT,
+                AZURE_TPM_LIMIT,
+                RATE_LIMIT_MAX_WAIT_SECONDS,
+            )
+        return _rate_limiter
@@ -0,0 +1,189 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+
+"""This module caches the analysis results of images on disk, so that repeated uploads of the same document are answered without running the OCR and the extraction again."""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from document_analyzation_service.single_flight import content_key
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# The cache is disabled unless a path for its database is configured
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "")
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+
+_result_cache: "ResultCache | None" = None
+_result_cache_lock = threading.Lock()
+
+
+def result_cache_key(
+    content_hash: str, document_type: str, model: str, extraction_version: str
+) -> str:
+    """Derive the cache key of an analysis result.
+
+    Args:
+    ----------
+    content_hash : str
+        The hash of the decoded image, see DocumentContext.content_hash.
+    document_type : str
+        The document type requested by the message.
+    model : str
+        The name of the model extracting the document data.
+    extraction_version : str
+        A fingerprint of the prompt and the schemas used for the extraction.
+
+    Returns:
+    -------
+    str
+        The hex digest identifying the result.
+    """
+    return content_key(content_hash, document_type, model, extraction_version)
+
+
+class ResultCache:
+    """Analysis results stored in a SQLite database with TTL and size based eviction.
+
+    The database can be shared by several processes. Every process, including forked
+    workers, opens its own connection on first use.
+    """
+
+    def __init__(self, path: str, ttl_seconds: int, max_entries: int) -> None:
+        """Initialize the cache.
+
+        :param path: The file of the SQLite database, created if it does not exist.
+        :param ttl_seconds: Seconds after which a result expires, 0 disables the expiry.
+        :param max_entries: Number of results kept, the least recently used are evicted first.
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._connection: sqlite3.Connection | None = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        """Return the cached result with the given key.
+
+        Args:
+        ----------
+        key : str
+            The key of the result, see result_cache_key.
+
+        Returns:
+        -------
+        dict[str, Any] | None
+            The cached result, None if it is missing or expired.
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT value, created FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self._is_expired(row[1], now):
+                connection.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            connection.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+        value: dict[str, Any] = json.loads(row[0])
+        return value
+
+    def put(self, key: str, value: dict[str, Any]) -> None:
+        """Store a result and evict expired and surplus results.
+
+        Args:
+        ----------
+        key : str
+            The key of the result, see result_cache_key.
+        value : dict[str, Any]
+            The JSON serializable result.
+        """
+        now = time.time()
+        serialized = json.dumps(value)
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO results (key, value, created, accessed) "
+                "VALUES (?, ?, ?, ?)",
+                (key, serialized, now, now),
+            )
+            if self.ttl_seconds > 0:
+                connection.execute(
+                    "DELETE FROM results WHERE created < ?", (now - self.ttl_seconds,)
+                )
+            if self.max_entries > 0:
+                connection.execute(
+                    "DELETE FROM results WHERE key NOT IN "
+                    "(SELECT key FROM results ORDER BY accessed DESC LIMIT ?)",
+                    (self.max_entries,),
+                )
+
+    def __len__(self) -> int:
+        """Return the number of stored results, including expired ones not yet evicted."""
+        with self._lock:
+            count: int = self._connect().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return count
+
+    def close(self) -> None:
+        """Close the connection of the current process."""
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+
+    def _is_expired(self, created: float, now: float) -> bool:
+        """Return whether a result created at the given time has expired."""
+        return self.ttl_seconds > 0 and created < now - self.ttl_seconds
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return the connection of the current process, opening it if necessary."""
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, "
+                "accessed REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+
+def get_result_cache() -> ResultCache | None:
+    """Return the process-wide result cache, creating it on first use.
+
+    Returns:
+    -------
+    ResultCache | None
+        The shared cache, None if RESULT_CACHE_PATH is not configured.
+    """
+    global _result_cache
+    if not RESULT_CACHE_PATH:
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            logger.info("Caching analysis results in %s", RESULT_CACHE_PATH)
+            _result_cache = ResultCache(
+                RESULT_CACHE_PATH, RESULT_CACHE_TTL_SECONDS, RESULT_CACHE_MAX_ENTRIES
+            )
+        return _result_cache
@@ -0,0 +1,170 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+
+"""This module defines the broker-side retry topology. Messages which failed transiently are parked in delay queues, whose expired messages are dead-lettered back into the work queue, with an exponentially growing delay per attempt. Messages which exhausted all attempts end up in a dead-letter queue."""
+
+import logging
+from typing import Any
+
+import pika
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+RETRY_ATTEMPT_HEADER = "x-retry-attempt"
+
+
+class RetryTopology:
+    """The delay queues and the dead-letter queue belonging to a work queue."""
+
+    def __init__(self, queue_name: str, delays_ms: list[int]) -> None:
+        """Initialize the topology.
+
+        :param queue_name: The work queue the retried messages are delivered to again.
+        :param delays_ms: The delay in milliseconds of every retry, one delay queue each.
+        """
+        self.queue_name = queue_name
+        self.delays_ms = delays_ms
+
+    @classmethod
+    def exponential(
+        cls, queue_name: str, levels: int, base_delay_ms: int, factor: int = 2
+    ) -> "RetryTopology":
+        """Create a topology whose delays grow exponentially.
+
+        Args:
+        ----------
+        queue_name : str
+            The work queue the retried messages are delivered to again.
+        levels : int
+            The number of retries.
+        base_delay_ms : int
+            The delay of the first retry in milliseconds.
+        factor : int
+            The factor the delay grows by with every retry.
+
+        Returns:
+        -------
+        RetryTopology
+            The topology with the delays base_delay_ms * factor ** level.
+        """
+        return cls(queue_name, [base_delay_ms * factor**level for level in range(levels)])
+
+    @property
+    def dead_letter_queue_name(self) -> str:
+        """The queue collecting the messages which exhausted all retries."""
+        return f"{self.queue_name}.dead-letter"
+
+    def retry_queue_name(self, level: int) -> str:
+        """Return the name of the delay queue of the given retry level."""
+        return f"{self.queue_name}.retry.{level}"
+
+    def queue_arguments(self) -> dict[str, dict[str, Any]]:
+        """Return the queues of the topology with the arguments they have to be declared with.
+
+        Returns:
+        -------
+        dict[str, dict[str, Any]]
+            The arguments of every delay queue and of the dead-letter queue by queue name.
+        """
+        queues: dict[str, dict[str, Any]] = {
+            self.retry_queue_name(level): {
+                "x-message-ttl": delay_ms,
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": self.queue_name,
+            }
+            for level, delay_ms in enumerate(self.delays_ms)
+        }
+        queues[self.dead_letter_queue_name] = {}
+        return queues
+
+    @staticmethod
+    def attempt_of(properties: Any) -> int:
+        """Return how often the message was already retried, based on its attempt header."""
+        headers = getattr(properties, "headers", None)
+        if not isinstance(headers, dict):
+            return 0
+        try:
+            return int(headers.get(RETRY_ATTEMPT_HEADER, 0))
+        except (TypeError, ValueError):
+            return 0
+
+    def next_destination(self, properties: Any) -> tuple[str, pika.BasicProperties, bool]:
+        """Determine where a transiently failed message has to be published to.
+
+        Args:
+        ----------
+        properties : Any
+            The AMQP properties of the failed message.
+
+        Returns:
+        -------
+        tuple[str, pika.BasicProperties, bool]
+            The queue to publish to, the properties with the incremented attempt header and
+            whether the retries are exhausted, i.e. the queue is the dead-letter queue.
+        """
+        attempt = self.attempt_of(properties)
+        headers = getattr(properties, "headers", None)
+        headers = dict(headers) if isinstance(headers, dict) else {}
+        headers[RETRY_ATTEMPT_HEADER] = attempt + 1
+        content_type = getattr(properties, "content_type", None)
+
+        if attempt < len(self.delays_ms):
+            delay_ms = self.delays_ms[attempt]
+            logger.info("Retrying message in %d ms (attempt %d).", delay_ms, attempt + 1)
+            return (
+                self.retry_queue_name(attempt),
+                pika.BasicProperties(
+                    content_type=content_type if isinstance(content_type, str) else None,
+                    headers=headers,
+                    expiration=str(delay_ms),
+                    delivery_mode=pika.DeliveryMode.Persistent,
+                ),
+                False,
+            )
+
+        logger.warning("Retries exhausted after %d attempts, dead-lettering message.", attempt)
+        return (
+            self.dead_letter_queue_name,
+            pika.BasicProperties(
+                content_type=content_type if isinstance(content_type, str) else None,
+                headers=headers,
+                delivery_mode=pika.DeliveryMode.Persistent,
+            ),
+            True,
+        )
+
+    def park_destination(self, properties: Any) -> tuple[str, pika.BasicProperties]:
+        """Determine where a message which was not attempted has to be parked.
+
+        The message waits in the delay queue with the longest delay and keeps its attempt
+        count, so that an outage of a dependency does not use up its retries.
+
+        Args:
+        ----------
+        properties : Any
+            The AMQP properties of the message.
+
+        Returns:
+        -------
+        tuple[str, pika.BasicProperties]
+            The delay queue to publish to and the properties with the unchanged attempt header.
+        """
+        level = len(self.delays_ms) - 1
+        headers = getattr(properties, "headers", None)
+        headers = dict(headers) if isinstance(headers, dict) else {}
+        headers[RETRY_ATTEMPT_HEADER] = self.attempt_of(properties)
+        content_type = getattr(properties, "content_type", None)
+        logger.info("Parking message for %d ms.", self.delays_ms[level])
+        return (
+            self.retry_queue_name(level),
+            pika.BasicProperties(
+                content_type=content_type if isinstance(content_type, str) else None,
+                headers=headers,
+                expiration=str(self.delays_ms[level]),
+                delivery_mode=pika.DeliveryMode.Persistent,
+            ),
+        )
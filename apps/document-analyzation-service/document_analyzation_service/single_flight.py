@@ -0,0 +1,169 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+
+"""This module coalesces concurrent computations with the same key, so that a burst of identical documents is only processed once while the result is shared by all waiting callers."""
+
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Awaitable, Callable, Generic, TypeVar
+
+from document_analyzation_service.metrics import metrics
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def content_key(*parts: str | bytes) -> str:
+    """Derive a single-flight key from the content the computation depends on.
+
+    Args:
+    ----------
+    *parts : str | bytes
+        The inputs of the computation, e.g. the image and the document type.
+
+    Returns:
+    -------
+    str
+        The hex digest of all parts.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8") if isinstance(part, str) else part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class _Call(Generic[T]):
+    """A computation in flight, which the callers with the same key wait for."""
+
+    def __init__(self) -> None:
+        """Initialize the call without a result."""
+        self.done = threading.Event()
+        self.result: T | None = None
+        self.exception: BaseException | None = None
+
+
+class SingleFlight(Generic[T]):
+    """Run at most one computation per key at a time across the threads of a process."""
+
+    def __init__(self, name: str) -> None:
+        """Initialize the single-flight group.
+
+        :param name: The name of the group, used as prefix of its metrics.
+        """
+        self.name = name
+        self._calls: dict[str, _Call[T]] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        """Run the computation, or wait for the one with the same key which is in flight.
+
+        The result, or the exception, of the computation is shared with every caller which
+        waited for it. Once it finished, the next call with the key computes anew.
+
+        Args:
+        ----------
+        key : str
+            The key identifying the computation, see content_key.
+        fn : Callable[[], T]
+            The computation.
+
+        Returns:
+        -------
+        T
+            The result of the computation.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if call is None:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.increment(f"{self.name}_coalesced_total")
+            logger.info("Waiting for the %s in flight for the same content.", self.name)
+            call.done.wait()
+            if call.exception is not None:
+                raise call.exception
+            return call.result  # type: ignore[return-value]
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.exception = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self) -> int:
+        """Return the number of computations currently running."""
+        with self._lock:
+            return len(self._calls)
+
+
+class AsyncSingleFlight(Generic[T]):
+    """Run at most one coroutine per key at a time on an event loop, see SingleFlight."""
+
+    def __init__(self, name: str) -> None:
+        """Initialize the single-flight group.
+
+        :param name: The name of the group, used as prefix of its metrics.
+        """
+        self.name = name
+        self._calls: dict[str, asyncio.Future[T]] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """Await the coroutine, or the one with the same key which is in flight.
+
+        Args:
+        ----------
+        key : str
+            The key identifying the computation, see content_key.
+        fn : Callable[[], Awaitable[T]]
+            Creates the coroutine of the computation.
+
+        Returns:
+        -------
+        T
+            The result of the computation, computed again if the coroutine in flight was
+            cancelled.
+        """
+        call = self._calls.get(key)
+        if call is not None:
+            metrics.increment(f"{self.name}_coalesced_total")
+            logger.info("Waiting for the %s in flight for the same content.", self.name)
+            try:
+                # Shielded, so that a cancelled follower does not cancel the computation
+                return await asyncio.shield(call)
+            except asyncio.CancelledError:
+                if not call.cancelled():
+                    raise
+            # Only the task awaiting the computation in flight was cancelled, not this one
+            return await self.do(key, fn)
+
+        call = asyncio.get_running_loop().create_future()
+        self._calls[key] = call
+        try:
+            result = await fn()
+            call.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except BaseException as e:
+            call.set_exception(e)
+            # Mark the exception as retrieved, in case no follower waits for it
+            call.exception()
+            raise
+        finally:
+            del self._calls[key]
@@ -0,0 +1,272 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+
+"""This module contains a multi-process entry point for the document analyzation service. The supervisor loads the doctr model once and forks consumer processes which share the weights copy-on-write. Crashed workers are restarted and workers are recycled after a number of messages or when their memory grows too large."""
+
+import gc
+import logging
+import multiprocessing
+import os
+import resource
+import signal
+import threading
+import time
+from multiprocessing.process import BaseProcess
+from types import FrameType
+from typing import Callable
+
+from dotenv import load_dotenv
+
+from document_analyzation_service.document_classification import classification
+from document_analyzation_service.main import (
+    CONSUMER_PREFETCH_COUNT,
+    CONSUMER_WORKER_COUNT,
+    close_publisher,
+    create_receiver,
+    on_image_received,
+)
+from document_analyzation_service.message_broker import RabbitMQReceiver
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+SUPERVISOR_WORKER_COUNT = int(os.getenv("SUPERVISOR_WORKER_COUNT", str(os.cpu_count() or 1)))
+WORKER_MAX_MESSAGES = int(os.getenv("WORKER_MAX_MESSAGES", "0"))
+WORKER_MAX_RSS_MB = int(os.getenv("WORKER_MAX_RSS_MB", "0"))
+WORKER_RESTART_DELAY = float(os.getenv("WORKER_RESTART_DELAY", "1"))
+
+MessageCallback = Callable[[object, object, object, object], None]
+
+
+def current_rss_bytes() -> int:
+    """Return the resident set size of the current process.
+
+    Returns:
+    -------
+    int
+        The resident memory in bytes, the peak resident memory if the current one is unknown.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is reported in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RecyclingCallback:
+    """Wrap a message callback and stop the receiver once the worker should be recycled."""
+
+    def __init__(
+        self,
+        receiver: RabbitMQReceiver,
+        callback: MessageCallback,
+        max_messages: int = 0,
+        max_rss_bytes: int = 0,
+    ) -> None:
+        """Initialize the callback wrapper.
+
+        :param receiver: The receiver to stop once a limit is reached.
+        :param callback: The callback processing the messages.
+        :param max_messages: Number of messages after which the worker is recycled, 0 disables it.
+        :param max_rss_bytes: Resident memory above which the worker is recycled, 0 disables it.
+        """
+        self.receiver = receiver
+        self.callback = callback
+        self.max_messages = max_messages
+        self.max_rss_bytes = max_rss_bytes
+        self.processed_messages = 0
+        self.stop_requested = False
+        self._lock = threading.Lock()
+
+    def __call__(self, ch: object, method: object, properties: object, body: object) -> None:
+        """Process a message and check the recycling limits afterwards."""
+        try:
+            self.callback(ch, method, properties, body)
+        finally:
+            with self._lock:
+                self.processed_messages += 1
+                reason = self._recycling_reason()
+                if reason and not self.stop_requested:
+                    self.stop_requested = True
+                    logger.info("Recycling worker %d: %s.", os.getpid(), reason)
+                    self.receiver.request_stop()
+
+    def _recycling_reason(self) -> str | None:
+        """Return why the worker has to be recycled, None if it can continue."""
+        if self.max_messages and self.processed_messages >= self.max_messages:
+            return f"processed {self.processed_messages} messages"
+        if self.max_rss_bytes:
+            rss = current_rss_bytes()
+            if rss > self.max_rss_bytes:
+                return f"resident memory of {rss // (1024 * 1024)} MB exceeds the limit"
+        return None
+
+
+def _raise_keyboard_interrupt(signal_number: int, frame: FrameType | None) -> None:
+    """Translate SIGTERM into the KeyboardInterrupt the consumer loop shuts down on."""
+    raise KeyboardInterrupt
+
+
+def run_worker(max_messages: int, max_rss_bytes: int) -> None:
+    """Consume messages in a forked worker process until it is stopped or recycled.
+
+    Args:
+    ----------
+    max_messages : int
+        Number of messages after which the worker exits, 0 disables the limit.
+    max_rss_bytes : int
+        Resident memory after which the worker exits, 0 disables the limit.
+    """
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    # The messages are acknowledged after processing and only a bounded number is prefetched,
+    # so that the messages of a recycled or terminated worker are redelivered to the others
+    receiver = create_receiver(
+        max(1, CONSUMER_WORKER_COUNT),
+        CONSUMER_PREFETCH_COUNT if CONSUMER_WORKER_COUNT > 0 else 1,
+    )
+    callback = RecyclingCallback(
+        receiver,
+        on_image_received,  # type: ignore[arg-type]
+        max_messages,
+        max_rss_bytes,
+    )
+    try:
+        logger.info("Worker %d is listening for messages...", os.getpid())
+        receiver.start_listening(callback)
+    except KeyboardInterrupt:
+        logger.info("Stopping worker %d...", os.getpid())
+    finally:
+        receiver.stop()
+        close_publisher()
+        classification.shutdown_ocr_workers()
+
+
+def preload_models() -> None:
+    """Load the doctr model in the supervisor, so that the forked workers inherit it.
+
+    No inference is run here, as the thread pools of torch must not be started before forking.
+    If the OCR runs in dedicated worker processes, they load the model themselves.
+    """
+    if classification.OCR_PROCESS_WORKERS > 0:
+        return
+    logger.info("Loaded OCR model %s.", type(classification.get_ocr_model()).__name__)
+
+
+class WorkerSupervisor:
+    """Fork, monitor and restart the consumer processes."""
+
+    def __init__(
+        self,
+        worker_count: int,
+        max_messages: int = 0,
+        max_rss_mb: int = 0,
+        restart_delay: float = 1.0,
+        poll_interval: float = 1.0,
+    ) -> None:
+        """Initialize the supervisor.
+
+        :param worker_count: Number of consumer processes.
+        :param max_messages: Messages after which a worker is recycled, 0 disables it.
+        :param max_rss_mb: Resident memory in MB after which a worker is recycled, 0 disables it.
+        :param restart_delay: Seconds to wait before restarting a crashed worker.
+        :param poll_interval: Seconds between two checks of the workers.
+        """
+        self.worker_count = max(1, worker_count)
+        self.max_messages = max_messages
+        self.max_rss_bytes = max_rss_mb * 1024 * 1024
+        self.restart_delay = restart_delay
+        self.poll_interval = poll_interval
+        self.workers: dict[int, BaseProcess] = {}
+        self._context = multiprocessing.get_context("fork")
+        self._stopping = False
+
+    def start_worker(self, slot: int) -> None:
+        """Fork a new consumer process for the given slot."""
+        worker = self._context.Process(
+            target=run_worker,
+            args=(self.max_messages, self.max_rss_bytes),
+            name=f"das-worker-{slot}",
+        )
+        worker.start()
+        self.workers[slot] = worker
+        logger.info("Started worker %s with PID %s.", worker.name, worker.pid)
+
+    def check_workers(self) -> None:
+        """Restart the workers which exited, delaying the restart of crashed ones."""
+        for slot, worker in list(self.workers.items()):
+            if worker.is_alive() or self._stopping:
+                continue
+            worker.join()
+            if worker.exitcode == 0:
+                logger.info("Worker %s was recycled, starting a new one.", worker.name)
+            else:
+                logger.error(
+                    "Worker %s crashed with exit code %s, restarting in %.1f seconds.",
+                    worker.name,
+                    worker.exitcode,
+                    self.restart_delay,
+                )
+                time.sleep(self.restart_delay)
+            if not self._stopping:
+                self.start_worker(slot)
+
+    def run(self) -> None:
+        """Start all workers and supervise them until SIGINT or SIGTERM is received."""
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        # Keep the objects of the preloaded model out of the garbage collector, so that its
+        # bookkeeping does not copy the shared pages into every worker
+        gc.freeze()
+        for slot in range(self.worker_count):
+            self.start_worker(slot)
+        while not self._stopping:
+            self.check_workers()
+            time.sleep(self.poll_interval)
+        self.stop()
+
+    def _request_stop(self, signal_number: int, frame: FrameType | None) -> None:
+        """Leave the supervision loop on the next iteration."""
+        logger.info("Received signal %d, stopping the workers...", signal_number)
+        self._stopping = True
+
+    def stop(self, timeout: float = 60.0) -> None:
+        """Terminate all workers, killing those which do not finish within the timeout."""
+        self._stopping = True
+        for worker in self.workers.values():
+            if worker.is_alive() and worker.pid is not None:
+                os.kill(worker.pid, signal.SIGTERM)
+        deadline = time.monotonic() + timeout
+        for worker in self.workers.values():
+            worker.join(max(0.0, deadline - time.monotonic()))
+            if worker.is_alive():
+                logger.warning("Worker %s did not stop in time, killing it.", worker.name)
+                worker.kill()
+                worker.join()
+        logger.info("All workers stopped.")
+
+
+def main() -> None:
+    """Load the models once and supervise the forked consumer processes."""
+    load_dotenv()
+    preload_models()
+    supervisor = WorkerSupervisor(
+        worker_count=SUPERVISOR_WORKER_COUNT,
+        max_messages=WORKER_MAX_MESSAGES,
+        max_rss_mb=WORKER_MAX_RSS_MB,
+        restart_delay=WORKER_RESTART_DELAY,
+    )
+    logger.info("Starting %d workers...", supervisor.worker_count)
+    try:
+        supervisor.run()
+    finally:
+        classification.shutdown_ocr_workers()
+
+
+if __name__ == "__main__":
+    main()
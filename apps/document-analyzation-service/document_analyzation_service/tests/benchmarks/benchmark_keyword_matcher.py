@@ -0,0 +1,72 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+"""Micro-benchmark of the document type scoring, compiled and fuzzy matching against substring tests.
+
+Run with: python -m document_analyzation_service.tests.benchmarks.benchmark_keyword_matcher
+"""
+
+import random
+import timeit
+
+from document_analyzation_service.document_classification.classification import (
+    _fuzzy_scorer,
+    calculate_best_doc_type_fit,
+)
+from document_analyzation_service.document_classification.document_class_identifier.document_type_identifier_list import (
+    document_type_identifier_list,
+)
+
+
+def naive_best_doc_type_fit(ocr_text):
+    """The scoring before the compiled matcher, one substring test per identifier."""
+    best_doc_type, best_score = "", 0.0
+    for doc_type_identifier in document_type_identifier_list:
+        identifiers = doc_type_identifier.characteristic_identifier
+        hits = sum(identifier.lower() in ocr_text.lower() for identifier in identifiers)
+        score = hits / len(identifiers) if identifiers else 0
+        if doc_type_identifier.main_identifier.lower() not in ocr_text.lower():
+            score *= 0.1
+        if best_score < score:
+            best_doc_type, best_score = doc_type_identifier.name, score
+    return best_doc_type
+
+
+def sample_texts(count, words_per_text=400, seed=0):
+    """OCR-like texts mixing identifiers with filler words."""
+    rng = random.Random(seed)
+    identifiers = [
+        identifier
+        for doc_type_identifier in document_type_identifier_list
+        for identifier in doc_type_identifier.characteristic_identifier
+    ]
+    filler = ["Lorem", "ipsum", "12.03.2024", "Hamburg", "Str.", "1234", "GmbH", "kg", "Nr."]
+    return [
+        " ".join(
+            rng.choice(identifiers).title() if rng.random() < 0.1 else rng.choice(filler)
+            for _ in range(words_per_text)
+        )
+        for _ in range(count)
+    ]
+
+
+def main(repeat=5):
+    texts = sample_texts(50)
+    assert [calculate_best_doc_type_fit(t) for t in texts] == [
+        naive_best_doc_type_fit(t) for t in texts
+    ]
+    for name, function in [
+        ("substring tests", naive_best_doc_type_fit),
+        ("compiled matcher", calculate_best_doc_type_fit),
+        ("fuzzy n-grams", _fuzzy_scorer.score),
+    ]:
+        seconds = min(
+            timeit.repeat(lambda: [function(t) for t in texts], number=10, repeat=repeat)
+        )
+        print(f"{name:>18}: {seconds / (10 * len(texts)) * 1e6:8.1f} µs per document")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+"""Benchmark of the OCR configurations of the classification on a folder of sample documents.
+
+Every configuration runs in a fresh process, so that its peak memory is measured in isolation.
+The classification agreement is reported relative to the first configuration.
+
+Run with:
+python -m document_analyzation_service.tests.benchmarks.benchmark_ocr_backends <samples_dir> \
+    torch:: torch:db_mobilenet_v3_large:crnn_mobilenet_v3_small onnx-int8::
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import statistics
+import time
+
+SAMPLE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def run_configuration(configuration, paths, connection):
+    """Classify all samples with one configuration "<backend>:<det_arch>:<reco_arch>"."""
+    from document_analyzation_service.document_classification import classification
+    from document_analyzation_service.document_context import DocumentContext
+
+    backend, det_arch, reco_arch = (configuration.split(":") + ["", ""])[:3]
+    if backend == "onnx-int8":
+        backend, classification.OCR_ONNX_INT8 = "onnx", True
+
+    start = time.perf_counter()
+    model = classification.load_ocr_model(
+        classification.OCR_MODEL_DIR, backend, det_arch, reco_arch
+    )
+    load_seconds = time.perf_counter() - start
+    # Exclude the allocations of the first inference from the latencies
+    classification._ocr_model = model
+    classification.warmup_ocr_model()
+
+    labels, latencies = [], []
+    for path in paths:
+        with open(path, "rb") as file:
+            document = DocumentContext(file.read())
+        start = time.perf_counter()
+        text = model([document.rgb_array]).render()
+        latencies.append(time.perf_counter() - start)
+        labels.append(classification.calculate_best_doc_type_fit(text))
+
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    connection.send((load_seconds, latencies, labels, peak_mb))
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "samples_dir", help="folder with the sample documents, searched recursively"
+    )
+    parser.add_argument("configurations", nargs="+", help="<backend>:<det_arch>:<reco_arch>")
+    arguments = parser.parse_args()
+
+    paths = sorted(
+        os.path.join(directory, file_name)
+        for directory, _, file_names in os.walk(arguments.samples_dir)
+        for file_name in file_names
+        if file_name.lower().endswith(SAMPLE_EXTENSIONS)
+    )
+    context = multiprocessing.get_context("spawn")
+    reference_labels = None
+    print(f"{len(paths)} samples")
+    print(
+        f"{'configuration':<55} {'load s':>7} {'median ms':>10} {'p95 ms':>8} {'peak MB':>8} {'agree':>6}"
+    )
+    for configuration in arguments.configurations:
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=run_configuration, args=(configuration, paths, sender))
+        process.start()
+        load_seconds, latencies, labels, peak_mb = receiver.recv()
+        process.join()
+
+        reference_labels = reference_labels or labels
+        agreement = sum(a == b for a, b in zip(labels, reference_labels)) / max(1, len(labels))
+        latencies_ms = sorted(latency * 1000 for latency in latencies)
+        p95 = latencies_ms[int(0.95 * (len(latencies_ms) - 1))] if latencies_ms else 0
+        print(
+            f"{configuration:<55} {load_seconds:7.1f} {statistics.median(latencies_ms or [0]):10.0f} "
+            f"{p95:8.0f} {peak_mb:8.0f} {agreement:6.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+import json
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from document_analyzation_service.async_main import AsyncDocumentAnalyzationService
+from document_analyzation_service.main import SAVE_ANALYZATION_RESULT_PATTERN, SEND_QUEUE_NAME
+
+
+class TestAsyncDocumentAnalyzationService(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.consumer = MagicMock()
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.service = AsyncDocumentAnalyzationService(self.consumer, 2, self.executor)
+
+    def tearDown(self):
+        self.executor.shutdown(wait=True)
+
+    @patch("document_analyzation_service.async_main.process_image_async", new_callable=AsyncMock)
+    @patch("document_analyzation_service.async_main.prepare_document")
+    @patch("document_analyzation_service.main.load_image_data", return_value=b"image")
+    async def test_on_image_received_publishes_result(self, mock_load, mock_prepare, mock_process):
+        mock_prepare.return_value = ("data_url", "CMR", 1.0)
+        mock_process.return_value = {"processed": "data"}
+        body = json.dumps({"data": {"uuid": "1234", "image_base64": "abc"}}).encode("utf-8")
+
+        await self.service.on_image_received(MagicMock(), body)
+
+        data, document = mock_prepare.call_args[0]
+        self.assertEqual(data, {"uuid": "1234", "image_base64": "abc"})
+        self.assertEqual(document.image_data, b"image")
+        mock_process.assert_awaited_once_with(
+            "data_url", "1234", SAVE_ANALYZATION_RESULT_PATTERN, "CMR", 1.0
+        )
+        self.consumer.publish.assert_called_once_with(
+            SEND_QUEUE_NAME, json.dumps({"processed": "data"})
+        )
+
+    @patch("document_analyzation_service.async_main.prepare_document")
+    @patch("document_analyzation_service.main.load_image_data", return_value=b"image")
+    async def test_on_image_received_publishes_error_event(self, mock_load, mock_prepare):
+        mock_prepare.side_effect = Exception("Decode failure")
+        body = json.dumps({"data": {"uuid": "1234"}}).encode("utf-8")
+
+        await self.service.on_image_received(MagicMock(), body)
+
+        event = json.loads(self.consumer.publish.call_args[0][1])
+        self.assertEqual(event["status"], "error")
+        self.assertIn("Decode failure", event["error_details"])
+
+    @patch("document_analyzation_service.async_main.store_result")
+    @patch("document_analyzation_service.async_main.load_cached_event", return_value=None)
+    @patch("document_analyzation_service.async_main.process_image_async", new_callable=AsyncMock)
+    @patch("document_analyzation_service.async_main.prepare_document")
+    @patch("document_analyzation_service.main.load_image_data", return_value=b"image")
+    async def test_result_cache_is_used_off_the_event_loop_and_the_executor(
+        self, mock_load, mock_prepare, mock_process, mock_load_cached, mock_store
+    ):
+        mock_prepare.return_value = ("data_url", "CMR", 1.0)
+        mock_process.return_value = {"processed": "data"}
+        threads = []
+        mock_load_cached.side_effect = lambda *args: threads.append(threading.current_thread())
+        mock_store.side_effect = lambda *args: threads.append(threading.current_thread())
+        body = json.dumps({"data": {"uuid": "1234", "image_base64": "abc"}}).encode("utf-8")
+
+        await self.service.on_image_received(MagicMock(), body)
+
+        self.assertEqual(len(threads), 2)
+        for thread in threads:
+            self.assertIsNot(thread, threading.current_thread())
+            self.assertTrue(thread.name.startswith("asyncio"))
+        mock_store.assert_called_once_with(
+            mock_load_cached.call_args.args[0], {"processed": "data"}
+        )
+
+    async def test_on_image_received_invalid_json(self):
+        with self.assertRaises(json.JSONDecodeError):
+            await self.service.on_image_received(MagicMock(), b"invalid_json")
+        self.consumer.publish.assert_not_called()
+
+    @patch("document_analyzation_service.async_main.process_image_async")
+    @patch("document_analyzation_service.async_main.prepare_document")
+    @patch("document_analyzation_service.main.load_image_data", return_value=b"image")
+    async def test_concurrency_is_bounded_by_semaphore(
+        self, mock_load, mock_prepare, mock_process
+    ):
+        mock_prepare.return_value = ("data_url", "CMR", 1.0)
+        in_flight = 0
+        max_in_flight = 0
+
+        async def slow_process(*args):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return {"processed": "data"}
+
+        mock_process.side_effect = slow_process
+        body = json.dumps({"data": {"uuid": "1234"}}).encode("utf-8")
+
+        await asyncio.gather(
+            *(self.service.on_image_received(MagicMock(), body) for _ in range(5))
+        )
+
+        self.assertEqual(max_in_flight, 2)
+        self.assertEqual(self.consumer.publish.call_count, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+import os
+import threading
+import unittest
+from unittest.mock import patch
+
+from document_analyzation_service import azure_client
+from document_analyzation_service.azure_client import (
+    AzureCredentials,
+    get_async_azure_client,
+    get_azure_client,
+    reset_azure_clients,
+)
+
+AZURE_ENVIRONMENT = {
+    "AZURE_API_ENDPOINT": "https://example.openai.azure.com",
+    "AZURE_API_KEY": "key-1",
+    "API_VERSION": "2024-08-01-preview",
+}
+
+
+@patch.dict(os.environ, AZURE_ENVIRONMENT)
+class TestAzureClient(unittest.TestCase):
+    def setUp(self):
+        reset_azure_clients()
+        self.addCleanup(reset_azure_clients)
+
+    def test_client_is_shared_by_all_threads(self):
+        clients = []
+        threads = [
+            threading.Thread(target=lambda: clients.append(get_azure_client())) for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(all(client is clients[0] for client in clients))
+
+    def test_client_uses_the_configured_pool_and_timeouts(self):
+        client = get_azure_client()
+
+        self.assertEqual(client.timeout.read, azure_client.AZURE_READ_TIMEOUT)
+        self.assertEqual(client.timeout.connect, azure_client.AZURE_CONNECT_TIMEOUT)
+        self.assertEqual(client.api_key, "key-1")
+
+    def test_client_is_rebuilt_on_credential_rotation(self):
+        client = get_azure_client()
+
+        with patch.dict(os.environ, {"AZURE_API_KEY": "key-2"}):
+            rotated = get_azure_client()
+
+        self.assertIsNot(rotated, client)
+        self.assertEqual(rotated.api_key, "key-2")
+
+    def test_every_endpoint_gets_its_own_client(self):
+        west = AzureCredentials("https://west.openai.azure.com", "west-key", "v1")
+
+        client = get_azure_client(west)
+
+        self.assertIs(get_azure_client(west), client)
+        self.assertIsNot(get_azure_client(), client)
+        self.assertEqual(client.api_key, "west-key")
+        self.assertEqual(str(client.base_url), "https://west.openai.azure.com/openai/")
+
+    def test_forked_process_gets_its_own_client(self):
+        client = get_azure_client()
+
+        with patch("document_analyzation_service.azure_client.os.getpid", return_value=-1):
+            self.assertIsNot(get_azure_client(), client)
+
+
+@patch.dict(os.environ, AZURE_ENVIRONMENT)
+class TestAsyncAzureClient(unittest.TestCase):
+    def setUp(self):
+        reset_azure_clients()
+        self.addCleanup(reset_azure_clients)
+
+    def test_client_is_shared_on_an_event_loop(self):
+        async def get_two_clients():
+            return get_async_azure_client(), get_async_azure_client()
+
+        first, second = asyncio.run(get_two_clients())
+
+        self.assertIs(first, second)
+
+    def test_client_is_rebuilt_for_another_event_loop(self):
+        async def get_client():
+            return get_async_azure_client()
+
+        self.assertIsNot(asyncio.run(get_client()), asyncio.run(get_client()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from document_analyzation_service.circuit_breaker import (
+    CircuitBreaker,
+    CircuitOpenError,
+    CircuitState,
+)
+from document_analyzation_service.metrics import labelled, metrics
+
+
+def fail():
+    raise ConnectionError("unreachable")
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        patcher = patch("document_analyzation_service.circuit_breaker.time.monotonic")
+        self.mock_time = patcher.start()
+        self.mock_time.return_value = 100.0
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker("azure", failure_threshold=2, recovery_seconds=30)
+
+    def open_circuit(self):
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                self.breaker.call(fail)
+
+    def test_opens_after_consecutive_failures(self):
+        with self.assertRaises(ConnectionError):
+            self.breaker.call(fail)
+        self.assertEqual(self.breaker.call(lambda: "ok"), "ok")
+        self.assertEqual(self.breaker.state, CircuitState.CLOSED)
+
+        self.open_circuit()
+
+        self.assertEqual(self.breaker.state, CircuitState.OPEN)
+        self.assertEqual(
+            metrics.value(
+                labelled("circuit_breaker_transitions_total", breaker="azure", state="open")
+            ),
+            1,
+        )
+        self.assertEqual(metrics.value(labelled("circuit_breaker_state", breaker="azure")), 2)
+
+    def test_open_circuit_rejects_without_calling(self):
+        self.open_circuit()
+        function = MagicMock()
+        self.mock_time.return_value = 110.0
+
+        with self.assertRaises(CircuitOpenError) as context:
+            self.breaker.call(function)
+
+        function.assert_not_called()
+        self.assertAlmostEqual(context.exception.retry_after, 20)
+        self.assertEqual(
+            metrics.value(labelled("circuit_breaker_rejected_total", breaker="azure")), 1
+        )
+
+    def test_successful_probe_closes_the_circuit(self):
+        self.open_circuit()
+        self.mock_time.return_value = 130.0
+
+        self.assertEqual(self.breaker.state, CircuitState.HALF_OPEN)
+        self.assertEqual(self.breaker.call(lambda: "ok"), "ok")
+
+        self.assertEqual(self.breaker.state, CircuitState.CLOSED)
+        self.assertEqual(metrics.value(labelled("circuit_breaker_state", breaker="azure")), 0)
+
+    def test_failed_probe_opens_the_circuit_again(self):
+        self.open_circuit()
+        self.mock_time.return_value = 130.0
+
+        with self.assertRaises(ConnectionError):
+            self.breaker.call(fail)
+
+        self.assertEqual(self.breaker.state, CircuitState.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(lambda: "ok")
+
+    def test_half_open_circuit_limits_the_probes(self):
+        self.open_circuit()
+        self.mock_time.return_value = 130.0
+
+        self.breaker.before_call()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_interrupted_probe_frees_its_slot(self):
+        self.open_circuit()
+        self.mock_time.return_value = 130.0
+
+        with self.assertRaises(KeyboardInterrupt):
+            self.breaker.call(MagicMock(side_effect=KeyboardInterrupt))
+
+        self.assertEqual(self.breaker.state, CircuitState.HALF_OPEN)
+        self.assertEqual(self.breaker.call(lambda: "ok"), "ok")
+        self.assertEqual(self.breaker.state, CircuitState.CLOSED)
+
+    def test_other_errors_do_not_open_the_circuit(self):
+        breaker = CircuitBreaker(
+            "azure",
+            failure_threshold=1,
+            recovery_seconds=30,
+            is_failure=lambda exception: isinstance(exception, ConnectionError),
+        )
+
+        with self.assertRaises(ValueError):
+            breaker.call(MagicMock(side_effect=ValueError("invalid request")))
+
+        self.assertEqual(breaker.state, CircuitState.CLOSED)
+
+    def test_disabled_breaker_never_opens(self):
+        breaker = CircuitBreaker("azure", failure_threshold=0, recovery_seconds=30)
+
+        for _ in range(5):
+            with self.assertRaises(ConnectionError):
+                breaker.call(fail)
+
+        self.assertEqual(breaker.state, CircuitState.CLOSED)
+
+
+class TestCircuitBreakerAsync(unittest.IsolatedAsyncioTestCase):
+    async def test_call_async(self):
+        breaker = CircuitBreaker("azure", failure_threshold=1, recovery_seconds=30)
+
+        self.assertEqual(await breaker.call_async(AsyncMock(return_value="ok")), "ok")
+        with self.assertRaises(ConnectionError):
+            await breaker.call_async(AsyncMock(side_effect=ConnectionError()))
+        with self.assertRaises(CircuitOpenError):
+            await breaker.call_async(AsyncMock(return_value="ok"))
+
+    @patch("document_analyzation_service.circuit_breaker.time.monotonic", return_value=100.0)
+    async def test_cancelled_probe_frees_its_slot(self, mock_time):
+        breaker = CircuitBreaker("azure", failure_threshold=1, recovery_seconds=30)
+        with self.assertRaises(ConnectionError):
+            await breaker.call_async(AsyncMock(side_effect=ConnectionError()))
+        mock_time.return_value = 130.0
+
+        probe = asyncio.create_task(breaker.call_async(lambda: asyncio.sleep(10)))
+        await asyncio.sleep(0)
+        probe.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await probe
+
+        self.assertEqual(await breaker.call_async(AsyncMock(return_value="ok")), "ok")
+        self.assertEqual(breaker.state, CircuitState.CLOSED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,308 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+from PIL import Image
+
+from document_analyzation_service.document_classification import classification
+from document_analyzation_service.document_context import DocumentContext
+
+
+def image_bytes(size=(64, 64)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class TestOcrModelLoading(unittest.TestCase):
+    def setUp(self):
+        classification._ocr_model = None
+        self.model_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.model_dir.cleanup)
+        checksums = []
+        for file_name in (
+            classification.OCR_DETECTION_WEIGHTS,
+            classification.OCR_RECOGNITION_WEIGHTS,
+        ):
+            content = f"weights of {file_name}".encode()
+            with open(os.path.join(self.model_dir.name, file_name), "wb") as file:
+                file.write(content)
+            checksums.append(f"{hashlib.sha256(content).hexdigest()}  {file_name}\n")
+        self.write_checksums("".join(checksums))
+
+    def tearDown(self):
+        classification._ocr_model = None
+
+    def write_checksums(self, content):
+        checksum_path = os.path.join(self.model_dir.name, classification.OCR_CHECKSUM_FILE)
+        with open(checksum_path, "w", encoding="utf-8") as checksum_file:
+            checksum_file.write(content)
+
+    @patch("doctr.models.ocr_predictor")
+    def test_model_is_loaded_once_by_concurrent_callers(self, mock_ocr_predictor):
+        models = []
+
+        def load():
+            models.append(classification.get_ocr_model())
+
+        threads = [threading.Thread(target=load) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        mock_ocr_predictor.assert_called_once_with(pretrained=True)
+        self.assertTrue(all(model is mock_ocr_predictor.return_value for model in models))
+
+    @patch("doctr.models.ocr_predictor")
+    def test_weights_are_loaded_from_the_model_directory(self, mock_ocr_predictor):
+        predictor = classification.load_ocr_model(self.model_dir.name)
+
+        mock_ocr_predictor.assert_called_once_with(pretrained=False, pretrained_backbone=False)
+        predictor.det_predictor.model.from_pretrained.assert_called_once_with(
+            os.path.join(self.model_dir.name, classification.OCR_DETECTION_WEIGHTS)
+        )
+        predictor.reco_predictor.model.from_pretrained.assert_called_once_with(
+            os.path.join(self.model_dir.name, classification.OCR_RECOGNITION_WEIGHTS)
+        )
+
+    @patch("doctr.models.ocr_predictor")
+    def test_architectures_are_configurable(self, mock_ocr_predictor):
+        classification.load_ocr_model(
+            "", "torch", "db_mobilenet_v3_large", "crnn_mobilenet_v3_small"
+        )
+
+        mock_ocr_predictor.assert_called_once_with(
+            pretrained=True,
+            det_arch="db_mobilenet_v3_large",
+            reco_arch="crnn_mobilenet_v3_small",
+        )
+
+    def test_onnx_backend_runs_onnxtr(self):
+        onnxtr_models = MagicMock()
+        modules = {"onnxtr": MagicMock(models=onnxtr_models), "onnxtr.models": onnxtr_models}
+
+        with patch.dict(sys.modules, modules), patch.object(classification, "OCR_ONNX_INT8", True):
+            predictor = classification.load_ocr_model("", "onnx", "", "crnn_mobilenet_v3_small")
+
+        self.assertIs(predictor, onnxtr_models.ocr_predictor.return_value)
+        onnxtr_models.ocr_predictor.assert_called_once_with(
+            load_in_8_bit=True, reco_arch="crnn_mobilenet_v3_small"
+        )
+
+    def test_onnx_backend_loads_the_local_models(self):
+        onnxtr_models = MagicMock()
+        modules = {"onnxtr": MagicMock(models=onnxtr_models), "onnxtr.models": onnxtr_models}
+        checksums = []
+        for file_name in (
+            classification.OCR_ONNX_DETECTION_MODEL,
+            classification.OCR_ONNX_RECOGNITION_MODEL,
+        ):
+            with open(os.path.join(self.model_dir.name, file_name), "wb") as file:
+                file.write(b"model")
+            checksums.append(f"{hashlib.sha256(b'model').hexdigest()}  {file_name}\n")
+        self.write_checksums("".join(checksums))
+
+        with patch.dict(sys.modules, modules):
+            classification.load_ocr_model(self.model_dir.name, "onnx", "db_mobilenet_v3_large", "")
+
+        onnxtr_models.db_mobilenet_v3_large.assert_called_once_with(
+            os.path.join(self.model_dir.name, classification.OCR_ONNX_DETECTION_MODEL)
+        )
+        onnxtr_models.crnn_vgg16_bn.assert_called_once_with(
+            os.path.join(self.model_dir.name, classification.OCR_ONNX_RECOGNITION_MODEL)
+        )
+        onnxtr_models.ocr_predictor.assert_called_once_with(
+            det_arch=onnxtr_models.db_mobilenet_v3_large.return_value,
+            reco_arch=onnxtr_models.crnn_vgg16_bn.return_value,
+        )
+
+    def test_onnx_backend_requires_onnxtr(self):
+        with patch.dict(sys.modules, {"onnxtr": None, "onnxtr.models": None}):
+            with self.assertRaises(ImportError):
+                classification.load_ocr_model("", "onnx")
+
+    def test_unknown_backend_raises(self):
+        with self.assertRaises(ValueError):
+            classification.load_ocr_model("", "tensorrt")
+
+    @patch("doctr.models.ocr_predictor")
+    def test_checksum_mismatch_raises(self, mock_ocr_predictor):
+        with open(
+            os.path.join(self.model_dir.name, classification.OCR_RECOGNITION_WEIGHTS), "ab"
+        ) as file:
+            file.write(b"tampered")
+
+        with self.assertRaisesRegex(RuntimeError, "does not match"):
+            classification.load_ocr_model(self.model_dir.name)
+        mock_ocr_predictor.assert_not_called()
+
+    def test_unlisted_weights_raise(self):
+        self.write_checksums("")
+
+        with self.assertRaisesRegex(RuntimeError, "No checksum"):
+            classification.verify_model_checksums(
+                self.model_dir.name, [classification.OCR_DETECTION_WEIGHTS]
+            )
+
+    def test_warmup_runs_one_inference(self):
+        model = MagicMock()
+        classification._ocr_model = model
+
+        classification.warmup_ocr_model()
+
+        model.assert_called_once()
+        (pages,) = model.call_args[0]
+        self.assertEqual(pages[0].shape, (256, 256, 3))
+
+
+class TestRecognizePage(unittest.TestCase):
+    @patch.object(classification, "OCR_PROCESS_WORKERS", 2)
+    @patch.object(classification, "_ocr_batcher")
+    @patch.object(classification, "_ocr_process_pool")
+    def test_ocr_runs_in_process_if_the_workers_cannot_start(self, mock_pool, mock_batcher):
+        def fail_to_start(page):
+            mock_pool.failed = True
+            raise BrokenProcessPool
+
+        mock_pool.failed = False
+        mock_pool.recognize.side_effect = fail_to_start
+        mock_batcher.recognize.return_value = "text"
+        page = np.zeros((8, 8, 3), dtype=np.uint8)
+
+        self.assertEqual(classification.recognize_page(page), "text")
+        self.assertEqual(classification.recognize_page(page), "text")
+
+        mock_pool.recognize.assert_called_once()
+        self.assertEqual(mock_batcher.recognize.call_count, 2)
+
+    @patch.object(classification, "OCR_PROCESS_WORKERS", 2)
+    @patch.object(classification, "_ocr_process_pool")
+    def test_crashed_workers_are_not_bypassed(self, mock_pool):
+        mock_pool.failed = False
+        mock_pool.recognize.side_effect = BrokenProcessPool
+
+        with self.assertRaises(BrokenProcessPool):
+            classification.recognize_page(np.zeros((8, 8, 3), dtype=np.uint8))
+
+
+class TestClassifyDocument(unittest.TestCase):
+    @patch.object(classification, "create_doctr_ocr")
+    @patch.object(classification, "get_layout_index")
+    def test_known_layout_skips_the_ocr(self, mock_get_layout_index, mock_create_doctr_ocr):
+        mock_get_layout_index.return_value.nearest.return_value = ("delivery_note", 0.02)
+        document = DocumentContext(image_bytes())
+
+        self.assertEqual(classification.classify_document(document), "delivery_note")
+        mock_create_doctr_ocr.assert_not_called()
+
+    @patch.object(classification, "create_doctr_ocr", return_value="Palettenschein Absender")
+    @patch.object(classification, "get_layout_index")
+    def test_distant_layout_falls_back_to_the_ocr(
+        self, mock_get_layout_index, mock_create_doctr_ocr
+    ):
+        mock_get_layout_index.return_value.nearest.return_value = ("delivery_note", 0.4)
+        document = DocumentContext(image_bytes())
+
+        self.assertEqual(classification.classify_document(document), "pallet_note")
+        mock_create_doctr_ocr.assert_called_once_with(document)
+
+    @patch.object(classification, "create_doctr_ocr", return_value="Palettenschein Absender")
+    def test_without_index_the_ocr_is_used(self, mock_create_doctr_ocr):
+        document = DocumentContext(image_bytes())
+
+        self.assertEqual(classification.classify_document(document), "pallet_note")
+
+
+@patch.object(classification, "STAGED_CLASSIFICATION", True)
+@patch.object(classification, "get_layout_index", return_value=None)
+class TestStagedClassification(unittest.TestCase):
+    @patch.object(classification, "create_doctr_ocr")
+    @patch.object(classification._ocr_batcher, "recognize", return_value="Lieferschein Nr. 4711")
+    def test_decisive_header_skips_the_full_page(
+        self, mock_recognize, mock_create_doctr_ocr, mock_get_layout_index
+    ):
+        document = DocumentContext(image_bytes((800, 1200)))
+
+        self.assertEqual(classification.classify_document(document), "delivery_note")
+        (band,) = mock_recognize.call_args[0]
+        self.assertEqual(band.shape, (256, 683, 3))
+        mock_create_doctr_ocr.assert_not_called()
+
+    @patch.object(classification, "create_doctr_ocr", return_value="Palettenschein Absender")
+    @patch.object(classification._ocr_batcher, "recognize", return_value="Muster GmbH")
+    def test_ambiguous_header_escalates_to_the_full_page(
+        self, mock_recognize, mock_create_doctr_ocr, mock_get_layout_index
+    ):
+        document = DocumentContext(image_bytes())
+
+        self.assertEqual(classification.classify_document(document), "pallet_note")
+        mock_create_doctr_ocr.assert_called_once_with(document)
+
+
+class TestConfidentDocType(unittest.TestCase):
+    def test_title_alone_decides_a_unique_type(self):
+        self.assertEqual(classification.confident_doc_type("PALETTENSCHEIN"), "pallet_note")
+
+    def test_shared_title_without_identifiers_is_ambiguous(self):
+        self.assertIsNone(classification.confident_doc_type("CMR"))
+
+    def test_best_type_with_margin_is_decided(self):
+        text = "CMR Absender Empfänger Bezeichnung des Gutes Bruttogewicht in kg"
+
+        self.assertEqual(classification.confident_doc_type(text), "soc_cmr")
+
+    def test_text_without_main_identifier_is_ambiguous(self):
+        self.assertIsNone(classification.confident_doc_type("Absender Empfänger Spedition"))
+
+    @patch.object(classification, "CLASSIFICATION_SCORING", "fuzzy")
+    def test_fuzzy_identifiers_are_matched_once(self):
+        text = "CMR Absender Empfanger Bezeichnung des Gutes Bruttogewicht in kg"
+
+        with patch.object(
+            classification._fuzzy_scorer,
+            "identifier_matches",
+            wraps=classification._fuzzy_scorer.identifier_matches,
+        ) as mock_matches:
+            self.assertEqual(classification.confident_doc_type(text), "soc_cmr")
+
+        mock_matches.assert_called_once_with(text)
+
+
+class TestCalculateBestDocTypeFit(unittest.TestCase):
+    def test_main_identifier_decides_between_similar_types(self):
+        text = "Palettenschein\nAbsender: Muster GmbH\nEmpfänger: Beispiel AG\nEuroflachpaletten 4"
+
+        self.assertEqual(classification.calculate_best_doc_type_fit(text), "pallet_note")
+
+    def test_text_without_identifiers_has_no_type(self):
+        self.assertEqual(classification.calculate_best_doc_type_fit("Lorem ipsum"), "")
+
+    @patch.object(classification, "CLASSIFICATION_SCORING", "fuzzy")
+    def test_fuzzy_scoring_tolerates_ocr_errors(self):
+        text = (
+            "Palettenschein\nAbsen der: Muster GmbH\nEmpfanger: Beispiel AG\nEuroflachpaletten 4"
+        )
+
+        self.assertEqual(classification.calculate_best_doc_type_fit(text), "pallet_note")
+
+    def test_score_counts_found_identifiers(self):
+        score = classification.calculate_doc_type_score({"absender"}, ["Absender", "Empfänger"])
+
+        self.assertEqual(score, 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
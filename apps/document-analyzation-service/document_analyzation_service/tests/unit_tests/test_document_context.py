@@ -0,0 +1,75 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+import hashlib
+import io
+import unittest
+from unittest.mock import patch
+
+from PIL import Image
+
+from document_analyzation_service.document_context import DocumentContext
+
+
+def encode_image(mode, image_format):
+    buffer = io.BytesIO()
+    Image.new(mode, (8, 4), color=0).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+class TestDocumentContext(unittest.TestCase):
+    def test_content_hash(self):
+        image_data = encode_image("RGB", "PNG")
+
+        self.assertEqual(
+            DocumentContext(image_data).content_hash, hashlib.sha256(image_data).hexdigest()
+        )
+
+    def test_image_is_decoded_once(self):
+        document = DocumentContext(encode_image("RGB", "PNG"))
+
+        with patch(
+            "document_analyzation_service.document_context.Image.open", wraps=Image.open
+        ) as mock_open:
+            thumbnail = document.decode_reduced((4, 2))
+            header = document.decode_reduced((8, 2))
+            rgb_array = document.rgb_array
+
+        mock_open.assert_called_once()
+        self.assertIs(thumbnail, document.image)
+        self.assertIs(header, document.image)
+        self.assertEqual(rgb_array.shape, (4, 8, 3))
+
+    def test_size_is_read_without_decoding(self):
+        document = DocumentContext(encode_image("RGB", "PNG"))
+
+        self.assertEqual(document.size, (8, 4))
+        self.assertNotIn("image", document.__dict__)
+
+    def test_jpeg_is_decoded_at_reduced_size(self):
+        buffer = io.BytesIO()
+        Image.new("RGB", (800, 400)).save(buffer, format="JPEG")
+        document = DocumentContext(buffer.getvalue())
+
+        image = document.decode_reduced((100, 50))
+
+        self.assertEqual(image.size, (100, 50))
+        self.assertEqual(image.format, "JPEG")
+
+    def test_decoded_image_is_reused(self):
+        document = DocumentContext(encode_image("RGB", "JPEG"))
+        image = document.image
+
+        self.assertIs(document.decode_reduced((2, 1)), image)
+
+    def test_rgb_array_of_grayscale_image(self):
+        document = DocumentContext(encode_image("L", "PNG"))
+
+        self.assertEqual(document.rgb_array.shape, (4, 8, 3))
+        self.assertEqual(document.image.mode, "L")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,189 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+import json
+import os
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from document_analyzation_service.azure_client import AzureCredentials
+from document_analyzation_service.circuit_breaker import CircuitOpenError
+from document_analyzation_service.endpoint_pool import (
+    AzureEndpoint,
+    EndpointPool,
+    parse_azure_endpoints,
+)
+from document_analyzation_service.metrics import labelled, metrics
+from document_analyzation_service.rate_limiter import RateLimitQuota
+
+
+def endpoint(name, weight=1.0):
+    return AzureEndpoint(
+        name, AzureCredentials(f"https://{name}.openai.azure.com", "key", "v1"), "gpt-4o", weight
+    )
+
+
+class TestParseAzureEndpoints(unittest.TestCase):
+    @patch.dict(
+        os.environ,
+        {
+            "AZURE_API_KEY": "default-key",
+            "WEST_KEY": "west-key",
+            "API_VERSION": "v1",
+            "GPT_MODEL": "gpt-4o",
+        },
+    )
+    def test_missing_values_fall_back_to_the_environment(self):
+        endpoints = parse_azure_endpoints(
+            json.dumps(
+                [
+                    {
+                        "endpoint": "https://west.openai.azure.com",
+                        "api_key_env": "WEST_KEY",
+                        "weight": 2,
+                    },
+                    {
+                        "name": "east",
+                        "endpoint": "https://east.openai.azure.com",
+                        "model": "gpt-4o-east",
+                        "rpm_limit": 30,
+                        "tpm_limit": 50000,
+                    },
+                ]
+            )
+        )
+
+        self.assertEqual(
+            endpoints,
+            [
+                AzureEndpoint(
+                    "west.openai.azure.com/gpt-4o",
+                    AzureCredentials("https://west.openai.azure.com", "west-key", "v1"),
+                    "gpt-4o",
+                    2.0,
+                ),
+                AzureEndpoint(
+                    "east",
+                    AzureCredentials("https://east.openai.azure.com", "default-key", "v1"),
+                    "gpt-4o-east",
+                    1.0,
+                    RateLimitQuota(30, 50000),
+                ),
+            ],
+        )
+
+    def test_empty_value(self):
+        self.assertEqual(parse_azure_endpoints(""), [])
+
+    def test_invalid_deployments_are_rejected(self):
+        with self.assertRaises(ValueError):
+            parse_azure_endpoints('[{"endpoint": "https://a", "weight": 0}]')
+        with self.assertRaises(ValueError):
+            parse_azure_endpoints(
+                '[{"name": "a", "endpoint": "https://a"}, {"name": "a", "endpoint": "https://b"}]'
+            )
+
+
+class TestEndpointPool(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def test_least_outstanding_deployment_is_selected(self):
+        pool = EndpointPool([endpoint("west"), endpoint("east")], 3, 30)
+
+        first = pool.acquire()
+        second = pool.acquire()
+
+        self.assertNotEqual(first.name, second.name)
+        pool.release(first)
+        self.assertEqual(pool.acquire().name, first.name)
+        self.assertEqual(pool.outstanding(first.name), 1)
+
+    def test_requests_follow_the_weights(self):
+        pool = EndpointPool([endpoint("west", weight=3), endpoint("east")], 3, 30)
+
+        names = [pool.call(lambda selected: selected.name) for _ in range(8)]
+
+        self.assertEqual(names.count("west"), 6)
+        self.assertEqual(names.count("east"), 2)
+        self.assertEqual(metrics.value(labelled("endpoint_requests_total", endpoint="west")), 6)
+
+    def test_concurrent_requests_follow_the_weights(self):
+        pool = EndpointPool([endpoint("west", weight=2), endpoint("east")], 3, 30)
+
+        names = [pool.acquire().name for _ in range(6)]
+
+        self.assertEqual(names.count("west"), 4)
+        self.assertEqual(names.count("east"), 2)
+
+    def test_failed_request_fails_over(self):
+        pool = EndpointPool([endpoint("west"), endpoint("east")], 3, 30)
+        function = MagicMock(side_effect=[ConnectionError("down"), "result"])
+
+        self.assertEqual(pool.call(function), "result")
+
+        first, second = (call.args[0].name for call in function.call_args_list)
+        self.assertNotEqual(first, second)
+        self.assertEqual(metrics.value(labelled("endpoint_failovers_total", endpoint=first)), 1)
+        self.assertEqual(pool.outstanding(first), 0)
+
+    def test_other_errors_do_not_fail_over(self):
+        pool = EndpointPool(
+            [endpoint("west"), endpoint("east")],
+            3,
+            30,
+            should_fail_over=lambda exception: isinstance(exception, ConnectionError),
+        )
+        function = MagicMock(side_effect=ValueError("invalid request"))
+
+        with self.assertRaises(ValueError):
+            pool.call(function)
+
+        function.assert_called_once()
+
+    def test_last_error_is_raised_once_all_deployments_failed(self):
+        pool = EndpointPool([endpoint("west"), endpoint("east")], 3, 30)
+
+        with self.assertRaises(ConnectionError):
+            pool.call(MagicMock(side_effect=ConnectionError("down")))
+
+    def test_unhealthy_deployment_is_skipped(self):
+        pool = EndpointPool([endpoint("west"), endpoint("east")], 1, 30)
+        pool.release(pool.acquire({"east"}), ConnectionError("down"))
+
+        self.assertEqual({pool.call(lambda selected: selected.name) for _ in range(3)}, {"east"})
+
+    def test_no_healthy_deployment(self):
+        pool = EndpointPool([endpoint("west")], 1, 30)
+        pool.release(pool.acquire(), ConnectionError("down"))
+
+        with self.assertRaises(CircuitOpenError):
+            pool.call(MagicMock())
+
+
+class TestEndpointPoolAsync(unittest.IsolatedAsyncioTestCase):
+    async def test_failed_request_fails_over(self):
+        pool = EndpointPool([endpoint("west"), endpoint("east")], 3, 30)
+        function = AsyncMock(side_effect=[ConnectionError("down"), "result"])
+
+        self.assertEqual(await pool.call_async(function), "result")
+        self.assertEqual(function.await_count, 2)
+
+    async def test_cancelled_request_is_released(self):
+        pool = EndpointPool([endpoint("west")], 3, 30)
+
+        request = asyncio.create_task(pool.call_async(lambda endpoint: asyncio.sleep(10)))
+        await asyncio.sleep(0)
+        self.assertEqual(pool.outstanding("west"), 1)
+        request.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await request
+
+        self.assertEqual(pool.outstanding("west"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
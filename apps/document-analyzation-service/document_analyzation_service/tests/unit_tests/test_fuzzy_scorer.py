@@ -0,0 +1,90 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+import unittest
+
+from document_analyzation_service.document_classification.document_class_identifier.document_type_identifier_dto import (
+    DocumentTypeIdentifierDto,
+)
+from document_analyzation_service.document_classification.fuzzy_scorer import (
+    FuzzyKeywordScorer,
+    character_ngrams,
+    normalize_text,
+    tokenize,
+)
+
+IDENTIFIERS = [
+    DocumentTypeIdentifierDto(
+        "pallet_note", "Palettenschein", ["absender", "empfänger", "euroflachpaletten"]
+    ),
+    DocumentTypeIdentifierDto(
+        "delivery_note", "Lieferschein", ["lieferadresse", "empfänger", "belegdatum", "kunde"]
+    ),
+]
+
+
+class TestNormalization(unittest.TestCase):
+    def test_diacritics_case_and_spaces_are_removed(self):
+        self.assertEqual(normalize_text("Empfänger"), "empfanger")
+        self.assertEqual(normalize_text("Absen der:"), "absender")
+
+    def test_text_is_split_into_folded_words(self):
+        self.assertEqual(
+            tokenize("Empfänger: Müller-Lüdenscheidt"), ["empfanger", "muller", "ludenscheidt"]
+        )
+
+    def test_short_texts_are_a_single_ngram(self):
+        self.assertEqual(character_ngrams("kg", 3), {"kg"})
+        self.assertEqual(character_ngrams("", 3), set())
+        self.assertEqual(character_ngrams("abcd", 3), {"abc", "bcd"})
+
+
+class TestFuzzyKeywordScorer(unittest.TestCase):
+    def setUp(self):
+        self.scorer = FuzzyKeywordScorer(IDENTIFIERS, n=3, threshold=0.8)
+
+    def test_clean_text_scores_like_exact_matching(self):
+        scores = self.scorer.score("Palettenschein\nAbsender: A\nEmpfänger: B\nEuroflachpaletten")
+
+        self.assertAlmostEqual(scores["pallet_note"], 1.0, places=5)
+        self.assertAlmostEqual(scores["delivery_note"], 0.025, places=5)
+
+    def test_ocr_errors_are_tolerated(self):
+        scores = self.scorer.score(
+            "Paletten schein\nAbsen der: A\nEmpfanger: B\nEuroflachpalctten"
+        )
+
+        self.assertGreater(scores["pallet_note"], 0.9)
+        self.assertGreater(scores["pallet_note"], scores["delivery_note"])
+
+    def test_unrelated_text_scores_zero(self):
+        scores = self.scorer.score("Lorem ipsum dolor sit amet")
+
+        self.assertEqual(scores, {"pallet_note": 0.0, "delivery_note": 0.0})
+
+    def test_adjacent_words_do_not_form_an_identifier(self):
+        # "kun" and "deutschland" joined contain all n-grams of "kunde"
+        matches = self.scorer.identifier_matches("Kun Deutschland")
+
+        self.assertFalse(matches.any())
+
+    def test_short_identifiers_match_exactly(self):
+        scorer = FuzzyKeywordScorer(
+            [DocumentTypeIdentifierDto("weight_note", "Wiegeschein", ["kg"])], n=3
+        )
+
+        self.assertEqual(scorer.identifier_matches("Gewicht 500 kg")[1], 1)
+        self.assertEqual(scorer.identifier_matches("Gewicht 500 kgs")[1], 0)
+
+    def test_partial_matches_below_the_threshold_are_ignored(self):
+        matches = FuzzyKeywordScorer(IDENTIFIERS, threshold=1.0).identifier_matches(
+            "Euroflachpalctten"
+        )
+
+        self.assertFalse(matches.any())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+import io
+import unittest
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from document_analyzation_service.image_encoder import (
+    EncodedImage,
+    encode_adaptive,
+    encode_for_extraction,
+    encode_image,
+    record_encoding,
+    structural_similarity,
+)
+from document_analyzation_service.metrics import metrics
+
+
+def document_image():
+    image = Image.new("RGB", (320, 200), color="white")
+    draw = ImageDraw.Draw(image)
+    for line in range(10):
+        draw.text(
+            (10, 10 + 18 * line), f"Consignee {line}: Musterstrasse {line * 7}", fill="black"
+        )
+    return image
+
+
+def luminance(encoded):
+    with Image.open(io.BytesIO(encoded.data)) as image:
+        return np.asarray(image.convert("L"))
+
+
+class TestStructuralSimilarity(unittest.TestCase):
+    def test_identical_images(self):
+        reference = np.asarray(document_image().convert("L"))
+
+        self.assertAlmostEqual(structural_similarity(reference, reference), 1.0)
+
+    def test_distorted_image(self):
+        reference = np.asarray(document_image().convert("L"))
+        noise = np.random.default_rng(0).integers(-60, 60, reference.shape)
+        distorted = np.clip(reference.astype(int) + noise, 0, 255)
+
+        self.assertLess(structural_similarity(reference, distorted), 0.5)
+
+    def test_different_shapes(self):
+        with self.assertRaises(ValueError):
+            structural_similarity(np.zeros((4, 4)), np.zeros((4, 5)))
+
+    def test_image_smaller_than_window(self):
+        self.assertAlmostEqual(structural_similarity(np.ones((3, 3)), np.ones((3, 3))), 1.0)
+
+
+class TestEncodeImage(unittest.TestCase):
+    def test_grayscale_jpeg(self):
+        encoded = encode_image(document_image(), "JPEG", 80, grayscale=True)
+
+        self.assertEqual(encoded.mime_type, "image/jpeg")
+        with Image.open(io.BytesIO(encoded.data)) as image:
+            self.assertEqual(image.mode, "L")
+
+    def test_webp_of_palette_image(self):
+        encoded = encode_image(document_image().convert("P"), "WEBP", 80)
+
+        self.assertEqual(encoded.mime_type, "image/webp")
+
+    def test_adaptive_encoding_stays_above_threshold(self):
+        image = document_image()
+        reference = np.asarray(image.convert("L"))
+
+        encoded = encode_adaptive(image, ssim_threshold=0.9, image_formats=("JPEG", "WEBP"))
+
+        self.assertGreaterEqual(structural_similarity(reference, luminance(encoded)), 0.9)
+        self.assertLessEqual(len(encoded.data), len(encode_image(image, "JPEG", 95).data))
+
+    def test_adaptive_encoding_falls_back_to_max_quality(self):
+        image = document_image()
+
+        encoded = encode_adaptive(
+            image, ssim_threshold=1.01, image_formats=("JPEG",), min_quality=50, max_quality=60
+        )
+
+        self.assertEqual(encoded, encode_image(image, "JPEG", 60))
+
+
+class TestEncodeForExtraction(unittest.TestCase):
+    def test_original_is_kept(self):
+        original = EncodedImage(b"original", "image/jpeg")
+
+        self.assertIs(encode_for_extraction(document_image(), original, "original"), original)
+
+    def test_smaller_original_is_kept(self):
+        original = EncodedImage(b"tiny", "image/png")
+
+        self.assertIs(encode_for_extraction(document_image(), original, "jpeg"), original)
+
+    def test_reencoding_replaces_larger_original(self):
+        image = Image.radial_gradient("L").resize((400, 200)).convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        original = EncodedImage(buffer.getvalue(), "image/png")
+
+        encoded = encode_for_extraction(image, original, "webp")
+
+        self.assertEqual(encoded.mime_type, "image/webp")
+        self.assertLess(len(encoded.data), len(original.data))
+
+    def test_decoded_image_keeps_png(self):
+        image = document_image()
+        image.format = "PNG"
+
+        self.assertEqual(encode_for_extraction(image).mime_type, "image/png")
+
+    def test_grayscale_reencodes_the_original_in_its_format(self):
+        image = document_image()
+        image.format = "PNG"
+        original = EncodedImage(b"tiny", "image/png")
+
+        encoded = encode_for_extraction(image, original, "original", grayscale=True)
+
+        self.assertEqual(encoded.mime_type, "image/png")
+        with Image.open(io.BytesIO(encoded.data)) as decoded:
+            self.assertEqual(decoded.mode, "L")
+
+
+class TestRecordEncoding(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.reset()
+
+    def test_bytes_are_counted_per_document_type(self):
+        record_encoding("CMR", 1000, 400)
+        record_encoding("CMR", 500, 100)
+
+        self.assertEqual(metrics.value('image_bytes_before_total{document_type="CMR"}'), 1500)
+        self.assertEqual(metrics.value('image_bytes_after_total{document_type="CMR"}'), 500)
+        self.assertEqual(metrics.value('images_encoded_total{document_type="CMR"}'), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
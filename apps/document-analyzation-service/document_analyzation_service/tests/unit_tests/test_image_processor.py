@@ -4,18 +4,58 @@
 # For details on the licensing terms, see the LICENSE file.
 # SPDX-License-Identifier: Apache-2.0
 
+import asyncio
+import base64
 import io
+import os
+import threading
 import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
+import httpx
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    InternalServerError,
+    RateLimitError,
+)
 from PIL import Image
+from PIL.JpegImagePlugin import JpegImageFile
 
+from document_analyzation_service.circuit_breaker import CircuitOpenError
+from document_analyzation_service.document_context import DocumentContext
 from document_analyzation_service.image_processor import (
+    ExtractionUnavailableError,
+    ImageSizeLimit,
+    TransientProcessingError,
+    build_result_event,
+    compute_scale_factor,
     convert_image_to_data_url,
+    estimate_image_tokens,
+    estimate_request_tokens,
+    parse_image_size_limits,
+    prepare_image_for_extraction,
+    extract_document_data,
+    extract_document_data_async,
+    is_outage,
     process_image,
+    process_image_async,
     process_image_with_azure,
+    process_image_with_azure_async,
+    request_document_data,
     retrieve_document_data,
+    retrieve_document_data_async,
+)
+from document_analyzation_service.azure_client import AzureCredentials
+from document_analyzation_service.endpoint_pool import AzureEndpoint, EndpointPool
+from document_analyzation_service.rate_limiter import (
+    LocalRateLimitBackend,
+    RateLimiter,
+    RateLimitQuota,
+    RateLimitTimeout,
 )
+from document_analyzation_service.utils import bytes_to_data_url
 
 
 class TestImageProcessor(unittest.TestCase):
@@ -41,11 +81,52 @@ class TestImageProcessor(unittest.TestCase):
         self.assertEqual(mock_process.call_count, 2)
         self.assertEqual(mock_sleep.call_count, 2)
 
-    @patch("document_analyzation_service.image_processor.AzureOpenAI")
+    @patch("document_analyzation_service.image_processor.time.sleep", return_value=None)
+    @patch(
+        "document_analyzation_service.image_processor.process_image_with_azure",
+        side_effect=CircuitOpenError("extraction", 30),
+    )
+    def test_process_image_is_not_retried_while_the_circuit_is_open(
+        self, mock_process, mock_sleep
+    ):
+        with self.assertRaises(ExtractionUnavailableError) as context:
+            process_image("dummy_url", "uuid123", "pattern", "CMR")
+
+        self.assertEqual(context.exception.retry_after, 30)
+        mock_process.assert_called_once()
+        mock_sleep.assert_not_called()
+
+    @patch(
+        "document_analyzation_service.image_processor.process_image_with_azure",
+        side_effect=CircuitOpenError("extraction", 30),
+    )
+    def test_extract_document_data_while_the_circuit_is_open(self, mock_process):
+        with self.assertRaises(ExtractionUnavailableError):
+            extract_document_data("dummy_url", "CMR")
+
+    def test_is_outage(self):
+        request = httpx.Request("POST", "https://azure")
+
+        self.assertTrue(is_outage(APIConnectionError(request=request)))
+        self.assertTrue(
+            is_outage(
+                InternalServerError(
+                    "unavailable", response=httpx.Response(503, request=request), body=None
+                )
+            )
+        )
+        self.assertFalse(
+            is_outage(
+                RateLimitError("quota", response=httpx.Response(429, request=request), body=None)
+            )
+        )
+        self.assertFalse(is_outage(ValueError("invalid response")))
+
+    @patch("document_analyzation_service.image_processor.get_azure_client")
     @patch("document_analyzation_service.image_processor.retrieve_document_data")
-    def test_process_image_with_azure(self, mock_retrieve, mock_client_class):
+    def test_process_image_with_azure(self, mock_retrieve, mock_get_client):
         mock_client = MagicMock()
-        mock_client_class.return_value = mock_client
+        mock_get_client.return_value = mock_client
         mock_completion = MagicMock()
         mock_completion.choices = [MagicMock(message=MagicMock(parsed={"field": "value"}))]
         mock_retrieve.return_value = mock_completion
@@ -53,9 +134,52 @@ class TestImageProcessor(unittest.TestCase):
         result = process_image_with_azure("some_data_url", "CMR")
 
         self.assertEqual(result, {"field": "value"})
-        mock_client_class.assert_called_once()
+        mock_get_client.assert_called_once()
         mock_retrieve.assert_called_once_with("some_data_url", mock_client, "CMR")
 
+    @patch("document_analyzation_service.image_processor.retrieve_document_data")
+    @patch("document_analyzation_service.image_processor.get_azure_client")
+    def test_request_is_balanced_over_the_endpoint_pool(self, mock_get_client, mock_retrieve):
+        west, east = (
+            AzureEndpoint(name, AzureCredentials(f"https://{name}", "key", "v1"), f"gpt-{name}", 1)
+            for name in ("west", "east")
+        )
+        mock_retrieve.return_value.choices = [
+            MagicMock(message=MagicMock(parsed={"field": "value"}))
+        ]
+
+        with patch(
+            "document_analyzation_service.image_processor._endpoint_pool",
+            EndpointPool([west, east], 3, 30),
+        ):
+            self.assertEqual(request_document_data("data_url", "CMR"), {"field": "value"})
+            self.assertEqual(request_document_data("data_url", "CMR"), {"field": "value"})
+
+        self.assertEqual(
+            [call.args[0] for call in mock_get_client.call_args_list],
+            [west.credentials, east.credentials],
+        )
+        self.assertEqual(
+            [call.args[3] for call in mock_retrieve.call_args_list], ["gpt-west", "gpt-east"]
+        )
+        self.assertEqual(
+            [call.args[4] for call in mock_retrieve.call_args_list], [west.quota, east.quota]
+        )
+
+    @patch.dict(os.environ, {"GPT_MODEL": "gpt-4o"})
+    def test_deployments_are_limited_by_their_own_quota(self):
+        mock_client = MagicMock(base_url="https://azure/openai/")
+        mock_client.beta.chat.completions.with_raw_response.parse.return_value.headers = {}
+        data_url = bytes_to_data_url(encode_image((100, 200), "PNG"), "image/png")
+
+        with patch(
+            "document_analyzation_service.rate_limiter._rate_limiter",
+            RateLimiter(LocalRateLimitBackend(), 0, 0, 0),
+        ):
+            retrieve_document_data(data_url, mock_client, "CMR", quota=RateLimitQuota(1, 0))
+            with self.assertRaises(RateLimitTimeout):
+                retrieve_document_data(data_url, mock_client, "CMR", quota=RateLimitQuota(1, 0))
+
     def test_retrieve_document_data(self):
         mock_client = MagicMock()
         mock_completion = MagicMock()
@@ -66,6 +190,51 @@ class TestImageProcessor(unittest.TestCase):
         self.assertEqual(result, mock_completion)
         mock_client.beta.chat.completions.parse.assert_called_once()
 
+    @patch.dict(os.environ, {"GPT_MODEL": "gpt-4o"})
+    @patch("document_analyzation_service.image_processor.get_rate_limiter")
+    def test_retrieve_document_data_is_rate_limited(self, mock_get_rate_limiter):
+        limiter = MagicMock(wraps=RateLimiter(LocalRateLimitBackend(), 60, 100000, 30))
+        mock_get_rate_limiter.return_value = limiter
+        mock_client = MagicMock(base_url="https://azure/openai/")
+        response = mock_client.beta.chat.completions.with_raw_response.parse.return_value
+        response.headers = {"x-ratelimit-remaining-tokens": "5000"}
+        response.parse.return_value.usage.total_tokens = 1200
+        data_url = bytes_to_data_url(encode_image((1000, 2000), "PNG"), "image/png")
+
+        result = retrieve_document_data(data_url, mock_client, "CMR")
+
+        self.assertEqual(result, response.parse.return_value)
+        tokens = estimate_request_tokens(data_url, "CMR")
+        limiter.acquire.assert_called_once_with("https://azure/openai/|gpt-4o", tokens, None)
+        limiter.observe.assert_called_once_with(
+            "https://azure/openai/|gpt-4o", response.headers, tokens, 1200, None
+        )
+        mock_client.beta.chat.completions.parse.assert_not_called()
+
+    @patch.dict(os.environ, {"GPT_MODEL": "gpt-4o"})
+    @patch("document_analyzation_service.image_processor.get_rate_limiter")
+    def test_reserved_tokens_are_released_after_a_timeout(self, mock_get_rate_limiter):
+        limiter = MagicMock(wraps=RateLimiter(LocalRateLimitBackend(), 60, 100000, 30))
+        mock_get_rate_limiter.return_value = limiter
+        mock_client = MagicMock(base_url="https://azure/openai/")
+        mock_client.beta.chat.completions.with_raw_response.parse.side_effect = APITimeoutError(
+            httpx.Request("POST", "https://azure/openai/")
+        )
+        data_url = bytes_to_data_url(encode_image((100, 200), "PNG"), "image/png")
+
+        with self.assertRaises(APITimeoutError):
+            retrieve_document_data(data_url, mock_client, "CMR")
+
+        limiter.release.assert_called_once_with(
+            "https://azure/openai/|gpt-4o", estimate_request_tokens(data_url, "CMR"), None
+        )
+        limiter.observe.assert_not_called()
+
+    def test_estimate_image_tokens(self):
+        # 2048 x 4096 is fitted into 1024 x 2048 and scaled to 768 x 1536, 2 x 3 tiles
+        self.assertEqual(estimate_image_tokens(2048, 4096), 85 + 170 * 6)
+        self.assertEqual(estimate_image_tokens(512, 512), 85 + 170)
+
     @patch("document_analyzation_service.image_processor.process_image_with_azure")
     def test_process_image_valid_data_url(self, mock_process_image_with_azure):
         data_url = "data:image/png;base64,testdata"
@@ -106,6 +275,298 @@ class TestImageProcessor(unittest.TestCase):
         self.assertEqual(mock_process.call_count, 2)
         mock_sleep.assert_called_once()
 
+    @patch("document_analyzation_service.image_processor.process_image_with_azure")
+    def test_extract_document_data_single_attempt(self, mock_process):
+        mock_process.side_effect = Exception("Temporary error")
+
+        with self.assertRaises(TransientProcessingError):
+            extract_document_data("dummy_url", "CMR")
+        mock_process.assert_called_once()
+
+    @patch(
+        "document_analyzation_service.image_processor.process_image_with_azure",
+        side_effect=Exception("401 Unauthorized"),
+    )
+    def test_extract_document_data_unauthorized_is_not_retried(self, mock_process):
+        result = extract_document_data("dummy_url", "CMR")
+
+        self.assertEqual(result["status"], "error")
+        self.assertIn("Azure Environment file not adjusted", result["message"])
+
+    @patch("document_analyzation_service.image_processor.process_image_with_azure")
+    def test_rejected_requests_are_not_retried(self, mock_process):
+        for status_code in (400, 404, 422):
+            mock_process.side_effect = APIStatusError(
+                "Rejected",
+                response=httpx.Response(
+                    status_code, request=httpx.Request("POST", "https://azure/openai/")
+                ),
+                body=None,
+            )
+
+            result = extract_document_data("dummy_url", "CMR")
+
+            self.assertEqual(result["status"], "error")
+
+    @patch("document_analyzation_service.image_processor.process_image_with_azure")
+    def test_throttled_and_failed_requests_are_retried(self, mock_process):
+        request = httpx.Request("POST", "https://azure/openai/")
+        for error in (
+            RateLimitError("Throttled", response=httpx.Response(429, request=request), body=None),
+            InternalServerError(
+                "Failed", response=httpx.Response(500, request=request), body=None
+            ),
+            APITimeoutError(request),
+        ):
+            mock_process.side_effect = error
+
+            with self.assertRaises(TransientProcessingError):
+                extract_document_data("dummy_url", "CMR")
+
+
+def encode_image(size, image_format):
+    byte_io = io.BytesIO()
+    Image.new("RGB", size, color="white").save(byte_io, format=image_format)
+    return byte_io.getvalue()
+
+
+def decode_data_url(data_url):
+    return Image.open(io.BytesIO(base64.b64decode(data_url.split(",", 1)[1])))
+
+
+class TestImageDownscaling(unittest.TestCase):
+    def test_compute_scale_factor(self):
+        self.assertEqual(compute_scale_factor((1000, 500), ImageSizeLimit(2048, 0)), 1.0)
+        self.assertEqual(compute_scale_factor((4096, 3072), ImageSizeLimit(2048, 0)), 0.5)
+        self.assertEqual(compute_scale_factor((4000, 4000), ImageSizeLimit(0, 4_000_000)), 0.5)
+        self.assertEqual(compute_scale_factor((4000, 4000), ImageSizeLimit(0, 0)), 1.0)
+
+    def test_pixel_budget_applies_after_long_side(self):
+        scale_factor = compute_scale_factor((4000, 4000), ImageSizeLimit(2000, 1_000_000))
+
+        self.assertAlmostEqual(scale_factor, 0.25)
+
+    def test_parse_image_size_limits(self):
+        limits = parse_image_size_limits('{"CMR": {"max_long_side": 2560}}')
+
+        self.assertEqual(limits["CMR"].max_long_side, 2560)
+        self.assertEqual(parse_image_size_limits(""), {})
+
+    @patch(
+        "document_analyzation_service.image_processor.IMAGE_SIZE_LIMITS",
+        {"CMR": ImageSizeLimit(1000, 0)},
+    )
+    def test_large_jpeg_is_decoded_reduced_and_downscaled(self):
+        document = DocumentContext(encode_image((4000, 2000), "JPEG"))
+
+        with patch.object(
+            JpegImageFile, "draft", autospec=True, side_effect=JpegImageFile.draft
+        ) as mock_draft:
+            data_url, scale_factor = prepare_image_for_extraction(document, "CMR")
+
+        mock_draft.assert_called_once()
+        self.assertEqual(scale_factor, 0.25)
+        self.assertEqual(decode_data_url(data_url).size, (1000, 500))
+        self.assertTrue(data_url.startswith("data:image/jpeg;base64,"))
+        self.assertNotIn("image", document.__dict__)
+
+    @patch(
+        "document_analyzation_service.image_processor.IMAGE_SIZE_LIMITS",
+        {"Pallet Note": ImageSizeLimit(100, 0)},
+    )
+    def test_downscaled_png_stays_png(self):
+        document = DocumentContext(encode_image((400, 200), "PNG"))
+
+        data_url, scale_factor = prepare_image_for_extraction(document, "Pallet Note")
+
+        self.assertEqual(scale_factor, 0.25)
+        self.assertTrue(data_url.startswith("data:image/png;base64,"))
+        self.assertEqual(decode_data_url(data_url).size, (100, 50))
+
+    def test_fitting_image_is_passed_on_unchanged(self):
+        image_data = encode_image((400, 200), "JPEG")
+
+        data_url, scale_factor = prepare_image_for_extraction(DocumentContext(image_data), "CMR")
+
+        self.assertEqual(scale_factor, 1.0)
+        self.assertEqual(base64.b64decode(data_url.split(",", 1)[1]), image_data)
+
+    @patch("document_analyzation_service.image_processor.IMAGE_ENCODING", "webp")
+    def test_configured_encoding_is_applied_without_downscaling(self):
+        byte_io = io.BytesIO()
+        Image.radial_gradient("L").resize((400, 200)).save(byte_io, format="PNG")
+
+        data_url, scale_factor = prepare_image_for_extraction(
+            DocumentContext(byte_io.getvalue()), "CMR"
+        )
+
+        self.assertEqual(scale_factor, 1.0)
+        self.assertTrue(data_url.startswith("data:image/webp;base64,"))
+
+    @patch("document_analyzation_service.image_processor.IMAGE_ENCODING_GRAYSCALE", True)
+    def test_fitting_image_is_reencoded_in_grayscale(self):
+        data_url, scale_factor = prepare_image_for_extraction(
+            DocumentContext(encode_image((400, 200), "JPEG")), "CMR"
+        )
+
+        self.assertEqual(scale_factor, 1.0)
+        self.assertTrue(data_url.startswith("data:image/jpeg;base64,"))
+        self.assertEqual(decode_data_url(data_url).mode, "L")
+
+    def test_unaccepted_format_is_converted(self):
+        data_url, scale_factor = prepare_image_for_extraction(
+            DocumentContext(encode_image((40, 20), "BMP")), "CMR"
+        )
+
+        self.assertTrue(data_url.startswith("data:image/jpeg;base64,"))
+
+    def test_result_event_records_scale_factor(self):
+        event = build_result_event({"field": "value"}, "uuid", "pattern", "CMR", 0.5)
+
+        self.assertEqual(event["data"]["scale_factor"], 0.5)
+        self.assertEqual(
+            build_result_event({}, "uuid", "pattern", "CMR")["data"]["scale_factor"], 1.0
+        )
+
+
+class TestImageProcessorAsync(unittest.IsolatedAsyncioTestCase):
+    @patch("document_analyzation_service.image_processor.asyncio.sleep", new_callable=AsyncMock)
+    @patch(
+        "document_analyzation_service.image_processor.process_image_with_azure_async",
+        new_callable=AsyncMock,
+    )
+    async def test_process_image_async_with_retry(self, mock_process, mock_sleep):
+        mock_process.side_effect = [Exception("Temporary error"), {"some": "result"}]
+
+        result = await process_image_async("dummy_url", "uuid123", "pattern", "CMR")
+
+        self.assertEqual(result["data"]["image_analysis_result"], {"some": "result"})
+        self.assertEqual(result["data"]["uuid"], "uuid123")
+        self.assertEqual(mock_process.await_count, 2)
+        mock_sleep.assert_awaited_once()
+
+    @patch(
+        "document_analyzation_service.image_processor.process_image_with_azure_async",
+        new_callable=AsyncMock,
+        side_effect=Exception("401 Unauthorized"),
+    )
+    async def test_process_image_async_unauthorized(self, mock_process):
+        result = await process_image_async("dummy_url", "uuid123", "pattern", "CMR")
+
+        self.assertEqual(result["data"]["image_analysis_result"]["status"], "error")
+        mock_process.assert_awaited_once()
+
+    @patch(
+        "document_analyzation_service.image_processor.process_image_with_azure_async",
+        new_callable=AsyncMock,
+    )
+    async def test_rejected_requests_are_not_retried_async(self, mock_process):
+        mock_process.side_effect = APIStatusError(
+            "Content filter",
+            response=httpx.Response(400, request=httpx.Request("POST", "https://azure/openai/")),
+            body=None,
+        )
+
+        result = await extract_document_data_async("dummy_url", "CMR")
+
+        self.assertEqual(result["status"], "error")
+        mock_process.assert_awaited_once()
+
+    @patch("document_analyzation_service.image_processor.get_async_azure_client")
+    async def test_process_image_with_azure_async(self, mock_get_client):
+        mock_client = mock_get_client.return_value
+        mock_completion = MagicMock()
+        mock_completion.choices = [MagicMock(message=MagicMock(parsed={"field": "value"}))]
+        mock_client.beta.chat.completions.parse = AsyncMock(return_value=mock_completion)
+
+        result = await process_image_with_azure_async("some_data_url", "CMR")
+
+        self.assertEqual(result, {"field": "value"})
+        mock_client.beta.chat.completions.parse.assert_awaited_once()
+
+    @patch.dict(os.environ, {"GPT_MODEL": "gpt-4o"})
+    @patch("document_analyzation_service.image_processor.get_rate_limiter")
+    async def test_retrieve_document_data_async_is_rate_limited(self, mock_get_rate_limiter):
+        limiter = MagicMock(wraps=RateLimiter(LocalRateLimitBackend(), 60, 100000, 30))
+        mock_get_rate_limiter.return_value = limiter
+        mock_client = MagicMock(base_url="https://azure/openai/")
+        response = MagicMock(headers={"x-ratelimit-remaining-requests": "10"})
+        response.parse.return_value.usage.total_tokens = 1200
+        mock_client.beta.chat.completions.with_raw_response.parse = AsyncMock(
+            return_value=response
+        )
+        data_url = bytes_to_data_url(encode_image((100, 200), "PNG"), "image/png")
+
+        result = await retrieve_document_data_async(data_url, mock_client, "CMR")
+
+        self.assertEqual(result, response.parse.return_value)
+        limiter.observe_async.assert_called_once_with(
+            "https://azure/openai/|gpt-4o",
+            response.headers,
+            estimate_request_tokens(data_url, "CMR"),
+            1200,
+            None,
+        )
+        limiter.observe.assert_not_called()
+
+    @patch("document_analyzation_service.image_processor.request_document_data_async")
+    @patch("document_analyzation_service.image_processor.estimate_request_tokens")
+    @patch("document_analyzation_service.image_processor.extraction_key")
+    async def test_image_is_not_hashed_or_decoded_on_the_event_loop(
+        self, mock_extraction_key, mock_estimate, mock_request
+    ):
+        threads = []
+
+        def record_thread(*args):
+            threads.append(threading.current_thread())
+            return 100
+
+        mock_extraction_key.side_effect = lambda *args: str(record_thread())
+        mock_estimate.side_effect = record_thread
+        mock_client = MagicMock(base_url="https://azure/openai/")
+        response = MagicMock(headers={})
+        response.parse.return_value.usage = None
+        mock_client.beta.chat.completions.with_raw_response.parse = AsyncMock(
+            return_value=response
+        )
+
+        async def request(data_url, document_type):
+            with patch(
+                "document_analyzation_service.image_processor.get_rate_limiter",
+                return_value=RateLimiter(LocalRateLimitBackend(), 60, 100000, 30),
+            ):
+                return await retrieve_document_data_async(data_url, mock_client, document_type)
+
+        mock_request.side_effect = request
+        await process_image_with_azure_async("data_url", "CMR")
+
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    @patch("document_analyzation_service.image_processor.request_document_data_async")
+    async def test_identical_extractions_are_coalesced(self, mock_request):
+        async def slow_request(data_url, document_type):
+            await asyncio.sleep(0.01)
+            return {"field": "value"}
+
+        mock_request.side_effect = slow_request
+
+        results = await asyncio.gather(
+            process_image_async("some_data_url", "uuid1", "pattern", "CMR"),
+            process_image_async("some_data_url", "uuid2", "pattern", "CMR"),
+            process_image_async("other_data_url", "uuid3", "pattern", "CMR"),
+        )
+
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertEqual(
+            [result["data"]["uuid"] for result in results], ["uuid1", "uuid2", "uuid3"]
+        )
+        self.assertTrue(
+            all(
+                result["data"]["image_analysis_result"] == {"field": "value"} for result in results
+            )
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
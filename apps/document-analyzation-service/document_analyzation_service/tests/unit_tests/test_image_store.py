@@ -0,0 +1,75 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from document_analyzation_service.image_store import (
+    LocalImageStore,
+    S3ImageStore,
+    fetch_image,
+)
+
+
+class TestLocalImageStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        (self.root / "bucket").mkdir()
+        (self.root / "bucket" / "image.jpeg").write_bytes(b"image_data")
+        self.store = LocalImageStore(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_fetch_with_bucket(self):
+        self.assertEqual(self.store.fetch("image.jpeg", "bucket"), b"image_data")
+
+    def test_fetch_without_bucket(self):
+        self.assertEqual(self.store.fetch("bucket/image.jpeg"), b"image_data")
+
+    def test_fetch_missing_image(self):
+        with self.assertRaises(FileNotFoundError):
+            self.store.fetch("missing.jpeg", "bucket")
+
+    def test_fetch_outside_of_root_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.store.fetch("../../etc/passwd", "bucket")
+
+
+@patch("document_analyzation_service.image_store._create_s3_client")
+class TestS3ImageStore(unittest.TestCase):
+    def test_fetch_streams_object(self, mock_create_client):
+        body = MagicMock()
+        body.iter_chunks.return_value = [b"image", b"_data"]
+        mock_create_client.return_value.get_object.return_value = {"Body": body}
+        store = S3ImageStore("http://s3:9000", "access", "secret", "default-bucket", pool_size=4)
+
+        self.assertEqual(store.fetch("image.jpeg"), b"image_data")
+        mock_create_client.assert_called_once_with("http://s3:9000", "access", "secret", 4)
+        mock_create_client.return_value.get_object.assert_called_once_with(
+            Bucket="default-bucket", Key="image.jpeg"
+        )
+
+    def test_fetch_requires_bucket(self, mock_create_client):
+        store = S3ImageStore("http://s3:9000", "access", "secret", None)
+
+        with self.assertRaises(ValueError):
+            store.fetch("image.jpeg")
+
+
+class TestFetchImage(unittest.TestCase):
+    @patch("document_analyzation_service.image_store.get_image_store")
+    def test_fetch_image_uses_shared_store(self, mock_get_image_store):
+        mock_get_image_store.return_value.fetch.return_value = b"image_data"
+
+        self.assertEqual(fetch_image("image.jpeg", "bucket"), b"image_data")
+        mock_get_image_store.return_value.fetch.assert_called_once_with("image.jpeg", "bucket")
+
+
+if __name__ == "__main__":
+    unittest.main()
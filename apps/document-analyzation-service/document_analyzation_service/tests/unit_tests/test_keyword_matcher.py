@@ -0,0 +1,56 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+import random
+import unittest
+
+from document_analyzation_service.document_classification.keyword_matcher import KeywordMatcher
+
+
+class TestKeywordMatcher(unittest.TestCase):
+    def test_keywords_are_found_ignoring_the_case(self):
+        matcher = KeywordMatcher(["Absender", "Empfänger", "CMR"])
+
+        found = matcher.find("ABSENDER: Muster GmbH\nEmpfänger: Beispiel AG")
+
+        self.assertEqual(found, {"absender", "empfänger"})
+
+    def test_keywords_sharing_a_prefix_are_all_found(self):
+        matcher = KeywordMatcher(["absender", "absender übergibt", "absender erhält"])
+
+        found = matcher.find("Der Absender übergibt die Ware")
+
+        self.assertEqual(found, {"absender", "absender übergibt"})
+
+    def test_keywords_inside_other_keywords_are_found(self):
+        matcher = KeywordMatcher(["gut", "des gutes", "gewicht"])
+
+        self.assertEqual(matcher.find("bezeichnung des gutes"), {"gut", "des gutes"})
+
+    def test_special_characters_are_matched_literally(self):
+        matcher = KeywordMatcher(["umfang in m3", "nr.", "(kg)"])
+
+        self.assertEqual(matcher.find("Nr. 5, Gewicht (kg)"), {"nr.", "(kg)"})
+        self.assertEqual(matcher.find("Nrx 5"), set())
+
+    def test_result_equals_substring_tests(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            keywords = {
+                "".join(rng.choice("ab ") for _ in range(rng.randint(1, 4))) for _ in range(6)
+            }
+            text = "".join(rng.choice("abAB ") for _ in range(30))
+
+            self.assertEqual(
+                KeywordMatcher(keywords).find(text),
+                {keyword for keyword in keywords if keyword in text.lower()},
+            )
+
+    def test_without_keywords_nothing_is_found(self):
+        self.assertEqual(KeywordMatcher([]).find("text"), set())
+
+
+if __name__ == "__main__":
+    unittest.main()
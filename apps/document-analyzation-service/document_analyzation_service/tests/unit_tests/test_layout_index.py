@@ -0,0 +1,87 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+import os
+import tempfile
+import unittest
+
+from PIL import Image, ImageDraw
+
+from document_analyzation_service.document_classification.layout_index import (
+    LayoutIndex,
+    layout_fingerprint,
+)
+
+
+def form(boxes, size=(600, 800)):
+    """A white page with black boxes at the given relative positions."""
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    for left, top, right, bottom in boxes:
+        draw.rectangle(
+            (left * size[0], top * size[1], right * size[0], bottom * size[1]), fill="black"
+        )
+    return image
+
+
+GRID_FORM = [(0.05, 0.05, 0.45, 0.2), (0.55, 0.05, 0.95, 0.2), (0.05, 0.3, 0.95, 0.35)]
+BANNER_FORM = [(0.05, 0.6, 0.95, 0.95), (0.4, 0.1, 0.6, 0.3)]
+
+
+class TestLayoutIndex(unittest.TestCase):
+    def setUp(self):
+        self.samples_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.samples_dir.cleanup)
+        for label, boxes in [("soc_cmr", GRID_FORM), ("delivery_note", BANNER_FORM)]:
+            os.makedirs(os.path.join(self.samples_dir.name, label))
+            form(boxes).save(os.path.join(self.samples_dir.name, label, "sample.png"))
+
+    def test_same_template_at_another_resolution_is_near(self):
+        index = LayoutIndex.build(self.samples_dir.name)
+
+        label, distance = index.nearest(layout_fingerprint(form(GRID_FORM, (1200, 1600))))
+
+        self.assertEqual(label, "soc_cmr")
+        self.assertLess(distance, 0.05)
+
+    def test_other_layout_is_far(self):
+        index = LayoutIndex.build(self.samples_dir.name)
+        other_form = form([(0.05, 0.05, 0.2, 0.95)])
+
+        _, distance = index.nearest(layout_fingerprint(other_form))
+
+        self.assertGreater(distance, 0.2)
+
+    def test_index_is_saved_and_loaded(self):
+        index = LayoutIndex.build(self.samples_dir.name)
+        path = os.path.join(self.samples_dir.name, "index.npz")
+
+        index.save(path)
+        loaded = LayoutIndex.load(path)
+
+        self.assertEqual(loaded.labels, ["delivery_note", "soc_cmr"])
+        self.assertTrue((loaded.fingerprints == index.fingerprints).all())
+
+    def test_index_is_loaded_from_a_path_without_npz_suffix(self):
+        index = LayoutIndex.build(self.samples_dir.name)
+        path = os.path.join(self.samples_dir.name, "layouts.idx")
+
+        index.save(path)
+
+        self.assertEqual(LayoutIndex.load(path).labels, index.labels)
+
+    def test_unknown_document_type_is_rejected(self):
+        with self.assertRaises(ValueError):
+            LayoutIndex.build(self.samples_dir.name, known_labels=["soc_cmr"])
+
+    def test_empty_index_has_no_nearest_sample(self):
+        empty_dir = os.path.join(self.samples_dir.name, "empty")
+        os.makedirs(empty_dir)
+
+        self.assertIsNone(LayoutIndex.build(empty_dir).nearest(layout_fingerprint(form([]))))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,27 +4,45 @@
 # For details on the licensing terms, see the LICENSE file.
 # SPDX-License-Identifier: Apache-2.0
 import json
+import os
+import tempfile
 import unittest
 from unittest.mock import MagicMock, patch
 
+import pika
+
+from document_analyzation_service.image_processor import (
+    ExtractionUnavailableError,
+    TransientProcessingError,
+    build_result_event,
+)
 from document_analyzation_service.main import (
     SAVE_ANALYZATION_RESULT_PATTERN,
     SEND_QUEUE_NAME,
+    close_publisher,
+    create_receiver,
+    get_publisher,
     on_image_received,
+    parse_message,
+    retry_message,
     send_event_to_queue,
 )
+from document_analyzation_service.message_broker import DeferredMessageError
+from document_analyzation_service.metrics import metrics
+from document_analyzation_service.result_cache import ResultCache
+from document_analyzation_service.retry_topology import RETRY_ATTEMPT_HEADER, RetryTopology
 
 
 class TestOnImageReceived(unittest.TestCase):
     @patch("document_analyzation_service.main.decode_image_from_message")
-    @patch("document_analyzation_service.main.convert_image_to_data_url")
+    @patch("document_analyzation_service.main.prepare_image_for_extraction")
     @patch("document_analyzation_service.main.process_image")
     @patch("document_analyzation_service.main.send_event_to_queue")
     def test_on_image_received_valid_message(
         self,
         mock_send_event_to_queue,
         mock_process_image,
-        mock_convert_image_to_data_url,
+        mock_prepare_image,
         mock_decode_image_from_message,
     ):
         ch = MagicMock()
@@ -40,27 +58,27 @@ class TestOnImageReceived(unittest.TestCase):
             }
         ).encode("utf-8")
         mock_decode_image_from_message.return_value = "decoded_image_data"
-        mock_convert_image_to_data_url.return_value = "data_url"
+        mock_prepare_image.return_value = ("data_url", 1.0)
         mock_process_image.return_value = {"processed": "data"}
 
         on_image_received(ch, method, properties, body)
 
         mock_decode_image_from_message.assert_called_once_with("some_base64_encoded_string")
-        mock_convert_image_to_data_url.assert_called_once_with("decoded_image_data")
+        self.assertEqual(mock_prepare_image.call_args[0][0].image_data, "decoded_image_data")
         mock_process_image.assert_called_once_with(
-            "data_url", "1234", SAVE_ANALYZATION_RESULT_PATTERN, "Delivery Note"
+            "data_url", "1234", SAVE_ANALYZATION_RESULT_PATTERN, "Delivery Note", 1.0
         )
         mock_send_event_to_queue.assert_called_once_with({"processed": "data"})
 
     @patch("document_analyzation_service.main.logger")
     @patch("document_analyzation_service.main.send_event_to_queue")
     @patch("document_analyzation_service.main.process_image")
-    @patch("document_analyzation_service.main.convert_image_to_data_url")
+    @patch("document_analyzation_service.main.prepare_image_for_extraction")
     @patch("document_analyzation_service.main.decode_image_from_message")
     def test_successful_processing_logs_and_calls(
         self,
         mock_decode,
-        mock_convert,
+        mock_prepare_image,
         mock_process,
         mock_send_event,
         mock_logger,
@@ -70,7 +88,7 @@ class TestOnImageReceived(unittest.TestCase):
         event_result = {"result": "some data"}
 
         mock_decode.return_value = b"decoded_image_bytes"
-        mock_convert.return_value = "data_url_string"
+        mock_prepare_image.return_value = ("data_url_string", 1.0)
         mock_process.return_value = event_result
 
         body = json.dumps(
@@ -80,9 +98,9 @@ class TestOnImageReceived(unittest.TestCase):
         on_image_received(MagicMock(), MagicMock(), MagicMock(), body)
 
         mock_decode.assert_called_once_with(base64_image)
-        mock_convert.assert_called_once_with(b"decoded_image_bytes")
+        self.assertEqual(mock_prepare_image.call_args[0][0].image_data, b"decoded_image_bytes")
         mock_process.assert_called_once_with(
-            "data_url_string", uuid, SAVE_ANALYZATION_RESULT_PATTERN, "CMR"
+            "data_url_string", uuid, SAVE_ANALYZATION_RESULT_PATTERN, "CMR", 1.0
         )
         mock_send_event.assert_called_once_with(event_result)
         mock_logger.info.assert_any_call("Image with UUID: %s processed successfully.", uuid)
@@ -115,6 +133,101 @@ class TestOnImageReceived(unittest.TestCase):
         self.assertIn("error_details", called_event)
         self.assertIn("Decode failure", called_event["error_details"])
 
+    @patch("document_analyzation_service.main.send_event_to_queue")
+    @patch("document_analyzation_service.main.process_image")
+    @patch("document_analyzation_service.main.prepare_image_for_extraction")
+    @patch("document_analyzation_service.main.decode_image_from_message")
+    @patch("document_analyzation_service.main.fetch_image")
+    def test_on_image_received_claim_check_message(
+        self, mock_fetch, mock_decode, mock_prepare_image, mock_process, mock_send_event
+    ):
+        mock_fetch.return_value = b"stored_image_bytes"
+        mock_prepare_image.return_value = ("data_url_string", 1.0)
+        mock_process.return_value = {"result": "processed data"}
+        body = json.dumps(
+            {
+                "data": {
+                    "uuid": "test-uuid",
+                    "image_key": "test-uuid.jpeg",
+                    "bucket": "skala-auavp",
+                    "document_type": "CMR",
+                }
+            }
+        ).encode("utf-8")
+
+        on_image_received(MagicMock(), MagicMock(), MagicMock(), body)
+
+        mock_fetch.assert_called_once_with("test-uuid.jpeg", "skala-auavp")
+        mock_decode.assert_not_called()
+        self.assertEqual(mock_prepare_image.call_args[0][0].image_data, b"stored_image_bytes")
+        mock_process.assert_called_once_with(
+            "data_url_string", "test-uuid", SAVE_ANALYZATION_RESULT_PATTERN, "CMR", 1.0
+        )
+        mock_send_event.assert_called_once_with({"result": "processed data"})
+
+    @patch("document_analyzation_service.main.send_event_to_queue")
+    @patch("document_analyzation_service.main.process_image")
+    @patch("document_analyzation_service.main.prepare_image_for_extraction")
+    @patch("document_analyzation_service.main.get_document_class")
+    @patch("document_analyzation_service.main.decode_image_from_message")
+    def test_on_image_received_auto_classifies_decoded_image(
+        self,
+        mock_decode,
+        mock_get_document_class,
+        mock_prepare_image,
+        mock_process,
+        mock_send_event,
+    ):
+        mock_decode.return_value = b"decoded_bytes"
+        mock_get_document_class.return_value = "delivery_note"
+        mock_prepare_image.return_value = ("data_url_string", 1.0)
+        body = json.dumps(
+            {"data": {"uuid": "1234", "image_base64": "abc", "document_type": "auto"}}
+        ).encode("utf-8")
+
+        on_image_received(MagicMock(), MagicMock(), MagicMock(), body)
+
+        document = mock_prepare_image.call_args[0][0]
+        self.assertEqual(document.image_data, b"decoded_bytes")
+        mock_get_document_class.assert_called_once_with(document)
+        mock_process.assert_called_once_with(
+            "data_url_string", "1234", SAVE_ANALYZATION_RESULT_PATTERN, "Delivery Note", 1.0
+        )
+
+    @patch("document_analyzation_service.main.send_event_to_queue")
+    @patch("document_analyzation_service.main.process_image")
+    @patch("document_analyzation_service.main.prepare_image_for_extraction")
+    @patch("document_analyzation_service.main.decode_image_from_message")
+    def test_on_image_received_binary_message(
+        self, mock_decode, mock_prepare_image, mock_process, mock_send_event
+    ):
+        mock_prepare_image.return_value = ("data_url_string", 1.0)
+        mock_process.return_value = {"result": "processed data"}
+        properties = pika.BasicProperties(
+            content_type="image/jpeg",
+            headers={"uuid": b"test-uuid", "document_type": "Pallet Note", "bundleId": "b1"},
+        )
+
+        on_image_received(MagicMock(), MagicMock(), properties, b"raw_image_bytes")
+
+        mock_decode.assert_not_called()
+        self.assertEqual(mock_prepare_image.call_args[0][0].image_data, b"raw_image_bytes")
+        mock_process.assert_called_once_with(
+            "data_url_string", "test-uuid", SAVE_ANALYZATION_RESULT_PATTERN, "Pallet Note", 1.0
+        )
+        mock_send_event.assert_called_once_with({"result": "processed data"})
+
+    def test_parse_message_formats(self):
+        json_body = json.dumps({"data": {"uuid": "1234", "image_base64": "abc"}}).encode()
+        self.assertEqual(
+            parse_message(pika.BasicProperties(content_type="application/json"), json_body),
+            {"uuid": "1234", "image_base64": "abc"},
+        )
+        self.assertEqual(
+            parse_message(pika.BasicProperties(content_type="application/octet-stream"), b"raw"),
+            {"image_data": b"raw"},
+        )
+
     @patch("document_analyzation_service.main.send_event_to_queue")
     def test_on_image_received_invalid_json(self, mock_send_event_to_queue):
         ch = MagicMock()
@@ -151,11 +264,11 @@ class TestOnImageReceived(unittest.TestCase):
 
     @patch("document_analyzation_service.main.send_event_to_queue")
     @patch("document_analyzation_service.main.process_image")
-    @patch("document_analyzation_service.main.convert_image_to_data_url")
+    @patch("document_analyzation_service.main.prepare_image_for_extraction")
     @patch("document_analyzation_service.main.decode_image_from_message")
     @patch("document_analyzation_service.main.logger")
     def test_on_image_received_success(
-        self, mock_logger, mock_decode, mock_convert, mock_process, mock_send_event
+        self, mock_logger, mock_decode, mock_prepare_image, mock_process, mock_send_event
     ):
         # Arrange
         uuid = "test-uuid"
@@ -163,7 +276,7 @@ class TestOnImageReceived(unittest.TestCase):
         event_result = {"result": "processed data"}
 
         mock_decode.return_value = b"decoded_bytes"
-        mock_convert.return_value = "data_url_string"
+        mock_prepare_image.return_value = ("data_url_string", 1.0)
         mock_process.return_value = event_result
 
         message = {
@@ -176,9 +289,9 @@ class TestOnImageReceived(unittest.TestCase):
 
         # Assert that all functions are called correctly
         mock_decode.assert_called_once_with(base64_img)
-        mock_convert.assert_called_once_with(b"decoded_bytes")
+        self.assertEqual(mock_prepare_image.call_args[0][0].image_data, b"decoded_bytes")
         mock_process.assert_called_once_with(
-            "data_url_string", uuid, SAVE_ANALYZATION_RESULT_PATTERN, "Pallet Note"
+            "data_url_string", uuid, SAVE_ANALYZATION_RESULT_PATTERN, "Pallet Note", 1.0
         )
         mock_send_event.assert_called_once_with(event_result)
 
@@ -207,6 +320,180 @@ class TestOnImageReceived(unittest.TestCase):
         self.assertIn("Invalid message format", call_args["message"])
 
 
+@patch(
+    "document_analyzation_service.main.RETRY_TOPOLOGY",
+    RetryTopology.exponential("work", levels=1, base_delay_ms=1000),
+)
+@patch("document_analyzation_service.main.send_event_to_queue")
+@patch("document_analyzation_service.main.get_publisher")
+@patch("document_analyzation_service.main.load_image_data", new=MagicMock(return_value=b"image"))
+@patch("document_analyzation_service.main.prepare_document", return_value=("data_url", "CMR", 1.0))
+@patch("document_analyzation_service.main.process_image")
+@patch("document_analyzation_service.main.extract_document_data")
+class TestOnImageReceivedWithBrokerRetries(unittest.TestCase):
+    def setUp(self):
+        self.body = json.dumps({"data": {"uuid": "1234", "image_base64": "abc"}}).encode()
+
+    def test_success_is_published_without_in_process_retries(
+        self, mock_extract, mock_process, mock_prepare, mock_get_publisher, mock_send_event
+    ):
+        mock_extract.return_value = {"field": "value"}
+
+        on_image_received(MagicMock(), MagicMock(), pika.BasicProperties(), self.body)
+
+        mock_process.assert_not_called()
+        mock_extract.assert_called_once_with("data_url", "CMR")
+        event = mock_send_event.call_args[0][0]
+        self.assertEqual(event["data"]["image_analysis_result"], {"field": "value"})
+        mock_get_publisher.return_value.publish.assert_not_called()
+
+    def test_transient_failure_is_delayed_on_broker(
+        self, mock_extract, mock_process, mock_prepare, mock_get_publisher, mock_send_event
+    ):
+        mock_extract.side_effect = TransientProcessingError("timeout")
+
+        on_image_received(MagicMock(), MagicMock(), pika.BasicProperties(), self.body)
+
+        body, routing_key, properties = mock_get_publisher.return_value.publish.call_args[0]
+        self.assertEqual(body, self.body)
+        self.assertEqual(routing_key, "work.retry.0")
+        self.assertEqual(properties.headers[RETRY_ATTEMPT_HEADER], 1)
+        mock_send_event.assert_not_called()
+
+    def test_exhausted_message_is_dead_lettered_with_error_event(
+        self, mock_extract, mock_process, mock_prepare, mock_get_publisher, mock_send_event
+    ):
+        mock_extract.side_effect = TransientProcessingError("timeout")
+        properties = pika.BasicProperties(headers={RETRY_ATTEMPT_HEADER: 1})
+
+        on_image_received(MagicMock(), MagicMock(), properties, self.body)
+
+        routing_key = mock_get_publisher.return_value.publish.call_args[0][1]
+        self.assertEqual(routing_key, "work.dead-letter")
+        event = mock_send_event.call_args[0][0]
+        self.assertEqual(event["data"]["uuid"], "1234")
+        self.assertEqual(event["data"]["image_analysis_result"]["status"], "error")
+        self.assertIn("timeout", event["data"]["image_analysis_result"]["error_details"])
+
+    def test_message_is_parked_while_the_circuit_is_open(
+        self, mock_extract, mock_process, mock_prepare, mock_get_publisher, mock_send_event
+    ):
+        mock_extract.side_effect = ExtractionUnavailableError("circuit open")
+        properties = pika.BasicProperties(headers={RETRY_ATTEMPT_HEADER: 1})
+
+        on_image_received(MagicMock(), MagicMock(), properties, self.body)
+
+        _, routing_key, retry_properties = mock_get_publisher.return_value.publish.call_args[0]
+        self.assertEqual(routing_key, "work.retry.0")
+        self.assertEqual(retry_properties.headers[RETRY_ATTEMPT_HEADER], 1)
+        mock_send_event.assert_not_called()
+
+    def test_message_failing_before_the_extraction_is_dead_lettered(
+        self, mock_extract, mock_process, mock_prepare, mock_get_publisher, mock_send_event
+    ):
+        mock_prepare.side_effect = TransientProcessingError("storage unavailable")
+        properties = pika.BasicProperties(headers={RETRY_ATTEMPT_HEADER: 1})
+        body = json.dumps(
+            {"data": {"uuid": "1234", "image_base64": "abc", "document_type": "CMR"}}
+        ).encode()
+
+        on_image_received(MagicMock(), MagicMock(), properties, body)
+
+        routing_key = mock_get_publisher.return_value.publish.call_args[0][1]
+        self.assertEqual(routing_key, "work.dead-letter")
+        event = mock_send_event.call_args[0][0]
+        self.assertEqual(event["data"]["image_analysis_result"]["status"], "error")
+        self.assertIn(
+            "storage unavailable", event["data"]["image_analysis_result"]["error_details"]
+        )
+
+
+class TestRetryMessageWithoutRetryTopology(unittest.TestCase):
+    @patch("document_analyzation_service.main.RETRY_TOPOLOGY", None)
+    def test_message_is_deferred_while_the_circuit_is_open(self):
+        publish = MagicMock()
+
+        with self.assertRaises(DeferredMessageError) as context:
+            retry_message(
+                pika.BasicProperties(),
+                b"body",
+                ExtractionUnavailableError("circuit open", 30),
+                "1234",
+                "CMR",
+                publish,
+            )
+
+        self.assertEqual(context.exception.retry_after, 30)
+        publish.assert_not_called()
+
+
+@patch("document_analyzation_service.main.send_event_to_queue")
+@patch("document_analyzation_service.main.process_image")
+@patch("document_analyzation_service.main.prepare_document", return_value=("data_url", "CMR", 1.0))
+@patch("document_analyzation_service.main.load_image_data", return_value=b"image")
+class TestOnImageReceivedWithResultCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(
+            os.path.join(self.directory.name, "results.sqlite"), ttl_seconds=60, max_entries=10
+        )
+        patcher = patch(
+            "document_analyzation_service.main.get_result_cache", return_value=self.cache
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        metrics.reset()
+
+    def tearDown(self):
+        self.cache.close()
+        self.directory.cleanup()
+        metrics.reset()
+
+    def receive(self, image_uuid):
+        body = json.dumps(
+            {"data": {"uuid": image_uuid, "image_base64": "abc", "document_type": "auto"}}
+        ).encode()
+        on_image_received(MagicMock(), MagicMock(), MagicMock(), body)
+
+    def test_repeated_upload_is_answered_from_cache(
+        self, mock_load, mock_prepare, mock_process, mock_send_event
+    ):
+        mock_process.return_value = build_result_event(
+            {"field": "value"}, "1", SAVE_ANALYZATION_RESULT_PATTERN, "CMR", 1.0
+        )
+
+        self.receive("1")
+        self.receive("2")
+
+        mock_process.assert_called_once()
+        mock_prepare.assert_called_once()
+        cached_event = mock_send_event.call_args[0][0]
+        self.assertEqual(
+            cached_event,
+            build_result_event({"field": "value"}, "2", SAVE_ANALYZATION_RESULT_PATTERN, "CMR"),
+        )
+        self.assertEqual(metrics.value("result_cache_hits_total"), 1)
+        self.assertEqual(metrics.value("result_cache_misses_total"), 1)
+
+    def test_error_results_are_not_cached(
+        self, mock_load, mock_prepare, mock_process, mock_send_event
+    ):
+        mock_process.return_value = build_result_event(
+            {"status": "error", "message": "failed"},
+            "1",
+            SAVE_ANALYZATION_RESULT_PATTERN,
+            "CMR",
+            1.0,
+        )
+
+        self.receive("1")
+        self.receive("2")
+
+        self.assertEqual(mock_process.call_count, 2)
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(metrics.value("result_cache_hits_total"), 0)
+
+
 class TestMainFunction(unittest.TestCase):
     @patch("document_analyzation_service.main.RabbitMQReceiver")
     @patch("document_analyzation_service.main.load_dotenv")
@@ -222,8 +509,52 @@ class TestMainFunction(unittest.TestCase):
         mock_receiver.return_value.start_listening.assert_called_once()
         mock_receiver.return_value.stop.assert_called_once()
 
+    @patch("document_analyzation_service.main.shutdown_ocr_workers")
+    @patch("document_analyzation_service.main.RabbitMQReceiver")
+    @patch("document_analyzation_service.main.load_dotenv")
+    def test_main_stops_the_ocr_workers(self, mock_load_dotenv, mock_receiver, mock_shutdown):
+        mock_receiver.return_value.start_listening.side_effect = KeyboardInterrupt
+
+        from document_analyzation_service.main import main
+
+        main()
+
+        mock_shutdown.assert_called_once()
+
+    @patch("document_analyzation_service.main.OCR_PROCESS_WORKERS", 2)
+    @patch("document_analyzation_service.main.CONSUMER_WORKER_COUNT", 0)
+    @patch("document_analyzation_service.main.RabbitMQReceiver")
+    def test_ocr_workers_without_consumer_workers_are_warned_about(self, mock_receiver):
+        with self.assertLogs("document_analyzation_service.main", level="WARNING"):
+            create_receiver()
+
+    @patch("document_analyzation_service.main.sys.argv", ["main.py", "--unknown"])
+    def test_arguments_of_the_process_are_only_parsed_by_the_entry_point(self):
+        from document_analyzation_service.main import parse_arguments
+
+        self.assertFalse(parse_arguments().warmup)
+        self.assertTrue(parse_arguments(["--warmup"]).warmup)
+
+    @patch("document_analyzation_service.main.warmup_ocr_model")
+    @patch("document_analyzation_service.main.RabbitMQReceiver")
+    @patch("document_analyzation_service.main.load_dotenv")
+    def test_main_warms_up_the_ocr_model(self, mock_load_dotenv, mock_receiver, mock_warmup):
+        mock_receiver.return_value.start_listening.side_effect = KeyboardInterrupt
+
+        from document_analyzation_service.main import main
+
+        main(["--warmup"])
+
+        mock_warmup.assert_called_once()
+
 
 class TestSendEventToQueue(unittest.TestCase):
+    def setUp(self):
+        close_publisher()
+
+    def tearDown(self):
+        close_publisher()
+
     @patch("pika.BlockingConnection")
     @patch("pika.ConnectionParameters")
     @patch("pika.PlainCredentials")
@@ -236,6 +567,30 @@ class TestSendEventToQueue(unittest.TestCase):
         mock_connection_parameters.assert_called_once()
         mock_plain_credentials.assert_called_once()
 
+    @patch("pika.BlockingConnection")
+    @patch("pika.ConnectionParameters")
+    @patch("pika.PlainCredentials")
+    def test_send_event_to_queue_reuses_connection(
+        self, mock_plain_credentials, mock_connection_parameters, mock_blocking_connection
+    ):
+        mock_channel = mock_blocking_connection.return_value.channel.return_value
+
+        send_event_to_queue({"first": "event"})
+        send_event_to_queue({"second": "event"})
+
+        mock_blocking_connection.assert_called_once()
+        mock_channel.queue_declare.assert_called_once_with(queue=SEND_QUEUE_NAME)
+        self.assertEqual(mock_channel.basic_publish.call_count, 2)
+        mock_channel.basic_publish.assert_called_with(
+            exchange="",
+            routing_key=SEND_QUEUE_NAME,
+            body=json.dumps({"second": "event"}),
+            properties=None,
+        )
+
+    def test_get_publisher_returns_shared_instance(self):
+        self.assertIs(get_publisher(), get_publisher())
+
 
 if __name__ == "__main__":
     unittest.main()
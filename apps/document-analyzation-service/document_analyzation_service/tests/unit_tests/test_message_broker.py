@@ -4,13 +4,21 @@
 # For details on the licensing terms, see the LICENSE file.
 # SPDX-License-Identifier: Apache-2.0
 
+import asyncio
 import base64
+import threading
 import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pika
 
-from document_analyzation_service.message_broker import RabbitMQReceiver, decode_image_from_message
+from document_analyzation_service.message_broker import (
+    AsyncRabbitMQConsumer,
+    DeferredMessageError,
+    RabbitMQPublisher,
+    RabbitMQReceiver,
+    decode_image_from_message,
+)
 
 
 class TestRabbitMQReceiver(unittest.TestCase):
@@ -41,16 +49,288 @@ class TestRabbitMQReceiver(unittest.TestCase):
     def test_start_listening(self):
         callback = MagicMock()
         self.receiver.start_listening(callback)
-        self.mock_channel.basic_consume.assert_called_once_with(
-            queue=self.queue_name, on_message_callback=callback, auto_ack=True
-        )
+        self.assertTrue(self.mock_channel.basic_consume.call_args.kwargs["auto_ack"])
         self.mock_channel.start_consuming.assert_called_once()
 
+        on_message = self.mock_channel.basic_consume.call_args.kwargs["on_message_callback"]
+        on_message(self.mock_channel, "method", "properties", b"body")
+        callback.assert_called_once_with(self.mock_channel, "method", "properties", b"body")
+
+    def test_deferred_message_is_republished_after_its_delay(self):
+        self.receiver.start_listening(MagicMock(side_effect=DeferredMessageError("open", 30)))
+        on_message = self.mock_channel.basic_consume.call_args.kwargs["on_message_callback"]
+
+        on_message(self.mock_channel, MagicMock(delivery_tag=5), "properties", b"body")
+
+        delay, republish = self.mock_connection.call_later.call_args.args
+        self.assertEqual(delay, 30)
+        republish()
+        self.mock_channel.basic_publish.assert_called_once_with(
+            exchange="", routing_key=self.queue_name, body=b"body", properties="properties"
+        )
+
     def test_stop(self):
         self.receiver.stop()
         self.mock_connection.close.assert_called_once()
 
 
+class TestRabbitMQReceiverWorkerPool(unittest.TestCase):
+    @patch("document_analyzation_service.message_broker.pika.BlockingConnection")
+    @patch("document_analyzation_service.message_broker.pika.ConnectionParameters")
+    @patch("document_analyzation_service.message_broker.pika.PlainCredentials")
+    def setUp(self, mock_credentials, mock_parameters, mock_connection):
+        self.mock_connection = mock_connection.return_value
+        self.mock_channel = self.mock_connection.channel.return_value
+        # Run callbacks scheduled for the connection thread immediately
+        self.mock_connection.add_callback_threadsafe.side_effect = lambda function: function()
+        self.receiver = RabbitMQReceiver(
+            "test_queue", "localhost", "guest", "guest", worker_count=4
+        )
+
+    def _deliver(self, callback, redelivered=False):
+        self.receiver.start_listening(callback)
+        on_message = self.mock_channel.basic_consume.call_args.kwargs["on_message_callback"]
+        method = MagicMock(delivery_tag=7, redelivered=redelivered)
+        on_message(self.mock_channel, method, MagicMock(), b"body")
+        self.receiver.stop()
+
+    def test_start_listening_uses_manual_acks_and_prefetch(self):
+        self.receiver.start_listening(MagicMock())
+
+        self.mock_channel.basic_qos.assert_called_once_with(prefetch_count=4)
+        self.assertFalse(self.mock_channel.basic_consume.call_args.kwargs["auto_ack"])
+        self.mock_channel.start_consuming.assert_called_once()
+        self.receiver.stop()
+
+    def test_message_is_processed_on_worker_and_acked(self):
+        worker_threads = []
+
+        def callback(ch, method, properties, body):
+            worker_threads.append(threading.current_thread().name)
+
+        self._deliver(callback)
+
+        self.assertTrue(worker_threads[0].startswith("das-worker"))
+        self.mock_connection.add_callback_threadsafe.assert_called_once()
+        self.mock_channel.basic_ack.assert_called_once_with(delivery_tag=7)
+        self.mock_channel.basic_nack.assert_not_called()
+
+    def test_request_stop_stops_consuming_on_connection_thread(self):
+        self.receiver.request_stop()
+
+        self.mock_connection.add_callback_threadsafe.assert_called_once_with(
+            self.mock_channel.stop_consuming
+        )
+        self.mock_channel.stop_consuming.assert_called_once()
+
+    def test_messages_delivered_after_the_stop_request_are_requeued(self):
+        callback = MagicMock()
+        self.receiver.start_listening(callback)
+        on_message = self.mock_channel.basic_consume.call_args.kwargs["on_message_callback"]
+
+        self.receiver.request_stop()
+        on_message(self.mock_channel, MagicMock(delivery_tag=8), MagicMock(), b"body")
+        self.receiver.stop()
+
+        callback.assert_not_called()
+        self.mock_channel.basic_nack.assert_called_once_with(delivery_tag=8, requeue=True)
+        self.mock_channel.basic_ack.assert_not_called()
+
+    def test_failed_message_is_requeued_once(self):
+        self._deliver(MagicMock(side_effect=Exception("publish failed")))
+
+        self.mock_channel.basic_nack.assert_called_once_with(delivery_tag=7, requeue=True)
+        self.mock_channel.basic_ack.assert_not_called()
+
+    def test_deferred_message_is_requeued_after_its_delay(self):
+        self._deliver(MagicMock(side_effect=DeferredMessageError("open", 30)), redelivered=True)
+
+        delay, requeue = self.mock_connection.call_later.call_args.args
+        self.assertEqual(delay, 30)
+        self.mock_channel.basic_nack.assert_not_called()
+        requeue()
+        self.mock_channel.basic_nack.assert_called_once_with(delivery_tag=7, requeue=True)
+
+    def test_failed_redelivered_message_is_rejected(self):
+        self._deliver(MagicMock(side_effect=Exception("publish failed")), redelivered=True)
+
+        self.mock_channel.basic_nack.assert_called_once_with(delivery_tag=7, requeue=False)
+
+    @patch("document_analyzation_service.message_broker.pika.BlockingConnection")
+    @patch("document_analyzation_service.message_broker.pika.ConnectionParameters")
+    @patch("document_analyzation_service.message_broker.pika.PlainCredentials")
+    def test_prefetch_count_can_be_configured(
+        self, mock_credentials, mock_parameters, mock_connection
+    ):
+        receiver = RabbitMQReceiver(
+            "test_queue", "localhost", "guest", "guest", worker_count=2, prefetch_count=10
+        )
+        self.assertEqual(receiver.prefetch_count, 10)
+
+
+@patch("document_analyzation_service.message_broker.pika.ConnectionParameters")
+@patch("document_analyzation_service.message_broker.pika.PlainCredentials")
+@patch("document_analyzation_service.message_broker.pika.BlockingConnection")
+class TestRabbitMQPublisher(unittest.TestCase):
+    def test_publish_connects_lazily_and_declares_queue_once(
+        self, mock_connection, mock_credentials, mock_parameters
+    ):
+        publisher = RabbitMQPublisher("result_queue", "localhost", "guest", "guest")
+        mock_connection.assert_not_called()
+
+        publisher.publish("first")
+        publisher.publish("second")
+
+        mock_connection.assert_called_once()
+        mock_channel = mock_connection.return_value.channel.return_value
+        mock_channel.queue_declare.assert_called_once_with(queue="result_queue")
+        self.assertEqual(mock_channel.basic_publish.call_count, 2)
+
+    def test_publish_reconnects_after_connection_loss(
+        self, mock_connection, mock_credentials, mock_parameters
+    ):
+        broken_connection = MagicMock()
+        broken_connection.channel.return_value.basic_publish.side_effect = (
+            pika.exceptions.StreamLostError("lost")
+        )
+        healthy_connection = MagicMock()
+        mock_connection.side_effect = [broken_connection, healthy_connection]
+
+        publisher = RabbitMQPublisher("result_queue", "localhost", "guest", "guest")
+        publisher.publish("event")
+
+        self.assertEqual(mock_connection.call_count, 2)
+        broken_connection.close.assert_called_once()
+        healthy_connection.channel.return_value.basic_publish.assert_called_once()
+        healthy_connection.channel.return_value.queue_declare.assert_called_once_with(
+            queue="result_queue"
+        )
+
+    def test_publish_raises_after_all_attempts_failed(
+        self, mock_connection, mock_credentials, mock_parameters
+    ):
+        mock_connection.side_effect = pika.exceptions.AMQPConnectionError("down")
+        publisher = RabbitMQPublisher(
+            "result_queue", "localhost", "guest", "guest", publish_attempts=2
+        )
+
+        with self.assertRaises(pika.exceptions.AMQPConnectionError):
+            publisher.publish("event")
+        self.assertEqual(mock_connection.call_count, 2)
+
+    def test_concurrent_publishes_use_separate_connections(
+        self, mock_connection, mock_credentials, mock_parameters
+    ):
+        mock_connection.side_effect = lambda parameters: MagicMock()
+        publisher = RabbitMQPublisher("result_queue", "localhost", "guest", "guest", pool_size=2)
+        barrier = threading.Barrier(2)
+        original_ensure_open = publisher._slots[0].ensure_open.__func__
+
+        def ensure_open_and_wait(slot):
+            channel = original_ensure_open(slot)
+            barrier.wait(timeout=5)
+            return channel
+
+        with patch(
+            "document_analyzation_service.message_broker._PooledChannel.ensure_open",
+            ensure_open_and_wait,
+        ):
+            threads = [threading.Thread(target=publisher.publish, args=("e",)) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(timeout=5)
+
+        self.assertEqual(mock_connection.call_count, 2)
+
+    def test_close_closes_connections_and_rejects_publishing(
+        self, mock_connection, mock_credentials, mock_parameters
+    ):
+        publisher = RabbitMQPublisher("result_queue", "localhost", "guest", "guest")
+        publisher.publish("event")
+
+        publisher.close()
+
+        mock_connection.return_value.close.assert_called_once()
+        with self.assertRaises(RuntimeError):
+            publisher.publish("event")
+
+    def test_invalid_pool_size(self, mock_connection, mock_credentials, mock_parameters):
+        with self.assertRaises(ValueError):
+            RabbitMQPublisher("result_queue", "localhost", "guest", "guest", pool_size=0)
+
+
+class TestAsyncRabbitMQConsumer(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.consumer = AsyncRabbitMQConsumer("test_queue", "localhost", "guest", "guest", 10)
+        self.channel = MagicMock()
+
+    async def test_handled_message_is_acked(self):
+        self.consumer._handler = AsyncMock()
+        method = MagicMock(delivery_tag=3, redelivered=False)
+
+        await self.consumer._handle(self.channel, method, "properties", b"body")
+
+        self.consumer._handler.assert_awaited_once_with("properties", b"body")
+        self.channel.basic_ack.assert_called_once_with(delivery_tag=3)
+
+    async def test_cancelled_message_is_requeued(self):
+        self.consumer._handler = AsyncMock(side_effect=asyncio.CancelledError)
+        method = MagicMock(delivery_tag=3, redelivered=True)
+
+        with self.assertRaises(asyncio.CancelledError):
+            await self.consumer._handle(self.channel, method, "properties", b"body")
+
+        self.channel.basic_nack.assert_called_once_with(delivery_tag=3, requeue=True)
+        self.channel.basic_ack.assert_not_called()
+
+    async def test_deferred_message_is_requeued_after_its_delay(self):
+        self.consumer._handler = AsyncMock(side_effect=DeferredMessageError("open", 0.01))
+        method = MagicMock(delivery_tag=3, redelivered=True)
+
+        await self.consumer._handle(self.channel, method, "properties", b"body")
+        self.channel.basic_nack.assert_not_called()
+        await asyncio.sleep(0.05)
+
+        self.channel.basic_nack.assert_called_once_with(delivery_tag=3, requeue=True)
+        self.channel.basic_ack.assert_not_called()
+
+    async def test_failed_message_is_nacked(self):
+        self.consumer._handler = AsyncMock(side_effect=Exception("failure"))
+        method = MagicMock(delivery_tag=3, redelivered=True)
+
+        await self.consumer._handle(self.channel, method, "properties", b"body")
+
+        self.channel.basic_nack.assert_called_once_with(delivery_tag=3, requeue=False)
+        self.channel.basic_ack.assert_not_called()
+
+    def test_publish_requires_open_channel(self):
+        with self.assertRaises(pika.exceptions.AMQPConnectionError):
+            self.consumer.publish("result_queue", "event")
+
+        self.consumer.channel = self.channel
+        self.consumer.publish("result_queue", "event")
+        self.channel.basic_publish.assert_called_once_with(
+            exchange="", routing_key="result_queue", body="event", properties=None
+        )
+
+    async def test_stop_waits_for_in_flight_messages(self):
+        finished = []
+
+        async def handler(properties, body):
+            await asyncio.sleep(0.01)
+            finished.append(body)
+
+        self.consumer._handler = handler
+        self.consumer.channel = self.channel
+        self.consumer._on_message(self.channel, MagicMock(delivery_tag=1), "properties", b"body")
+
+        await self.consumer.stop()
+
+        self.assertEqual(finished, [b"body"])
+        self.channel.basic_ack.assert_called_once_with(delivery_tag=1)
+
+
 class TestDecodeImageFromMessage(unittest.TestCase):
     def test_decode_image_from_message(self):
         message_body = base64.b64encode(b"test_image_data")
@@ -0,0 +1,82 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+import socket
+import unittest
+import urllib.request
+
+from document_analyzation_service.metrics import (
+    Metrics,
+    labelled,
+    metrics,
+    start_metrics_server,
+)
+
+
+class TestMetrics(unittest.TestCase):
+    def test_increment_and_value(self):
+        counters = Metrics()
+
+        counters.increment("hits_total")
+        counters.increment("hits_total", 2)
+
+        self.assertEqual(counters.value("hits_total"), 3)
+        self.assertEqual(counters.value("missing_total"), 0)
+
+    def test_set_gauge(self):
+        gauges = Metrics()
+
+        gauges.set("state", 2)
+        gauges.set("state", 0)
+
+        self.assertEqual(gauges.value("state"), 0)
+
+    def test_render(self):
+        counters = Metrics()
+        counters.increment("b_total")
+        counters.increment("a_total", 0.5)
+
+        self.assertEqual(
+            counters.render(),
+            "document_analyzation_service_a_total 0.5\ndocument_analyzation_service_b_total 1\n",
+        )
+
+    def test_labelled(self):
+        self.assertEqual(
+            labelled("bytes_total", document_type="CMR", format="jpeg"),
+            'bytes_total{document_type="CMR",format="jpeg"}',
+        )
+        self.assertEqual(labelled("bytes_total"), "bytes_total")
+
+    def test_disabled_server(self):
+        self.assertIsNone(start_metrics_server(0))
+
+
+class TestMetricsServer(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.reset()
+
+    def test_scrape(self):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        server = start_metrics_server(port)
+        metrics.increment("result_cache_hits_total")
+
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+                body = response.read().decode("utf-8")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertIn("document_analyzation_service_result_cache_hits_total 1", body)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from document_analyzation_service.document_classification.ocr_batcher import OcrBatcher
+
+
+def page(value):
+    return np.full((4, 4, 3), value, dtype=np.uint8)
+
+
+class FakeModel:
+    """Render the value of every page, recording the size of each call."""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def __call__(self, pages):
+        self.batch_sizes.append(len(pages))
+        result = MagicMock()
+        result.pages = [MagicMock(**{"render.return_value": str(p[0, 0, 0])}) for p in pages]
+        return result
+
+
+class TestOcrBatcher(unittest.TestCase):
+    def setUp(self):
+        self.model = FakeModel()
+
+    def test_single_page_calls_without_batching(self):
+        model = MagicMock()
+        model.return_value.render.return_value = "text"
+        batcher = OcrBatcher(lambda: model, max_batch_size=1, max_wait_seconds=1)
+
+        self.assertEqual(batcher.recognize(page(1)), "text")
+        model.assert_called_once()
+
+    def test_concurrent_pages_share_a_batch(self):
+        batcher = OcrBatcher(lambda: self.model, max_batch_size=4, max_wait_seconds=5)
+        texts = {}
+
+        def recognize(value):
+            texts[value] = batcher.recognize(page(value))
+
+        threads = [threading.Thread(target=recognize, args=(value,)) for value in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(texts, {value: str(value) for value in range(4)})
+        self.assertEqual(self.model.batch_sizes, [4])
+
+    def test_partial_batch_runs_after_the_wait(self):
+        batcher = OcrBatcher(lambda: self.model, max_batch_size=8, max_wait_seconds=0.01)
+
+        self.assertEqual(batcher.recognize(page(7)), "7")
+        self.assertEqual(self.model.batch_sizes, [1])
+
+    def test_model_error_is_raised_for_every_page(self):
+        model = MagicMock(side_effect=RuntimeError("OCR failed"))
+        batcher = OcrBatcher(lambda: model, max_batch_size=2, max_wait_seconds=0)
+        first, second = MagicMock(), MagicMock()
+
+        batcher.process_batch([(page(1), first), (page(2), second)])
+
+        first.set_exception.assert_called_once()
+        second.set_exception.assert_called_once()
+        first.set_result.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
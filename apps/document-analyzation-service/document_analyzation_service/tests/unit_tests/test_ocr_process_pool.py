@@ -0,0 +1,92 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+import os
+import sys
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+from document_analyzation_service.document_classification import ocr_process_pool
+from document_analyzation_service.document_classification.ocr_process_pool import OcrProcessPool
+
+
+class FakeResult:
+    def __init__(self, text):
+        self.text = text
+
+    def render(self):
+        return self.text
+
+
+def fake_model(pages):
+    (page,) = pages
+    return FakeResult(f"{page.shape} {int(page.sum())} {os.getpid()}")
+
+
+def get_fake_model():
+    return fake_model
+
+
+def get_broken_model():
+    raise RuntimeError("The weights are missing.")
+
+
+class TestRecognizeSharedPage(unittest.TestCase):
+    def test_page_is_read_from_shared_memory(self):
+        page = np.arange(24, dtype=np.uint8).reshape(2, 4, 3)
+        shared_memory = SharedMemory(create=True, size=page.nbytes)
+        self.addCleanup(shared_memory.unlink)
+        self.addCleanup(shared_memory.close)
+        np.ndarray(page.shape, page.dtype, buffer=shared_memory.buf)[...] = page
+
+        with patch.object(ocr_process_pool, "_worker_model", fake_model):
+            text = ocr_process_pool._recognize_shared_page(
+                shared_memory.name, page.shape, page.dtype.str
+            )
+
+        self.assertTrue(text.startswith(f"(2, 4, 3) {int(page.sum())} "))
+
+    def test_worker_sets_the_torch_threads_and_loads_the_model(self):
+        torch = MagicMock()
+
+        with (
+            patch.dict(sys.modules, {"torch": torch}),
+            patch.object(ocr_process_pool, "_worker_model", None),
+        ):
+            ocr_process_pool._initialize_worker(get_fake_model, 2)
+
+            self.assertIs(ocr_process_pool._worker_model, fake_model)
+        torch.set_num_threads.assert_called_once_with(2)
+
+
+class TestOcrProcessPool(unittest.TestCase):
+    def test_pages_are_recognized_in_a_worker_process(self):
+        pool = OcrProcessPool(get_fake_model, workers=1, torch_threads=0)
+        self.addCleanup(pool.shutdown)
+        page = np.full((8, 8, 3), 2, dtype=np.uint8)
+
+        shape, total, pid = pool.recognize(page).rsplit(" ", 2)
+
+        self.assertEqual(shape, "(8, 8, 3)")
+        self.assertEqual(int(total), page.sum())
+        self.assertNotEqual(int(pid), os.getpid())
+        self.assertFalse(pool.failed)
+
+    def test_pool_is_marked_as_failed_if_the_workers_cannot_start(self):
+        pool = OcrProcessPool(get_broken_model, workers=1, torch_threads=0)
+        self.addCleanup(pool.shutdown)
+
+        with self.assertRaises(BrokenProcessPool):
+            pool.recognize(np.zeros((8, 8, 3), dtype=np.uint8))
+
+        self.assertTrue(pool.failed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,199 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+import httpx
+
+from document_analyzation_service.metrics import labelled, metrics
+from document_analyzation_service.rate_limiter import (
+    BucketCost,
+    LocalRateLimitBackend,
+    RateLimiter,
+    RateLimitQuota,
+    RateLimitTimeout,
+    SqliteRateLimitBackend,
+    create_rate_limit_backend,
+    parse_retry_after,
+    plan_reservation,
+)
+
+
+class TestPlanReservation(unittest.TestCase):
+    def test_new_buckets_start_full(self):
+        wait, states = plan_reservation({}, [BucketCost("tokens", 600, 100)], 1000.0, 10)
+
+        self.assertEqual(wait, 0)
+        self.assertEqual(states["tokens"].level, 500)
+
+    def test_requests_queue_behind_the_reserved_budget(self):
+        # 600 tokens per minute refill 10 tokens per second
+        _, states = plan_reservation({}, [BucketCost("tokens", 600, 600)], 1000.0, 10)
+        wait, states = plan_reservation(states, [BucketCost("tokens", 600, 50)], 1000.0, 10)
+
+        self.assertAlmostEqual(wait, 5)
+        self.assertEqual(states["tokens"].level, -50)
+
+    def test_buckets_refill_over_time(self):
+        _, states = plan_reservation({}, [BucketCost("tokens", 600, 600)], 1000.0, 10)
+        wait, _ = plan_reservation(states, [BucketCost("tokens", 600, 50)], 1005.0, 10)
+
+        self.assertEqual(wait, 0)
+
+    def test_nothing_is_reserved_beyond_the_maximum_wait(self):
+        _, states = plan_reservation({}, [BucketCost("tokens", 600, 600)], 1000.0, 10)
+
+        self.assertIsNone(plan_reservation(states, [BucketCost("tokens", 600, 200)], 1000.0, 10))
+
+
+class TestParseRetryAfter(unittest.TestCase):
+    def test_retry_after_in_seconds_and_milliseconds(self):
+        self.assertEqual(parse_retry_after(httpx.Headers({"Retry-After": "7"}), 100.0), 107.0)
+        self.assertEqual(
+            parse_retry_after(httpx.Headers({"retry-after-ms": "1500"}), 100.0), 101.5
+        )
+
+    def test_retry_after_as_http_date(self):
+        headers = httpx.Headers({"Retry-After": "Thu, 01 Jan 1970 00:02:00 GMT"})
+
+        self.assertEqual(parse_retry_after(headers, 100.0), 120.0)
+
+    def test_missing_or_invalid_retry_after(self):
+        self.assertIsNone(parse_retry_after(httpx.Headers({}), 100.0))
+        self.assertIsNone(parse_retry_after(httpx.Headers({"Retry-After": "soon"}), 100.0))
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "limits", "buckets.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def backends(self):
+        return [LocalRateLimitBackend(), SqliteRateLimitBackend(self.path)]
+
+    @patch("document_analyzation_service.rate_limiter.time.time", return_value=1000.0)
+    def test_requests_wait_for_their_budget(self, mock_time):
+        for backend in self.backends():
+            limiter = RateLimiter(backend, 60, 6000, max_wait_seconds=30)
+
+            self.assertEqual(limiter.reserve(f"{backend}", 5000), 0)
+            # 6000 tokens per minute refill 100 tokens per second
+            self.assertAlmostEqual(limiter.reserve(f"{backend}", 2000), 10)
+            with self.assertRaises(RateLimitTimeout):
+                limiter.reserve(f"{backend}", 3000)
+
+    @patch("document_analyzation_service.rate_limiter.time.time", return_value=1000.0)
+    def test_request_quota_is_limited(self, mock_time):
+        limiter = RateLimiter(LocalRateLimitBackend(), 2, 0, max_wait_seconds=60)
+
+        self.assertEqual(limiter.reserve("deployment", 10**6), 0)
+        self.assertEqual(limiter.reserve("deployment", 10**6), 0)
+        self.assertAlmostEqual(limiter.reserve("deployment", 10**6), 30)
+        self.assertEqual(
+            metrics.value(labelled("rate_limit_throttled_total", scope="deployment")), 1
+        )
+
+    @patch("document_analyzation_service.rate_limiter.time.time", return_value=1000.0)
+    def test_scopes_with_their_own_quota(self, mock_time):
+        limiter = RateLimiter(LocalRateLimitBackend(), 0, 6000, max_wait_seconds=30)
+        small = RateLimitQuota(0, 600)
+
+        self.assertEqual(limiter.reserve("small", 600, small), 0)
+        # 600 tokens per minute refill 10 tokens per second
+        self.assertAlmostEqual(limiter.reserve("small", 100, small), 10)
+        self.assertEqual(limiter.reserve("large", 6000), 0)
+
+    @patch("document_analyzation_service.rate_limiter.time.time", return_value=1000.0)
+    def test_retry_after_blocks_the_scope(self, mock_time):
+        for backend in self.backends():
+            limiter = RateLimiter(backend, 60, 6000, max_wait_seconds=30)
+
+            limiter.observe("deployment", httpx.Headers({"Retry-After": "20"}))
+
+            self.assertAlmostEqual(limiter.reserve("deployment", 1), 20)
+            self.assertEqual(limiter.reserve("other", 1), 0)
+
+    @patch("document_analyzation_service.rate_limiter.time.time", return_value=1000.0)
+    def test_remaining_headers_lower_the_budget(self, mock_time):
+        limiter = RateLimiter(LocalRateLimitBackend(), 60, 6000, max_wait_seconds=30)
+
+        limiter.observe("deployment", httpx.Headers({"x-ratelimit-remaining-tokens": "0"}))
+
+        self.assertAlmostEqual(limiter.reserve("deployment", 500), 5)
+
+    @patch("document_analyzation_service.rate_limiter.time.time", return_value=1000.0)
+    def test_unused_tokens_are_given_back(self, mock_time):
+        limiter = RateLimiter(LocalRateLimitBackend(), 0, 6000, max_wait_seconds=30)
+        limiter.reserve("deployment", 6000)
+
+        limiter.observe("deployment", httpx.Headers({}), estimated_tokens=6000, used_tokens=1000)
+
+        self.assertEqual(limiter.reserve("deployment", 5000), 0)
+
+    @patch("document_analyzation_service.rate_limiter.time.time", return_value=1000.0)
+    def test_released_tokens_are_available_again(self, mock_time):
+        limiter = RateLimiter(LocalRateLimitBackend(), 0, 6000, max_wait_seconds=30)
+        limiter.reserve("deployment", 6000)
+
+        limiter.release("deployment", 6000)
+
+        self.assertEqual(limiter.reserve("deployment", 6000), 0)
+
+    def test_buckets_are_shared_through_the_database(self):
+        with patch("document_analyzation_service.rate_limiter.time.time", return_value=1000.0):
+            RateLimiter(SqliteRateLimitBackend(self.path), 0, 6000, 30).reserve("deployment", 6000)
+
+            self.assertAlmostEqual(
+                RateLimiter(SqliteRateLimitBackend(self.path), 0, 6000, 30).reserve(
+                    "deployment", 1000
+                ),
+                10,
+            )
+
+    @patch("document_analyzation_service.rate_limiter.time.sleep")
+    def test_acquire_sleeps_for_the_wait(self, mock_sleep):
+        limiter = RateLimiter(LocalRateLimitBackend(), 1, 0, max_wait_seconds=120)
+
+        limiter.acquire("deployment", 1)
+        mock_sleep.assert_not_called()
+        limiter.acquire("deployment", 1)
+        self.assertAlmostEqual(mock_sleep.call_args.args[0], 60, delta=1)
+
+    def test_create_custom_backend(self):
+        backend = create_rate_limit_backend(
+            "document_analyzation_service.rate_limiter:LocalRateLimitBackend"
+        )
+
+        self.assertIsInstance(backend, LocalRateLimitBackend)
+
+
+class TestRateLimiterAsync(unittest.IsolatedAsyncioTestCase):
+    async def test_backend_is_not_used_on_the_event_loop(self):
+        limiter = RateLimiter(LocalRateLimitBackend(), 60, 6000, max_wait_seconds=30)
+        threads = []
+        update = limiter.backend.update
+
+        def record_thread(*args):
+            threads.append(threading.get_ident())
+            update(*args)
+
+        with patch.object(limiter.backend, "update", side_effect=record_thread):
+            await limiter.observe_async("deployment", httpx.Headers({"Retry-After": "1"}))
+            await limiter.release_async("deployment", 100)
+
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(threading.get_ident(), threads)
+
+
+if __name__ == "__main__":
+    unittest.main()
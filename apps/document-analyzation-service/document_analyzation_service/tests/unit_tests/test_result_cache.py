@@ -0,0 +1,87 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from document_analyzation_service.result_cache import ResultCache, result_cache_key
+
+
+class TestResultCacheKey(unittest.TestCase):
+    def test_key_is_stable(self):
+        self.assertEqual(
+            result_cache_key("image-hash", "CMR", "gpt-4o", "v1"),
+            result_cache_key("image-hash", "CMR", "gpt-4o", "v1"),
+        )
+
+    def test_key_depends_on_every_part(self):
+        key = result_cache_key("image-hash", "CMR", "gpt-4o", "v1")
+
+        self.assertNotEqual(key, result_cache_key("other-hash", "CMR", "gpt-4o", "v1"))
+        self.assertNotEqual(key, result_cache_key("image-hash", "auto", "gpt-4o", "v1"))
+        self.assertNotEqual(key, result_cache_key("image-hash", "CMR", "gpt-4.1", "v1"))
+        self.assertNotEqual(key, result_cache_key("image-hash", "CMR", "gpt-4o", "v2"))
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "cache", "results.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_put_and_get(self):
+        cache = ResultCache(self.path, ttl_seconds=60, max_entries=10)
+
+        cache.put("key", {"image_analysis_result": {"field": "value"}, "document_type": "CMR"})
+
+        self.assertEqual(
+            cache.get("key"),
+            {"image_analysis_result": {"field": "value"}, "document_type": "CMR"},
+        )
+        self.assertIsNone(cache.get("missing"))
+        cache.close()
+
+    def test_results_are_shared_through_the_database(self):
+        ResultCache(self.path, ttl_seconds=60, max_entries=10).put("key", {"a": 1})
+
+        self.assertEqual(
+            ResultCache(self.path, ttl_seconds=60, max_entries=10).get("key"), {"a": 1}
+        )
+
+    @patch("document_analyzation_service.result_cache.time.time")
+    def test_expired_results_are_not_returned(self, mock_time):
+        cache = ResultCache(self.path, ttl_seconds=60, max_entries=10)
+        mock_time.return_value = 1000.0
+        cache.put("key", {"a": 1})
+
+        mock_time.return_value = 1061.0
+
+        self.assertIsNone(cache.get("key"))
+        self.assertEqual(len(cache), 0)
+
+    @patch("document_analyzation_service.result_cache.time.time")
+    def test_least_recently_used_results_are_evicted(self, mock_time):
+        cache = ResultCache(self.path, ttl_seconds=0, max_entries=2)
+        mock_time.return_value = 1.0
+        cache.put("first", {"a": 1})
+        mock_time.return_value = 2.0
+        cache.put("second", {"a": 2})
+        mock_time.return_value = 3.0
+        cache.get("first")
+        mock_time.return_value = 4.0
+        cache.put("third", {"a": 3})
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("second"))
+        self.assertEqual(cache.get("first"), {"a": 1})
+        self.assertEqual(cache.get("third"), {"a": 3})
+
+
+if __name__ == "__main__":
+    unittest.main()
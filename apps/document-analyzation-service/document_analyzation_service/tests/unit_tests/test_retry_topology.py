@@ -0,0 +1,81 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+import unittest
+
+import pika
+
+from document_analyzation_service.retry_topology import RETRY_ATTEMPT_HEADER, RetryTopology
+
+
+class TestRetryTopology(unittest.TestCase):
+    def setUp(self):
+        self.topology = RetryTopology.exponential("work", levels=3, base_delay_ms=1000)
+
+    def test_exponential_delays(self):
+        self.assertEqual(self.topology.delays_ms, [1000, 2000, 4000])
+
+    def test_queue_arguments(self):
+        queues = self.topology.queue_arguments()
+
+        self.assertEqual(
+            queues["work.retry.1"],
+            {
+                "x-message-ttl": 2000,
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": "work",
+            },
+        )
+        self.assertEqual(queues["work.dead-letter"], {})
+        self.assertEqual(len(queues), 4)
+
+    def test_first_failure_goes_to_first_delay_queue(self):
+        properties = pika.BasicProperties(content_type="image/jpeg", headers={"uuid": "1234"})
+
+        routing_key, retry_properties, exhausted = self.topology.next_destination(properties)
+
+        self.assertEqual(routing_key, "work.retry.0")
+        self.assertFalse(exhausted)
+        self.assertEqual(retry_properties.expiration, "1000")
+        self.assertEqual(retry_properties.content_type, "image/jpeg")
+        self.assertEqual(retry_properties.headers, {"uuid": "1234", RETRY_ATTEMPT_HEADER: 1})
+
+    def test_attempt_header_selects_level(self):
+        properties = pika.BasicProperties(headers={RETRY_ATTEMPT_HEADER: 2})
+
+        routing_key, retry_properties, exhausted = self.topology.next_destination(properties)
+
+        self.assertEqual(routing_key, "work.retry.2")
+        self.assertEqual(retry_properties.headers[RETRY_ATTEMPT_HEADER], 3)
+        self.assertFalse(exhausted)
+
+    def test_exhausted_message_goes_to_dead_letter_queue(self):
+        properties = pika.BasicProperties(headers={RETRY_ATTEMPT_HEADER: 3})
+
+        routing_key, retry_properties, exhausted = self.topology.next_destination(properties)
+
+        self.assertEqual(routing_key, "work.dead-letter")
+        self.assertIsNone(retry_properties.expiration)
+        self.assertTrue(exhausted)
+
+    def test_parked_message_keeps_its_attempt(self):
+        properties = pika.BasicProperties(
+            content_type="image/jpeg", headers={RETRY_ATTEMPT_HEADER: 1}
+        )
+
+        routing_key, park_properties = self.topology.park_destination(properties)
+
+        self.assertEqual(routing_key, "work.retry.2")
+        self.assertEqual(park_properties.expiration, "4000")
+        self.assertEqual(park_properties.content_type, "image/jpeg")
+        self.assertEqual(park_properties.headers[RETRY_ATTEMPT_HEADER], 1)
+
+    def test_attempt_of_without_headers(self):
+        self.assertEqual(RetryTopology.attempt_of(pika.BasicProperties()), 0)
+        self.assertEqual(RetryTopology.attempt_of(None), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
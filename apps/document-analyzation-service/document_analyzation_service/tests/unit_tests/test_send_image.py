@@ -11,7 +11,10 @@ import uuid
 from unittest import mock
 from unittest.mock import MagicMock, patch
 
-from document_analyzation_service.demo.send_image import send_image_to_queue
+from document_analyzation_service.demo.send_image import (
+    send_binary_image_to_queue,
+    send_image_to_queue,
+)
 
 
 class TestSendImageToQueue(unittest.TestCase):
@@ -58,6 +61,31 @@ class TestSendImageToQueue(unittest.TestCase):
         )
         mock_connection.return_value.close.assert_called_once()
 
+    @patch("document_analyzation_service.demo.send_image.pika.BlockingConnection")
+    @patch("document_analyzation_service.demo.send_image.pika.ConnectionParameters")
+    @patch("document_analyzation_service.demo.send_image.pika.PlainCredentials")
+    @patch("builtins.open", new_callable=mock.mock_open)
+    @patch(
+        "document_analyzation_service.demo.send_image.uuid.uuid4",
+        return_value=uuid.UUID("12345678123456781234567812345678"),
+    )
+    def test_send_binary_image_to_queue(
+        self, mock_uuid, mock_open, mock_credentials, mock_parameters, mock_connection
+    ):
+        mock_open.return_value.read.return_value = b"test_image_data"
+        mock_channel = mock_connection.return_value.channel.return_value
+
+        send_binary_image_to_queue("test_image.jpg", "CMR")
+
+        kwargs = mock_channel.basic_publish.call_args.kwargs
+        self.assertEqual(kwargs["body"], b"test_image_data")
+        self.assertEqual(kwargs["properties"].content_type, "image/jpeg")
+        self.assertEqual(
+            kwargs["properties"].headers,
+            {"uuid": "12345678-1234-5678-1234-567812345678", "document_type": "CMR"},
+        )
+        mock_connection.return_value.close.assert_called_once()
+
 
 if __name__ == "__main__":
     unittest.main()
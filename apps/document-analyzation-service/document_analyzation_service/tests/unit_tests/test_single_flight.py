@@ -0,0 +1,174 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from document_analyzation_service.metrics import metrics
+from document_analyzation_service.single_flight import (
+    AsyncSingleFlight,
+    SingleFlight,
+    content_key,
+)
+
+
+class TestContentKey(unittest.TestCase):
+    def test_key_depends_on_parts(self):
+        self.assertEqual(content_key(b"image", "CMR"), content_key(b"image", "CMR"))
+        self.assertNotEqual(content_key(b"image", "CMR"), content_key(b"image", "Pallet Note"))
+        self.assertNotEqual(content_key("ab", "c"), content_key("a", "bc"))
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.flights = SingleFlight("test")
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def tearDown(self):
+        metrics.reset()
+
+    def compute(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        return {"field": "value"}
+
+    def wait_for_followers(self, count):
+        for _ in range(500):
+            if metrics.value("test_coalesced_total") >= count:
+                return
+            threading.Event().wait(0.01)
+
+    def test_concurrent_calls_share_one_computation(self):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            leader = executor.submit(self.flights.do, "key", self.compute)
+            self.started.wait(5)
+            followers = [executor.submit(self.flights.do, "key", self.compute) for _ in range(3)]
+            self.wait_for_followers(3)
+            self.release.set()
+
+            results = [leader.result(5)] + [follower.result(5) for follower in followers]
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [{"field": "value"}] * 4)
+        self.assertEqual(metrics.value("test_coalesced_total"), 3)
+        self.assertEqual(self.flights.in_flight(), 0)
+
+    def test_exception_is_shared_with_followers(self):
+        def fail():
+            self.started.set()
+            self.release.wait(5)
+            raise ValueError("Azure unavailable")
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            leader = executor.submit(self.flights.do, "key", fail)
+            self.started.wait(5)
+            follower = executor.submit(self.flights.do, "key", fail)
+            self.wait_for_followers(1)
+            self.release.set()
+
+            with self.assertRaises(ValueError):
+                leader.result(5)
+            with self.assertRaises(ValueError):
+                follower.result(5)
+
+    def test_sequential_calls_compute_again(self):
+        self.release.set()
+
+        self.flights.do("key", self.compute)
+        self.flights.do("key", self.compute)
+
+        self.assertEqual(self.calls, 2)
+
+    def test_different_keys_are_not_coalesced(self):
+        self.release.set()
+
+        self.flights.do("first", self.compute)
+        self.flights.do("second", self.compute)
+
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(metrics.value("test_coalesced_total"), 0)
+
+
+class TestAsyncSingleFlight(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.reset()
+
+    async def test_concurrent_coroutines_share_one_computation(self):
+        flights = AsyncSingleFlight("test")
+        calls = 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(*(flights.do("key", compute) for _ in range(5)))
+
+        self.assertEqual(calls, 1)
+        self.assertEqual(results, ["result"] * 5)
+        self.assertEqual(metrics.value("test_coalesced_total"), 4)
+
+    async def test_exception_is_shared_with_followers(self):
+        flights = AsyncSingleFlight("test")
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("Azure unavailable")
+
+        results = await asyncio.gather(
+            *(flights.do("key", fail) for _ in range(3)), return_exceptions=True
+        )
+
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    async def test_followers_compute_again_if_the_leader_is_cancelled(self):
+        flights = AsyncSingleFlight("test")
+        calls = 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "result"
+
+        leader = asyncio.create_task(flights.do("key", compute))
+        await asyncio.sleep(0)
+        followers = [asyncio.create_task(flights.do("key", compute)) for _ in range(2)]
+        await asyncio.sleep(0)
+        leader.cancel()
+
+        self.assertEqual(await asyncio.gather(*followers), ["result", "result"])
+        self.assertTrue(leader.cancelled())
+        self.assertEqual(calls, 2)
+
+    async def test_cancelled_follower_does_not_cancel_the_leader(self):
+        flights = AsyncSingleFlight("test")
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            return "result"
+
+        leader = asyncio.create_task(flights.do("key", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("key", compute))
+        await asyncio.sleep(0)
+        follower.cancel()
+
+        self.assertEqual(await leader, "result")
+        self.assertTrue(follower.cancelled())
+
+
+if __name__ == "__main__":
+    unittest.main()
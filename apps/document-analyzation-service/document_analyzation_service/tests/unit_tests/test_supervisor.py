@@ -0,0 +1,136 @@
+# Copyright Fraunhofer Institute for Material Flow and Logistics
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# For details on the licensing terms, see the LICENSE file.
+# SPDX-License-Identifier: Apache-2.0
+import unittest
+from unittest.mock import MagicMock, patch
+
+from document_analyzation_service.supervisor import (
+    RecyclingCallback,
+    WorkerSupervisor,
+    current_rss_bytes,
+    run_worker,
+)
+
+
+class TestRecyclingCallback(unittest.TestCase):
+    def setUp(self):
+        self.receiver = MagicMock()
+        self.callback = MagicMock()
+
+    def test_stop_requested_after_max_messages(self):
+        recycling_callback = RecyclingCallback(self.receiver, self.callback, max_messages=2)
+
+        recycling_callback("ch", "method", "properties", "body")
+        self.receiver.request_stop.assert_not_called()
+        recycling_callback("ch", "method", "properties", "body")
+        recycling_callback("ch", "method", "properties", "body")
+
+        self.assertEqual(self.callback.call_count, 3)
+        self.receiver.request_stop.assert_called_once()
+
+    @patch("document_analyzation_service.supervisor.current_rss_bytes", return_value=2048)
+    def test_stop_requested_when_rss_exceeds_limit(self, mock_rss):
+        recycling_callback = RecyclingCallback(self.receiver, self.callback, max_rss_bytes=1024)
+
+        recycling_callback("ch", "method", "properties", "body")
+
+        self.receiver.request_stop.assert_called_once()
+
+    def test_messages_are_counted_when_callback_fails(self):
+        self.callback.side_effect = Exception("failure")
+        recycling_callback = RecyclingCallback(self.receiver, self.callback, max_messages=1)
+
+        with self.assertRaises(Exception):
+            recycling_callback("ch", "method", "properties", "body")
+
+        self.receiver.request_stop.assert_called_once()
+
+    def test_unlimited_worker_is_never_stopped(self):
+        recycling_callback = RecyclingCallback(self.receiver, self.callback)
+
+        for _ in range(10):
+            recycling_callback("ch", "method", "properties", "body")
+
+        self.receiver.request_stop.assert_not_called()
+
+
+class TestWorkerSupervisor(unittest.TestCase):
+    def setUp(self):
+        self.supervisor = WorkerSupervisor(worker_count=2, restart_delay=0)
+        self.supervisor._context = MagicMock()
+
+    def test_start_worker(self):
+        self.supervisor.start_worker(0)
+
+        process = self.supervisor._context.Process
+        process.assert_called_once()
+        process.return_value.start.assert_called_once()
+        self.assertIs(self.supervisor.workers[0], process.return_value)
+
+    @patch("document_analyzation_service.supervisor.time.sleep")
+    def test_check_workers_restarts_crashed_and_recycled_workers(self, mock_sleep):
+        alive_worker = MagicMock(exitcode=None)
+        alive_worker.is_alive.return_value = True
+        crashed_worker = MagicMock(exitcode=1)
+        crashed_worker.is_alive.return_value = False
+        self.supervisor.workers = {0: alive_worker, 1: crashed_worker}
+
+        self.supervisor.check_workers()
+
+        alive_worker.join.assert_not_called()
+        crashed_worker.join.assert_called_once()
+        mock_sleep.assert_called_once_with(0)
+        self.assertIs(self.supervisor.workers[1], self.supervisor._context.Process.return_value)
+
+        recycled_worker = MagicMock(exitcode=0)
+        recycled_worker.is_alive.return_value = False
+        self.supervisor.workers = {0: recycled_worker}
+        mock_sleep.reset_mock()
+
+        self.supervisor.check_workers()
+
+        mock_sleep.assert_not_called()
+        self.assertIs(self.supervisor.workers[0], self.supervisor._context.Process.return_value)
+
+    @patch("document_analyzation_service.supervisor.os.kill")
+    def test_stop_terminates_workers(self, mock_kill):
+        worker = MagicMock(pid=1234)
+        worker.is_alive.side_effect = [True, False]
+        self.supervisor.workers = {0: worker}
+
+        self.supervisor.stop(timeout=1)
+
+        mock_kill.assert_called_once()
+        worker.join.assert_called_once()
+        worker.kill.assert_not_called()
+
+
+class TestRunWorker(unittest.TestCase):
+    @patch("document_analyzation_service.supervisor.CONSUMER_WORKER_COUNT", 0)
+    @patch("document_analyzation_service.supervisor.classification.shutdown_ocr_workers")
+    @patch("document_analyzation_service.supervisor.close_publisher")
+    @patch("document_analyzation_service.supervisor.signal.signal")
+    @patch("document_analyzation_service.supervisor.create_receiver")
+    def test_worker_acknowledges_messages_after_processing(
+        self, mock_create_receiver, mock_signal, mock_close_publisher, mock_shutdown
+    ):
+        receiver = mock_create_receiver.return_value
+        receiver.start_listening.side_effect = KeyboardInterrupt
+
+        run_worker(max_messages=10, max_rss_bytes=0)
+
+        # A worker thread with a prefetch of one message, instead of acknowledging on delivery
+        mock_create_receiver.assert_called_once_with(1, 1)
+        receiver.stop.assert_called_once()
+        mock_shutdown.assert_called_once()
+
+
+class TestCurrentRssBytes(unittest.TestCase):
+    def test_current_rss_bytes_is_positive(self):
+        self.assertGreater(current_rss_bytes(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
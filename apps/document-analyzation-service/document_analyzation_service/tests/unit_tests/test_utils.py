@@ -13,9 +13,9 @@ import pytest
 from PIL import Image
 
 from document_analyzation_service.utils import (
-    image_to_data_url,
     local_image_to_data_url,
     make_serializable,
+    sniff_image_mime_type,
 )
 
 
@@ -54,29 +54,20 @@ def test_local_image_to_data_url_with_nonexistent_file():
         local_image_to_data_url(image_path)
 
 
-def test_image_to_data_url_with_valid_image():
-    image = Image.new("RGB", (10, 10), color="red")
-    mime_type = "image/jpeg"
+@pytest.mark.parametrize(
+    "image_format, mime_type",
+    [("JPEG", "image/jpeg"), ("PNG", "image/png"), ("GIF", "image/gif"), ("WEBP", "image/webp")],
+)
+def test_sniff_image_mime_type(image_format, mime_type):
     buffered = io.BytesIO()
-    image.save(buffered, format="JPEG")
-    base64_encoded_data = base64.b64encode(buffered.getvalue()).decode("utf-8")
-    expected_data_url = f"data:{mime_type};base64,{base64_encoded_data}"
-
-    expected = expected_data_url.split(",")[1]
-    actual = image_to_data_url(image).split(",")[1]
-    assert expected == actual
+    Image.new("RGB", (10, 10), color="red").save(buffered, format=image_format)
 
+    assert sniff_image_mime_type(buffered.getvalue()) == mime_type
 
-def test_image_to_data_url_with_unknown_format():
-    image = Image.new("RGB", (10, 10), color="red")
-    image.format = None
-    mime_type = "application/octet-stream"
-    buffered = io.BytesIO()
-    image.save(buffered, format="JPEG")
-    base64_encoded_data = base64.b64encode(buffered.getvalue()).decode("utf-8")
-    expected_data_url = f"data:{mime_type};base64,{base64_encoded_data}"
 
-    assert image_to_data_url(image) == expected_data_url
+def test_sniff_image_mime_type_with_unknown_data():
+    assert sniff_image_mime_type(b"BM not sniffed") is None
+    assert sniff_image_mime_type(b"") is None
 
 
 def test_make_serializable_with_dict():
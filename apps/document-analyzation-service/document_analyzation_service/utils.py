@@ -7,14 +7,14 @@
 """This module provides utility functions for image processing and serialization."""
 
 import base64
-import io
 import os
 from enum import Enum
 from mimetypes import guess_type
 from pathlib import Path
 from typing import AnyStr
 
-from PIL.Image import Image
+# Image formats the LLM accepts as they are, GIF is excluded as animated GIFs are rejected
+LLM_IMAGE_MIME_TYPES = ("image/jpeg", "image/png", "image/webp")
 
 
 class DocumentType(Enum):
@@ -47,31 +47,46 @@ def local_image_to_data_url(image_path: str) -> str:
     return f"data:{mime_type};base64,{base64_encoded_data}"
 
 
-def image_to_data_url(image: Image) -> str:
-    """Convert a PIL.Image object to a data URL.
+def sniff_image_mime_type(image_data: bytes) -> str | None:
+    """Determine the MIME type of an encoded image from its magic bytes.
 
     Args:
     ----------
-    image : Image
-        The PIL Image object to be converted.
+    image_data : bytes
+        The encoded image.
 
     Returns:
     -------
-    str
-        The data URL representation of the image.
+    str | None
+        The MIME type of a JPEG, PNG, GIF or WebP image, None for any other data.
     """
-    # MIME-Typ anhand des Bildformats bestimmen
-    mime_type = f"image/{image.format.lower()}" if image.format else "application/octet-stream"
+    if image_data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if image_data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if image_data.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if image_data[:4] == b"RIFF" and image_data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
 
-    # Bild in einen BytesIO-Stream schreiben und als Base64 kodieren
-    buffered = io.BytesIO()
-    image.save(
-        buffered, format=image.format or "JPEG"
-    )  # Standardmäßig JPEG, falls Format unbekannt
-    base64_encoded_data = base64.b64encode(buffered.getvalue()).decode("utf-8")
 
-    # Data-URL erstellen
-    return f"data:{mime_type};base64,{base64_encoded_data}"
+def bytes_to_data_url(image_data: bytes, mime_type: str) -> str:
+    """Base64-encode already encoded image bytes into a data URL, without decoding them.
+
+    Args:
+    ----------
+    image_data : bytes
+        The encoded image.
+    mime_type : str
+        The MIME type of the image.
+
+    Returns:
+    -------
+    str
+        The data URL representation of the image.
+    """
+    return f"data:{mime_type};base64,{base64.b64encode(image_data).decode('utf-8')}"
 
 
 def make_serializable(obj: object) -> object: